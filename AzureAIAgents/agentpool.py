@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import concurrent.futures
+from collections import deque
+
+
+def agent_fingerprint(model, instructions, toolset=None):
+    """
+    Hashes everything that defines an agent's behaviour: model, instructions and tools.
+
+    :return: A hex digest that is stable across processes.
+    :rtype: str
+    """
+    definitions = []
+    resources = None
+    if toolset is not None:
+        # user_functions is a set, so sort the definitions to get the same hash in every process
+        definitions = sorted(json.dumps(definition.as_dict(), sort_keys=True) for definition in toolset.definitions)
+        resources = toolset.resources.as_dict() if toolset.resources else None
+    # Indentation differences in the instructions shouldn't create a new agent
+    normalized_instructions = "\n".join(line.strip() for line in instructions.strip().splitlines())
+    payload = json.dumps({"model": model, "instructions": normalized_instructions,
+                          "tools": definitions, "tool_resources": resources}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AgentRegistry:
+    """
+    Reuses agents across sessions and processes instead of creating one per chat.
+
+    Agents are created with their fingerprint in ``metadata`` and found again
+    with list_agents, so a restarted process picks up the agent it created
+    before, and several worker processes end up sharing one agent. Lookups
+    after the first one are served from memory.
+    """
+
+    def __init__(self, project_client):
+        self.project_client = project_client
+        self._agents = {}
+        self._lock = threading.Lock()
+
+    def _find(self, fingerprint):
+        # Workers starting together may each create the agent; all of them settle on the oldest one
+        matches = []
+        after = None
+        while True:
+            page = self.project_client.agents.list_agents(limit=100, after=after)
+            matches.extend(agent for agent in page.data if (agent.metadata or {}).get("fingerprint") == fingerprint)
+            if not page.has_more:
+                return min(matches, key=lambda agent: (agent.created_at, agent.id)) if matches else None
+            after = page.last_id
+
+    def get_or_create(self, model, name, instructions, toolset=None):
+        """
+        Returns an agent for the model, instructions and toolset, creating it only if none exists.
+
+        :rtype: Agent
+        """
+        fingerprint = agent_fingerprint(model, instructions, toolset)
+        with self._lock:
+            agent = self._agents.get(fingerprint)
+            if agent is not None:
+                return agent
+
+            agent = self._find(fingerprint)
+            if agent is not None:
+                print(f"Reusing agent, ID: {agent.id}")
+                if toolset is not None:
+                    # Register the local function implementations for this agent with the SDK
+                    agent = self.project_client.agents.update_agent(agent.id, toolset=toolset)
+            else:
+                agent = self.project_client.agents.create_agent(
+                    model=model,
+                    name=name,
+                    instructions=instructions,
+                    toolset=toolset,
+                    metadata={"fingerprint": fingerprint},
+                )
+                print(f"Created agent, ID: {agent.id}")
+                # Another worker may have created the same agent meanwhile; keep the oldest
+                oldest = self._find(fingerprint)
+                if oldest is not None and oldest.id != agent.id:
+                    self.project_client.agents.delete_agent(agent.id)
+                    print(f"Deleted duplicate agent {agent.id}, reusing {oldest.id}")
+                    agent = oldest
+                    if toolset is not None:
+                        agent = self.project_client.agents.update_agent(agent.id, toolset=toolset)
+
+            self._agents[fingerprint] = agent
+            return agent
+
+
+class ThreadPool:
+    """
+    Keeps pre-created agent threads ready so a new session gets one without a round-trip.
+
+    Threads hold a conversation, so each one belongs to a single session. A
+    released thread is deleted in the background, and session threads idle for
+    longer than ``idle_timeout`` seconds are reclaimed.
+    """
+
+    def __init__(self, project_client, size=int(os.getenv("AGENT_THREAD_POOL_SIZE") or 4),
+                 idle_timeout=float(os.getenv("AGENT_THREAD_IDLE_TIMEOUT") or 7200)):
+        self.project_client = project_client
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._ready = deque()
+        self._in_use = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="agent-threads")
+
+    def _create(self):
+        try:
+            thread = self.project_client.agents.create_thread()
+            with self._lock:
+                self._ready.append(thread.id)
+        except Exception as e:
+            print(f"Failed to pre-create thread: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _delete(self, thread_id):
+        try:
+            self.project_client.agents.delete_thread(thread_id)
+        except Exception as e:
+            print(f"Failed to delete thread {thread_id}: {e}")
+
+    def fill(self):
+        """
+        Tops the pool up to its size in the background and reclaims idle session threads.
+        """
+        now = time.monotonic()
+        with self._lock:
+            idle = [thread_id for thread_id, last_used in self._in_use.items()
+                    if now - last_used > self.idle_timeout]
+            for thread_id in idle:
+                del self._in_use[thread_id]
+            missing = self.size - len(self._ready) - self._pending
+            self._pending += max(missing, 0)
+        for thread_id in idle:
+            print(f"Reclaiming idle thread, ID: {thread_id}")
+            self._executor.submit(self._delete, thread_id)
+        for _ in range(missing):
+            self._executor.submit(self._create)
+
+    def acquire(self):
+        """
+        Returns a thread id for a new session, from the pool when one is ready.
+
+        :rtype: str
+        """
+        with self._lock:
+            thread_id = self._ready.popleft() if self._ready else None
+        if thread_id is None:
+            thread_id = self.project_client.agents.create_thread().id
+        with self._lock:
+            self._in_use[thread_id] = time.monotonic()
+        self.fill()
+        return thread_id
+
+    def touch(self, thread_id):
+        """
+        Marks a session thread as active; returns a fresh thread if it was reclaimed.
+
+        :rtype: str
+        """
+        with self._lock:
+            if thread_id in self._in_use:
+                self._in_use[thread_id] = time.monotonic()
+                return thread_id
+        return self.acquire()
+
+    def swap(self, old_thread_id, new_thread_id):
+        """
+        Hands a session over to a thread created outside the pool (e.g. by history compaction).
+        """
+        with self._lock:
+            self._in_use[new_thread_id] = time.monotonic()
+        self.release(old_thread_id)
+
+    def release(self, thread_id):
+        with self._lock:
+            known = self._in_use.pop(thread_id, None) is not None
+        if known:
+            self._executor.submit(self._delete, thread_id)
+
+    def stats(self):
+        with self._lock:
+            return {"ready": len(self._ready), "in_use": len(self._in_use), "pending": self._pending}
@@ -1,14 +1,53 @@
-import chainlit as cl
 import json
 from typing import Any, Callable, Set, Dict, List, Optional
-import os, time
-from azure.ai.projects import AIProjectClient
-from azure.identity import DefaultAzureCredential
-from azure.ai.projects.models import FunctionTool, ToolSet, AzureAISearchTool, AzureAISearchQueryType
-from azure.ai.projects.models import FunctionTool, ToolSet, RequiredFunctionToolCall, SubmitToolOutputsAction, ToolOutput
+import os
+import sys
+# telemetry.py and contextpacker.py are kept once, in AzureCosmosDB; appended so this folder's modules come first
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "AzureCosmosDB"))
+from dotenv import load_dotenv
+# warmup and telemetry read their settings at import, so .env is loaded before them
+load_dotenv()
+from warmup import boot, build_credential, project_scopes, warm_tokenizer
+
+# Startup is timed phase by phase and reported once the agent is ready
+with boot.phase("imports"):
+    import chainlit as cl
+    from azure.ai.projects import AIProjectClient
+    from azure.ai.projects.models import FunctionTool, AzureAISearchTool, AzureAISearchQueryType
+    from streaming import stream_agent
+    from rundriver import memoize_tool, ConcurrentToolSet
+    from agentpool import AgentRegistry, ThreadPool
+    from history import project_summarizer
+    from sessions import ChatSession
+    from telemetry import span, traced, record_usage, log, start_metrics_server
+
+# Stream run events when possible; set AGENT_STREAMING=false to poll the run instead
+agent_streaming = os.getenv("AGENT_STREAMING", "true").lower() != "false"
+
+project_connection_string = os.getenv("PROJECT_CONNECTION_STRING")
+# Pick the credential once and fetch its tokens before the first user connects
+with boot.phase("credential"):
+    credential = build_credential()
+    credential.warm(*project_scopes)
+# Create an Azure AI Client from a connection string, copied from your Azure AI Foundry project.    
+with boot.phase("client"):
+    project_client = AIProjectClient.from_connection_string(
+        credential=credential,
+        conn_str=project_connection_string,
+    )
+
+# Agents are shared across sessions; each session gets its own thread from the pool
+agent_registry = AgentRegistry(project_client)
+thread_pool = ThreadPool(project_client)
+thread_pool.fill()
+# Summarizes old turns when HISTORY_COMPACTION=summarize
+summarize = project_summarizer(project_client)
+# Prometheus metrics on METRICS_PORT, when set
+start_metrics_server()
 
 
 # Define the function to fetch weather information
+@memoize_tool(ttl=300)
 def fetch_weather(location: str) -> str:
     """
     Fetches the weather information for the specified location.
@@ -29,6 +68,7 @@ def fetch_weather(location: str) -> str:
     return weather_json
 
 # Define the function to fetch restaurant information
+@memoize_tool(ttl=300)
 def fetch_restaurant(location: str) -> str:
     """
     Fetches the restaurant information for the specified location.
@@ -49,6 +89,7 @@ def fetch_restaurant(location: str) -> str:
     return restaurant_json
 
 # Define the function to fetch budget information
+@memoize_tool(ttl=300)
 def fetch_budget() -> str:
     """
     Fetches the budget information for the specified location.
@@ -107,102 +148,37 @@ def reformat_citations(content_block):
     return paragraph
 
 # Define the function to run the agent
-def run_agent(user_input, project_client, thread, agent): 
+@traced("run_agent")
+async def run_agent(user_input, project_client, session): 
 
     functions = FunctionTool(user_functions)
+    agent_response = ""
 
-    # Add a message to the thread  
-    message = project_client.agents.create_message(
-        thread_id=thread.id,
-        role="user",
-        content=user_input,
-    )
-    print(f"Created message, ID: {message.id}")
-
-    # Step 4: Run the agent
-    run = project_client.agents.create_run(thread_id=thread.id, agent_id=agent.id)
-    print(f"Created run, ID: {run.id}")
-
-    # Step 5: Check the Run Status
-    while run.status in ["queued", "in_progress", "requires_action"]:
-        time.sleep(1)
-        run = project_client.agents.get_run(thread_id=thread.id, run_id=run.id)
-
-        # Print the current status of the run
-        print(f"Current run status: {run.status}")
-
-        if run.status == "requires_action" and isinstance(run.required_action, SubmitToolOutputsAction):
-            tool_calls = run.required_action.submit_tool_outputs.tool_calls
-            if not tool_calls:
-                print("No tool calls provided - cancelling run")
-                project_client.agents.cancel_run(thread_id=thread.id, run_id=run.id)
-                break
-
-            tool_outputs = []
-            for tool_call in tool_calls:
-                if isinstance(tool_call, RequiredFunctionToolCall):
-                    try:
-                        print(f"Executing tool call: {tool_call}")
-                        output = functions.execute(tool_call)
-                        tool_outputs.append(
-                            ToolOutput(
-                                tool_call_id=tool_call.id,
-                                output=output,
-                            )
-                        )
-                    except Exception as e:
-                        print(f"Error executing tool_call {tool_call.id}: {e}")
-
-            print(f"Tool outputs: {tool_outputs}")
-            if tool_outputs:
-                project_client.agents.submit_tool_outputs_to_run(
-                    thread_id=thread.id, run_id=run.id, tool_outputs=tool_outputs
-                )
-    
-        if run.status == "failed":
-            print(f"Run failed: {run.last_error}")
-
-        # Step 6: Display the Agent's Response
-        elif run.status == 'completed':
-            # Fetch all messages in the thread
-            messages = project_client.agents.list_messages(thread_id=thread.id)
-            if messages.data:
-                agent_message = messages.data[0]  # Get the last assistant message
-                content_block = agent_message.content[0].text
-
-                # Check if there are annotations before reformatting the response
-                if content_block.get("annotations"):
-                    # Reformat the response to replace placeholders with citation titles
-                    agent_response = reformat_citations(content_block)
-                else:
-                    agent_response = content_block["value"]
+    # Steps 3 to 5: add the message, create the run and poll it, executing tool calls as requested
+    run, agent_message = await session.run_turn(project_client, user_input, functions)
+    record_usage(run.usage, "agent")
 
-                print(f"Agent Response: {agent_response}")
-            else:
-                print("No messages found.")
-    
-    return agent_response
+    if run.status == "failed":
+        log("run_failed", level="error", run_id=run.id, error=run.last_error)
 
-# Define the function to delete the agent
-def delete_agent(project_client, agent):
-    # Delete the agent when done
-    project_client.agents.delete_agent(agent.id)
-    print("Deleted agent")
-    
+    # Step 6: Display the Agent's Response
+    elif run.status == 'completed':
+        if agent_message is not None:
+            content_block = agent_message.content[0].text
 
-@cl.on_chat_start
-def on_chat_start():
+            # Check if there are annotations before reformatting the response
+            if content_block.get("annotations"):
+                # Reformat the response to replace placeholders with citation titles
+                agent_response = reformat_citations(content_block)
+            else:
+                agent_response = content_block["value"]
+        else:
+            log("no_agent_message", level="warning", run_id=run.id)
     
-    global project_client
-    global agent
-    global thread
+    return agent_response
 
-    project_connection_string = os.getenv("PROJECT_CONNECTION_STRING")
-    # Create an Azure AI Client from a connection string, copied from your Azure AI Foundry project.    
-    project_client = AIProjectClient.from_connection_string(
-        credential=DefaultAzureCredential(),
-        conn_str=project_connection_string,
-    )
+# Define the function to get the agent, once per process
+def get_agent():
 
     # Initialize agent AI search tool and add the search index connection ID and index name
     connection_id = os.getenv("PROJECT_CONNECTION_ID_AZURE_AI_SEARCH")
@@ -216,12 +192,12 @@ def on_chat_start():
 
     # Initialize agent toolset with user functions
     functions = FunctionTool(user_functions)
-    toolset = ToolSet()
+    toolset = ConcurrentToolSet()
     toolset.add(functions)
     toolset.add(ai_search)
     
-    # Create a new agent with the toolset
-    agent = project_client.agents.create_agent(
+    # Reuse the agent for this model, instructions and toolset; it is only created the first time
+    return agent_registry.get_or_create(
         model="gpt-4o", 
         name="my-chainlit-agent", 
         instructions="""
@@ -232,29 +208,71 @@ def on_chat_start():
         toolset=toolset
     )
 
-    print(f"Created agent, ID: {agent.id}")
+# Get the agent before the first user connects; this also opens the connection to the project
+with boot.phase("agent"):
+    agent = get_agent()
+with boot.phase("tokenizer"):
+    warm_tokenizer()
+boot.report()
+
+
+@cl.on_chat_start
+async def on_chat_start():
 
-    # Create a new thread for the agent
-    thread = project_client.agents.create_thread()
-    print(f"Created thread, ID: {thread.id}")
+    # Take a ready thread from the pool; the thread and agent id live in this session only
+    cl.user_session.set("session", await ChatSession.start(thread_pool, agent.id))
     
     print("A new chat session has started!")
 
 @cl.on_message
 async def main(message: cl.Message):
 
-    # Call the agent with the user's message
-    agent_response = run_agent(message.content, project_client, thread, agent)
-    
-    # Send a response back to the user
-    await cl.Message(
-        content=agent_response,
-    ).send()
+    session = cl.user_session.get("session")
+    # One run at a time per thread: a second message waits for the first answer
+    async with session.lock:
+        if not agent_streaming:
+            # Call the agent with the user's message and wait for the complete answer
+            agent_response = await run_agent(message.content, project_client, session)
+            await cl.Message(
+                content=agent_response,
+            ).send()
+            await session.compact(project_client, summarize)
+            return
+
+        history = await session.history_for_turn()
+        thread_id = history.thread_id
+
+        # Call the agent with the user's message and stream its answer as it is generated
+        # The same run_agent stage as the non-streaming path, timed until the answer is complete
+        with span("run_agent", streaming=True):
+            stream = await cl.make_async(stream_agent)(message.content, project_client, thread_id, session.agent_id, history)
+            response_message = cl.Message(content="")
+            async for delta in stream.stream_async():
+                await response_message.stream_token(delta)
+
+            # Replace citation placeholders once the full message is available
+            if stream.message and stream.message.content:
+                content_block = stream.message.content[0].text
+                if content_block.get("annotations"):
+                    response_message.content = reformat_citations(content_block)
+
+        # Send a response back to the user
+        await response_message.send()
+
+        # The stream already delivered the completed message; no need to list the thread
+        if stream.message is not None:
+            history.record(stream.message)
+        await session.compact(project_client, summarize)
+
+        log("run_finished", thread_id=thread_id, ttft_ms=stream.ttft_ms,
+            tokens_per_second=stream.tokens_per_second, timings_ms=stream.timings.as_dict())
 
 @cl.on_chat_end
 def on_chat_end():
-    # Delete the agent when done
-    delete_agent(project_client, agent)
+    # The agent is shared across sessions; only this session's thread is released
+    session = cl.user_session.get("session")
+    if session is not None:
+        session.end()
     print("The user disconnected!")
 
 @cl.set_starters
@@ -1,13 +1,54 @@
-import chainlit as cl
 import json
 from typing import Any, Callable, Set, Dict, List, Optional
 import os
-from azure.ai.projects import AIProjectClient
-from azure.identity import DefaultAzureCredential
-from azure.ai.projects.models import FunctionTool, ToolSet, AzureAISearchTool, AzureAISearchQueryType
+import sys
+# telemetry.py and contextpacker.py are kept once, in AzureCosmosDB; appended so this folder's modules come first
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "AzureCosmosDB"))
+from dotenv import load_dotenv
+# warmup and telemetry read their settings at import, so .env is loaded before them
+load_dotenv()
+from warmup import boot, build_credential, project_scopes, warm_tokenizer
+
+# Startup is timed phase by phase and reported once the agent is ready
+with boot.phase("imports"):
+    import chainlit as cl
+    from azure.ai.projects import AIProjectClient
+    from azure.ai.projects.models import FunctionTool
+    from rundriver import memoize_tool, ConcurrentToolSet
+    from agentpool import AgentRegistry, ThreadPool
+    from history import project_summarizer
+    from sessions import ChatSession
+    from telemetry import traced, record_usage, log, start_metrics_server
+    from productsearch import ProductRetrievalService
+
+project_connection_string = os.getenv("PROJECT_CONNECTION_STRING")
+# Pick the credential once and fetch its tokens before the first user connects
+with boot.phase("credential"):
+    credential = build_credential()
+    credential.warm(*project_scopes)
+# Create an Azure AI Client from a connection string, copied from your Azure AI Foundry project.    
+with boot.phase("client"):
+    project_client = AIProjectClient.from_connection_string(
+        credential=credential,
+        conn_str=project_connection_string,
+    )
+
+# Agents are shared across sessions; each session gets its own thread from the pool
+agent_registry = AgentRegistry(project_client)
+thread_pool = ThreadPool(project_client)
+thread_pool.fill()
+# Summarizes old turns when HISTORY_COMPACTION=summarize
+summarize = project_summarizer(project_client)
+# Prometheus metrics on METRICS_PORT, when set
+start_metrics_server()
+
+# Built once at startup and shared by every fetch_product_info call
+with boot.phase("product_service"):
+    product_service = ProductRetrievalService()
 
 
 # Define the function to fetch weather information
+@memoize_tool(ttl=300)
 def fetch_weather(location: str) -> str:
     """
     Fetches the weather information for the specified location.
@@ -28,6 +69,7 @@ def fetch_weather(location: str) -> str:
     return weather_json
 
 # Define the function to fetch restaurant information
+@memoize_tool(ttl=300)
 def fetch_restaurant(location: str) -> str:
     """
     Fetches the restaurant information for the specified location.
@@ -48,6 +90,7 @@ def fetch_restaurant(location: str) -> str:
     return restaurant_json
 
 # Define the function to fetch budget information
+@memoize_tool(ttl=300)
 def fetch_budget() -> str:
     """
     Fetches the budget information for the specified location.
@@ -83,77 +126,8 @@ def fetch_product_info(userquery: str) -> str:
     :rtype: str
     """
 
-    from azure.search.documents import SearchClient
-    from azure.search.documents.models import VectorizableTextQuery
-    from azure.core.credentials import AzureKeyCredential
-    from openai import AzureOpenAI
-
-    azure_search_service_admin_key = os.getenv("AZURE_SEARCH_ADMIN_KEY")
-    azure_search_service_endpoint = os.getenv("AZURE_SEARCH_SERVICE_ENDPOINT")
-    azure_search_service_index_name = os.getenv("AZURE_SEARCH_INDEX_NAME")
-    azure_openai_api_version = os.getenv("AZURE_OPENAI_API_VERSION")
-    azure_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-    azure_openai_key = os.getenv("AZURE_OPENAI_API_KEY")
-    azure_openai_deployment = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME")
-
-    # Get credential from Azure AI Search Admin key
-    credential = AzureKeyCredential(azure_search_service_admin_key)
-    search_client = SearchClient(endpoint=azure_search_service_endpoint, 
-                                credential=credential, 
-                                index_name=azure_search_service_index_name)
-
-    # Azure OpenAI client
-    openai_client = AzureOpenAI(
-        api_version=azure_openai_api_version,
-        azure_endpoint=azure_openai_endpoint,
-        api_key=azure_openai_key)
-
-    # Provide instructions to the model
-    SYSTEM_PROMPT="""
-    You are an AI assistant that helps users learn from the information found in the source material.
-    Answer the query using only the sources provided below.
-    Use bullets if the answer has multiple points.
-    If the answer is longer than 3 sentences, provide a summary.
-    Answer ONLY with the facts listed in the list of sources below. Cite your source when you answer the question
-    If there isn't enough information below, say you don't know.
-    Do not generate answers that don't use the sources below.
-    Query: {query}
-    Sources:\n{sources}
-    """
-
-    # User Query
-    query = userquery 
-
-    # Convert query into vector form
-    vector_query = VectorizableTextQuery(text=query, 
-                                        k_nearest_neighbors=50, 
-                                        fields="text_vector",
-                                        weight=1)
-
-    results = search_client.search(
-        query_type="semantic", 
-        semantic_configuration_name='my-semantic-config',
-        search_text=query,
-        vector_queries= [vector_query],
-        select=["title","chunk"],
-        top=5,
-    )
-
-    # Use a unique separator to make the sources distinct. 
-    # We chose repeated equal signs (=) followed by a newline because it's unlikely the source documents contain this sequence.
-    sources_formatted = "=================\n".join([f'TITLE: {document["title"]}, CONTENT: {document["chunk"]}' for document in results])
-
-    response = openai_client.chat.completions.create(
-        messages=[
-            {
-                "role": "user",
-                "content": SYSTEM_PROMPT.format(query=query, sources=sources_formatted)
-            }
-        ],
-        model=azure_openai_deployment
-    )
-
-    return response.choices[0].message.content
+    # Clients, connections and the search cache live in the shared service
+    return product_service.answer(userquery)
 
 
 # Statically defined user functions for fast reference
@@ -162,61 +136,38 @@ user_functions: Set[Callable[..., Any]] = {
 }
 
 # Define the function to run the agent
-def run_agent(user_input, project_client, thread, agent):  
-    # Step 3: Add a message to the thread  
-    message = project_client.agents.create_message(
-        thread_id=thread.id,
-        role="user",
-        content=user_input,
-    )
-    print(f"Created message, ID: {message.id}")
+@traced("run_agent")
+async def run_agent(user_input, project_client, session):  
+    agent_response = ""
 
-    # Step 4 & 5: Create and process agent run in thread with tools
-    run = project_client.agents.create_and_process_run(thread_id=thread.id, agent_id=agent.id)
+    # Steps 3 to 5: add the message, create the run and poll it without blocking the event loop,
+    # executing tool calls as requested
+    functions = FunctionTool(user_functions)
+    run, agent_message = await session.run_turn(project_client, user_input, functions)
+    record_usage(run.usage, "agent")
     
     if run.status == "failed":
-        print(f"Run failed: {run.last_error}")
+        log("run_failed", level="error", run_id=run.id, error=run.last_error)
 
     # Step 6: Display the Agent's Response
     elif run.status == 'completed':
-            # Fetch all messages in the thread
-            messages = project_client.agents.list_messages(thread_id=thread.id)
-            if messages.data:
-                agent_response = messages.data[0].content[0].text.value # Get the last assistant message
-                print(f"Agent Response: {agent_response}") 
+            if agent_message is not None:
+                agent_response = agent_message.content[0].text.value
             else:
-                print("No messages found.")
+                log("no_agent_message", level="warning", run_id=run.id)
     
     return agent_response
 
-# Define the function to delete the agent
-def delete_agent(project_client, agent):
-    # Delete the agent when done
-    project_client.agents.delete_agent(agent.id)
-    print("Deleted agent")
-    
-
-@cl.on_chat_start
-def on_chat_start():
-    
-    global project_client
-    global agent
-    global thread
-
-    project_connection_string = os.getenv("PROJECT_CONNECTION_STRING")
-    # Create an Azure AI Client from a connection string, copied from your Azure AI Foundry project.    
-    project_client = AIProjectClient.from_connection_string(
-        credential=DefaultAzureCredential(),
-        conn_str=project_connection_string,
-    )
+# Define the function to get the agent, once per process
+def get_agent():
 
     # Initialize agent toolset with user functions
     functions = FunctionTool(user_functions)
-    toolset = ToolSet()
+    toolset = ConcurrentToolSet()
     toolset.add(functions)
 
-    # Create a new agent with the toolset
-    agent = project_client.agents.create_agent(
+    # Reuse the agent for this model, instructions and toolset; it is only created the first time
+    return agent_registry.get_or_create(
         model="gpt-4o", 
         name="my-chainlit-agent", 
         instructions="""
@@ -231,29 +182,44 @@ def on_chat_start():
         toolset=toolset,
     )
 
-    print(f"Created agent, ID: {agent.id}")
+# Get the agent before the first user connects; this also opens the connection to the project
+with boot.phase("agent"):
+    agent = get_agent()
+with boot.phase("tokenizer"):
+    warm_tokenizer()
+boot.report()
+
+
+@cl.on_chat_start
+async def on_chat_start():
 
-    # Create a new thread for the agent
-    thread = project_client.agents.create_thread()
-    print(f"Created thread, ID: {thread.id}")
+    # Take a ready thread from the pool; the thread and agent id live in this session only
+    cl.user_session.set("session", await ChatSession.start(thread_pool, agent.id))
     
     print("A new chat session has started!")
 
 @cl.on_message
 async def main(message: cl.Message):
 
-    # Call the agent with the user's message
-    agent_response = run_agent(message.content, project_client, thread, agent)
-    
-    # Send a response back to the user
-    await cl.Message(
-        content=agent_response,
-    ).send()
+    session = cl.user_session.get("session")
+    # One run at a time per thread: a second message waits for the first answer
+    async with session.lock:
+        # Call the agent with the user's message
+        agent_response = await run_agent(message.content, project_client, session)
+
+        # Send a response back to the user
+        await cl.Message(
+            content=agent_response,
+        ).send()
+
+        await session.compact(project_client, summarize)
 
 @cl.on_chat_end
 def on_chat_end():
-    # Delete the agent when done
-    delete_agent(project_client, agent)
+    # The agent is shared across sessions; only this session's thread is released
+    session = cl.user_session.get("session")
+    if session is not None:
+        session.end()
     print("The user disconnected!")
 
 @cl.set_starters
@@ -1,14 +1,24 @@
 ## az login is needed before running this code
 
 import os
-import chainlit as cl
+import sys
 import logging
+# telemetry.py and contextpacker.py are kept once, in AzureCosmosDB; appended so this folder's modules come first
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "AzureCosmosDB"))
 from dotenv import load_dotenv
-from azure.ai.projects import AIProjectClient
-from azure.identity import DefaultAzureCredential
-
-# Load environment variables
+# warmup and telemetry read their settings at import, so .env is loaded before them
 load_dotenv()
+from warmup import boot, build_credential, project_scopes, warm_tokenizer
+
+# Startup is timed phase by phase and reported once the agent is ready
+with boot.phase("imports"):
+    import chainlit as cl
+    from azure.ai.projects import AIProjectClient
+    from streaming import stream_agent
+    from agentpool import ThreadPool
+    from history import project_summarizer
+    from sessions import ChatSession
+    from telemetry import span, traced, log, start_metrics_server
 
 # Disable verbose connection logs
 logger = logging.getLogger("azure.core.pipeline.policies.http_logging_policy")
@@ -17,18 +27,41 @@ logger.setLevel(logging.WARNING)
 # Load environment variables
 AIPROJECT_CONNECTION_STRING = os.getenv("PROJECT_CONNECTION_STRING")
 AGENT_ID = os.getenv("AGENT_ID")
+# Stream run events when possible; set AGENT_STREAMING=false to process the run and send the whole answer
+agent_streaming = os.getenv("AGENT_STREAMING", "true").lower() != "false"
+
+# Pick the credential once and fetch its tokens before the first user connects
+with boot.phase("credential"):
+    credential = build_credential()
+    credential.warm(*project_scopes)
+
+# Create an instance of the AIProjectClient using the cached credential
+with boot.phase("client"):
+    project_client = AIProjectClient.from_connection_string(
+        conn_str=AIPROJECT_CONNECTION_STRING, credential=credential
+    )
+
+# Keep a few threads ready so a new session doesn't wait for create_thread
+thread_pool = ThreadPool(project_client)
+thread_pool.fill()
+# Summarizes old turns when HISTORY_COMPACTION=summarize
+summarize = project_summarizer(project_client)
+# Prometheus metrics on METRICS_PORT, when set
+start_metrics_server()
 
-# Create an instance of the AIProjectClient using DefaultAzureCredential
-project_client = AIProjectClient.from_connection_string(
-	conn_str=AIPROJECT_CONNECTION_STRING, credential=DefaultAzureCredential()
-)
+# Check the agent exists before the first user connects; this also opens the connection to the project
+with boot.phase("agent"):
+    project_client.agents.get_agent(AGENT_ID)
+with boot.phase("tokenizer"):
+    warm_tokenizer()
+boot.report()
 
 # Define the function to run the agent
-def run_agent(user_input, project_client, thread_id):  
+@traced("run_agent")
+def run_agent(user_input, project_client, history):  
 
-    print("Entering run agent...")
-    print(AGENT_ID)
-    print(AIPROJECT_CONNECTION_STRING)
+    agent_response = ""
+    thread_id = history.thread_id
 
     # Add a message to the thread  
     message = project_client.agents.create_message(
@@ -36,48 +69,72 @@ def run_agent(user_input, project_client, thread_id):
         role="user",
         content=user_input,
     )
-    print(f"Created message, ID: {message.id}")
+    log("message_created", thread_id=thread_id, message_id=message.id)
+    history.record(message)
 
     # Create and process agent run in thread with tools
     run = project_client.agents.create_and_process_run(thread_id=thread_id, agent_id=AGENT_ID)
     
     if run.status == "failed":
-        print(f"Run failed: {run.last_error}")
+        log("run_failed", level="error", run_id=run.id, error=run.last_error)
 
     # Display the Agent's Response
     elif run.status == 'completed':
-            # Fetch all messages in the thread
-            messages = project_client.agents.list_messages(thread_id=thread_id)
-            if messages.data:
-                agent_response = messages.data[0]  # Get the last assistant message
-                print(f"Agent Response: {agent_response.content[0].text.value}") 
+            # Fetch only the messages added since the user's message
+            agent_message = history.latest_reply(project_client)
+            if agent_message is not None:
+                agent_response = agent_message.content[0].text.value
             else:
-                print("No messages found.")
+                log("no_agent_message", level="warning", run_id=run.id)
     
     return agent_response
 
 @cl.on_chat_start
 async def on_chat_start():
-    print(AGENT_ID)
-    print(AIPROJECT_CONNECTION_STRING)
-    if not cl.user_session.get("thread_id"):
-	    
-        thread = project_client.agents.create_thread()
-        cl.user_session.set("thread_id", thread.id)
-        print(f"New Thread ID: {thread.id}")
+    if not cl.user_session.get("session"):
+        # Take a ready thread from the pool; the thread lives in this session only
+        cl.user_session.set("session", await ChatSession.start(thread_pool, AGENT_ID))
 
 @cl.on_message
 async def main(message: cl.Message):
-    thread_id = cl.user_session.get("thread_id")
+    session = cl.user_session.get("session")
+    # One run at a time per thread: a second message waits for the first answer
+    async with session.lock:
+        history = await session.history_for_turn()
+        thread_id = history.thread_id
 
-    # Call the agent with the user's message
-    agent_response = run_agent(message.content, project_client, thread_id)
-    
-    # Send a response back to the user
-    await cl.Message(
-        content=agent_response,
-    ).send()
+        if not agent_streaming:
+            # Call the agent with the user's message and wait for the complete answer
+            agent_response = await cl.make_async(run_agent)(message.content, project_client, history)
+            await cl.Message(content=agent_response).send()
+            await session.compact(project_client, summarize)
+            return
+
+        # Call the agent with the user's message and stream its answer as it is generated
+        # The same run_agent stage as the non-streaming path, timed until the answer is complete
+        with span("run_agent", streaming=True):
+            stream = await cl.make_async(stream_agent)(message.content, project_client, thread_id, AGENT_ID, history)
+            response_message = cl.Message(content="")
+            async for delta in stream.stream_async():
+                await response_message.stream_token(delta)
+
+        # Send a response back to the user
+        await response_message.send()
+
+        # The stream already delivered the completed message; no need to list the thread
+        if stream.message is not None:
+            history.record(stream.message)
+        await session.compact(project_client, summarize)
+
+        log("run_finished", thread_id=thread_id, ttft_ms=stream.ttft_ms,
+            tokens_per_second=stream.tokens_per_second, timings_ms=stream.timings.as_dict())
     
+@cl.on_chat_end
+def on_chat_end():
+    session = cl.user_session.get("session")
+    if session is not None:
+        session.end()
+
 @cl.set_starters
 async def set_starters():
     return [
@@ -0,0 +1,157 @@
+import os
+from azure.ai.projects.models import ThreadMessageOptions
+from contextpacker import count_tokens
+
+# Opt-in: "off" (default) keeps the whole thread, "truncate" carries the last messages over,
+# "summarize" adds a summary of the rest
+history_compaction = os.getenv("HISTORY_COMPACTION") or "off"
+history_token_budget = int(os.getenv("HISTORY_TOKEN_BUDGET") or 8000)
+history_keep_messages = int(os.getenv("HISTORY_KEEP_MESSAGES") or 6)
+
+SUMMARY_PROMPT = """
+Summarize the conversation below for an AI travel agent that will continue it.
+Keep the user's destinations, dates, budget, preferences and any open questions.
+Conversation:\n{conversation}
+"""
+
+
+def message_role(message):
+    # MessageRole is a str enum; compare on its value
+    return getattr(message.role, "value", message.role)
+
+def message_text(message):
+    return "\n".join(block.text.value for block in message.content if getattr(block, "text", None))
+
+def fetch_new_messages(project_client, thread_id, after=None, limit=100):
+    """
+    Returns the thread's messages created after the given message id, oldest first.
+
+    :param project_client: An AIProjectClient.
+    :param thread_id (str): The thread to read.
+    :param after (str): The last message id already seen; None reads the whole thread.
+    :rtype: list[ThreadMessage]
+    """
+    messages = []
+    while True:
+        page = project_client.agents.list_messages(thread_id=thread_id, order="asc", after=after, limit=limit)
+        messages.extend(page.data)
+        if not page.has_more or not page.data:
+            return messages
+        after = page.data[-1].id
+
+
+class ConversationHistory:
+    """
+    Tracks one session's thread: the last message seen and the tokens held.
+
+    After each run only the messages newer than the cursor are fetched, so a
+    turn transfers the reply instead of the whole thread. When the thread
+    grows past the token budget, compact() moves the conversation to a new
+    thread holding the last few messages (and optionally a summary of the
+    rest), which keeps the agent's prompt from growing without bound.
+    """
+
+    def __init__(self, thread_id, token_budget=history_token_budget, keep_messages=history_keep_messages,
+                 compaction=history_compaction):
+        self.thread_id = thread_id
+        self.token_budget = token_budget
+        self.keep_messages = keep_messages
+        self.compaction = compaction
+        self.last_id = None
+        self.messages = []
+        self.tokens = 0
+
+    def record(self, message):
+        text = message_text(message)
+        tokens = count_tokens(text)
+        self.messages.append((message_role(message), text, tokens))
+        self.tokens += tokens
+        self.last_id = message.id
+
+    def fetch_new(self, project_client):
+        """
+        Fetches and records the messages added since the last one seen.
+
+        :return: The new messages, oldest first.
+        :rtype: list[ThreadMessage]
+        """
+        messages = fetch_new_messages(project_client, self.thread_id, self.last_id)
+        for message in messages:
+            self.record(message)
+        return messages
+
+    def latest_reply(self, project_client):
+        # The newest assistant message among the ones added by the run
+        for message in reversed(self.fetch_new(project_client)):
+            if message_role(message) == "assistant":
+                return message
+        return None
+
+    def needs_compaction(self):
+        return self.compaction != "off" and self.tokens > self.token_budget and len(self.messages) > self.keep_messages
+
+    def compact(self, project_client, summarize=None):
+        """
+        Moves the conversation to a new thread that holds only its recent part.
+
+        :param project_client: An AIProjectClient.
+        :param summarize: Callable turning the dropped messages' text into a summary; used when compaction is "summarize".
+        :return: The new thread id. The caller releases the old thread.
+        :rtype: str
+        """
+        # Sliced by position, since messages[-0:] would keep everything when keep_messages is 0
+        split = max(len(self.messages) - self.keep_messages, 0)
+        dropped = self.messages[:split]
+        kept = self.messages[split:]
+        # A thread has to start with a user message
+        while kept and kept[0][0] != "user":
+            dropped.append(kept.pop(0))
+
+        if self.compaction == "summarize" and summarize is not None and dropped:
+            conversation = "\n".join(f"{role}: {text}" for role, text, _ in dropped)
+            summary = f"Summary of the conversation so far:\n{summarize(conversation)}"
+            kept.insert(0, ("user", summary, count_tokens(summary)))
+        options = [ThreadMessageOptions(role=role, content=text) for role, text, _ in kept]
+
+        thread = project_client.agents.create_thread(messages=options)
+        print(f"Compacted thread {self.thread_id} ({self.tokens} tokens) into {thread.id}")
+
+        self.thread_id = thread.id
+        self.messages = kept
+        self.tokens = sum(tokens for _, _, tokens in kept)
+        # The carried-over messages are already recorded; the next user message moves the cursor
+        self.last_id = None
+        return thread.id
+
+    def compact_if_needed(self, project_client, thread_pool, summarize=None):
+        """
+        Compacts the thread when it is over budget and hands the session over to the new one.
+
+        :return: The session's thread id after compaction.
+        :rtype: str
+        """
+        if not self.needs_compaction():
+            return self.thread_id
+        old_thread_id = self.thread_id
+        thread_pool.swap(old_thread_id, self.compact(project_client, summarize))
+        return self.thread_id
+
+
+def openai_summarizer(openai_client, model):
+    """
+    Returns a summarize callable for ConversationHistory.compact backed by a chat completion.
+    """
+    def summarize(conversation):
+        response = openai_client.chat.completions.create(
+            messages=[{"role": "user", "content": SUMMARY_PROMPT.format(conversation=conversation)}],
+            model=model,
+        )
+        return response.choices[0].message.content
+    return summarize
+
+def project_summarizer(project_client, model=os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME") or "gpt-4o"):
+    # Only built when HISTORY_COMPACTION=summarize
+    if history_compaction != "summarize":
+        return None
+    openai_client = project_client.inference.get_azure_openai_client(api_version=os.getenv("AZURE_OPENAI_API_VERSION"))
+    return openai_summarizer(openai_client, model)
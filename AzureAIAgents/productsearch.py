@@ -0,0 +1,181 @@
+from dotenv import load_dotenv
+import os
+import time
+import threading
+from collections import OrderedDict
+import httpx
+from openai import AzureOpenAI
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents import SearchClient
+from azure.search.documents.models import VectorizableTextQuery
+from contextpacker import pack_context
+from telemetry import span, record_usage, log
+
+load_dotenv() # take environment variables from .env.
+
+azure_search_service_admin_key = os.getenv("AZURE_SEARCH_ADMIN_KEY")
+azure_search_service_endpoint = os.getenv("AZURE_SEARCH_SERVICE_ENDPOINT")
+azure_search_service_index_name = os.getenv("AZURE_SEARCH_INDEX_NAME")
+azure_openai_api_version = os.getenv("AZURE_OPENAI_API_VERSION")
+azure_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+azure_openai_key = os.getenv("AZURE_OPENAI_API_KEY")
+azure_openai_deployment = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME")
+
+# Search result cache settings
+product_search_cache_size = int(os.getenv("PRODUCT_SEARCH_CACHE_SIZE") or 1000)
+product_search_cache_ttl = float(os.getenv("PRODUCT_SEARCH_CACHE_TTL") or 600)
+
+# Provide instructions to the model
+SYSTEM_PROMPT="""
+You are an AI assistant that helps users learn from the information found in the source material.
+Answer the query using only the sources provided below.
+Use bullets if the answer has multiple points.
+If the answer is longer than 3 sentences, provide a summary.
+Answer ONLY with the facts listed in the list of sources below. Cite your source when you answer the question
+If there isn't enough information below, say you don't know.
+Do not generate answers that don't use the sources below.
+Query: {query}
+Sources:\n{sources}
+"""
+
+
+def normalize_query(text):
+    return " ".join(text.lower().split())
+
+
+class ProductRetrievalService:
+    """
+    Long-lived retrieval-augmented answering over the product search index.
+
+    The SearchClient and AzureOpenAI client are built once and keep their
+    HTTP connections open between tool calls. Search results are cached per
+    normalized query, and every answer records how long each stage took.
+    """
+
+    def __init__(self, cache_size=product_search_cache_size, cache_ttl=product_search_cache_ttl):
+        self.search_client = SearchClient(endpoint=azure_search_service_endpoint,
+                                          credential=AzureKeyCredential(azure_search_service_admin_key),
+                                          index_name=azure_search_service_index_name)
+        self.openai_client = AzureOpenAI(
+            api_version=azure_openai_api_version,
+            azure_endpoint=azure_openai_endpoint,
+            api_key=azure_openai_key,
+            http_client=httpx.Client(limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)))
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.totals = {}
+        self.calls = 0
+        self.tokens_saved = 0
+
+    def search(self, query):
+        """
+        Returns the top chunks for a query from the hybrid semantic + vector search, cached per normalized query.
+
+        :param query (str): The user's query.
+        :return: The title and chunk of each result.
+        :rtype: list[dict]
+        """
+        key = normalize_query(query)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[1] > now:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Convert query into vector form
+        vector_query = VectorizableTextQuery(text=query,
+                                            k_nearest_neighbors=50,
+                                            fields="text_vector",
+                                            weight=1)
+
+        with span("product_search"):
+            results = self.search_client.search(
+                query_type="semantic",
+                semantic_configuration_name='my-semantic-config',
+                search_text=query,
+                vector_queries= [vector_query],
+                select=["title","chunk"],
+                top=5,
+            )
+            # The pager is lazy; read it here so the search stage is timed on its own
+            documents = [{"title": document["title"], "chunk": document["chunk"]} for document in results]
+
+        with self._lock:
+            self._cache[key] = (documents, now + self.cache_ttl)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return documents
+
+    def answer_with_timings(self, query):
+        """
+        Answers a query from the product index.
+
+        :param query (str): The user's query.
+        :return: The answer, the milliseconds spent in search, packing and completion, and the packing stats.
+        :rtype: tuple[str, dict, PackStats]
+        """
+        start = time.perf_counter()
+        documents = self.search(query)
+        searched = time.perf_counter()
+
+        # Drop the 500-char overlap between adjacent chunks and fit the rest into the token budget
+        with span("context_pack") as current:
+            documents, pack_stats = pack_context(documents, "chunk")
+            current.set_attribute("tokens_saved", pack_stats.tokens_saved)
+
+        # Use a unique separator to make the sources distinct.
+        # We chose repeated equal signs (=) followed by a newline because it's unlikely the source documents contain this sequence.
+        sources_formatted = "=================\n".join([f'TITLE: {document["title"]}, CONTENT: {document["chunk"]}' for document in documents])
+        prompt = SYSTEM_PROMPT.format(query=query, sources=sources_formatted)
+        formatted = time.perf_counter()
+
+        with span("completion", model=azure_openai_deployment) as current:
+            response = self.openai_client.chat.completions.create(
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                model=azure_openai_deployment
+            )
+            record_usage(response.usage, azure_openai_deployment, current)
+        completed = time.perf_counter()
+
+        timings = {
+            "search_ms": round((searched - start) * 1000, 1),
+            "pack_ms": round((formatted - searched) * 1000, 1),
+            "completion_ms": round((completed - formatted) * 1000, 1),
+            "total_ms": round((completed - start) * 1000, 1),
+        }
+        with self._lock:
+            self.calls += 1
+            self.tokens_saved += pack_stats.tokens_saved
+            for stage, elapsed in timings.items():
+                self.totals[stage] = self.totals.get(stage, 0.0) + elapsed
+        return response.choices[0].message.content, timings, pack_stats
+
+    def answer(self, query):
+        with span("fetch_product_info"):
+            answer, timings, pack_stats = self.answer_with_timings(query)
+        log("product_answer", tokens_saved=pack_stats.tokens_saved, **timings)
+        return answer
+
+    def stats(self):
+        with self._lock:
+            averages = {stage: round(total / self.calls, 1) for stage, total in self.totals.items()} if self.calls else {}
+            return {"calls": self.calls, "cache_hits": self.hits, "cache_misses": self.misses,
+                    "cached_queries": len(self._cache), "average_ms": averages,
+                    "tokens_saved": self.tokens_saved}
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
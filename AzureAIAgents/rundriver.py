@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import asyncio
+import functools
+import threading
+import concurrent.futures
+from azure.ai.projects.models import FunctionTool, ToolSet, RequiredFunctionToolCall, SubmitToolOutputsAction, ToolOutput
+from telemetry import span, stage_latency, log
+
+# Tool calls of one requires_action step run concurrently on this pool
+tool_executor = concurrent.futures.ThreadPoolExecutor(max_workers=int(os.getenv("TOOL_MAX_WORKERS") or 8),
+                                                      thread_name_prefix="agent-tool")
+tool_timeout = float(os.getenv("TOOL_TIMEOUT") or 30)
+
+# Run states in which the agent is still working
+active_statuses = ("queued", "in_progress", "requires_action", "cancelling")
+
+
+class RunTimings:
+    """
+    Records how long a run spent in each status (queued, in_progress, requires_action, ...).
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.durations = {}
+        self._status = None
+        self._since = None
+
+    def observe(self, status):
+        now = time.perf_counter()
+        if status == self._status:
+            return
+        if self._status is not None:
+            self.durations[self._status] = self.durations.get(self._status, 0.0) + now - self._since
+        self._status = status
+        self._since = now
+
+    def finish(self):
+        self.observe(None)
+
+    def record(self):
+        # One histogram sample per status, e.g. run_queued, run_in_progress, run_requires_action
+        for status, seconds in self.durations.items():
+            stage_latency.observe(seconds, stage=f"run_{status}")
+
+    def as_dict(self):
+        timings = {status: round(seconds * 1000, 1) for status, seconds in self.durations.items()}
+        timings["total"] = round((time.perf_counter() - self.start) * 1000, 1)
+        return timings
+
+
+def memoize_tool(ttl=300):
+    """
+    Caches a deterministic tool function's JSON output per argument set for ``ttl`` seconds.
+
+    functools.wraps keeps the name, signature and docstring FunctionTool builds its schema from.
+    """
+    def decorator(function):
+        cache = {}
+        lock = threading.Lock()
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = json.dumps([args, kwargs], sort_keys=True, default=str)
+            now = time.monotonic()
+            with lock:
+                entry = cache.get(key)
+                if entry is not None and entry[1] > now:
+                    return entry[0]
+            result = function(*args, **kwargs)
+            with lock:
+                cache[key] = (result, now + ttl)
+            return result
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+def tool_error(tool_call, error_type, message):
+    # Structured output so the model can tell a failed tool from an empty result
+    return ToolOutput(
+        tool_call_id=tool_call.id,
+        output=json.dumps({"error": {"type": error_type, "tool": tool_call.function.name, "message": message}}),
+    )
+
+def execute_traced(functions, tool_call):
+    with span("tool_call", tool=tool_call.function.name):
+        return functions.execute(tool_call)
+
+def execute_tool_calls(functions, tool_calls, timeout=tool_timeout, timeouts=None):
+    """
+    Runs the function tool calls of a requires_action step concurrently and collects their outputs.
+
+    Every call runs on a shared, bounded thread pool. A call that raises or runs
+    past its timeout returns a structured error output instead of being dropped.
+
+    :param functions (FunctionTool): The agent's function tools.
+    :param tool_calls (list): The tool calls from run.required_action.
+    :param timeout (float): Seconds each tool may take.
+    :param timeouts (dict): Optional per-tool overrides, keyed by function name.
+    :return: The outputs to submit back to the run, in tool call order.
+    :rtype: list[ToolOutput]
+    """
+    timeouts = timeouts or {}
+    started = time.monotonic()
+    futures = []
+    for tool_call in tool_calls:
+        if isinstance(tool_call, RequiredFunctionToolCall):
+            log("tool_call_started", tool=tool_call.function.name, tool_call_id=tool_call.id)
+            futures.append((tool_call, tool_executor.submit(execute_traced, functions, tool_call)))
+
+    tool_outputs = []
+    for tool_call, future in futures:
+        limit = timeouts.get(tool_call.function.name, timeout)
+        try:
+            output = future.result(timeout=max(0.0, started + limit - time.monotonic()))
+            tool_outputs.append(
+                ToolOutput(
+                    tool_call_id=tool_call.id,
+                    output=output,
+                )
+            )
+        except concurrent.futures.TimeoutError:
+            # The worker thread can't be interrupted; it finishes in the background
+            log("tool_call_timeout", level="warning", tool=tool_call.function.name,
+                tool_call_id=tool_call.id, timeout=limit)
+            tool_outputs.append(tool_error(tool_call, "timeout", f"No result within {limit} seconds"))
+        except Exception as e:
+            log("tool_call_failed", level="error", tool=tool_call.function.name,
+                tool_call_id=tool_call.id, error=str(e))
+            tool_outputs.append(tool_error(tool_call, type(e).__name__, str(e)))
+    return tool_outputs
+
+
+class ConcurrentToolSet(ToolSet):
+    """
+    ToolSet whose function calls run through execute_tool_calls, so runs the
+    SDK drives itself (streaming, create_and_process_run) get the same
+    concurrency, timeouts and error outputs.
+    """
+
+    def execute_tool_calls(self, tool_calls):
+        return execute_tool_calls(self.get_tool(FunctionTool), tool_calls)
+
+async def drive_run(project_client, thread_id, run, handle_tool_calls=None,
+                    initial_interval=0.25, max_interval=2.0, backoff=1.5, deadline=300.0):
+    """
+    Polls a run to completion without blocking the event loop.
+
+    Polling starts fast and backs off geometrically while the status stays the
+    same, resetting on every status change. SDK calls run in worker threads.
+    The run is cancelled if it is still active after ``deadline`` seconds.
+
+    :param project_client: An AIProjectClient.
+    :param thread_id (str): The run's thread.
+    :param run (ThreadRun): The run returned by create_run.
+    :param handle_tool_calls: Callable (or coroutine function) turning tool calls into ToolOutputs.
+    :return: The final run and its per-status timings.
+    :rtype: tuple[ThreadRun, RunTimings]
+    """
+    agents = project_client.agents
+    timings = RunTimings()
+    timings.observe(run.status)
+    expires = time.monotonic() + deadline
+    interval = initial_interval
+
+    while run.status in active_statuses:
+        if time.monotonic() > expires:
+            await asyncio.to_thread(agents.cancel_run, thread_id=thread_id, run_id=run.id)
+            timings.finish()
+            timings.record()
+            raise TimeoutError(f"Run {run.id} did not finish within {deadline}s (last status: {run.status})")
+
+        await asyncio.sleep(interval)
+        previous_status = run.status
+        run = await asyncio.to_thread(agents.get_run, thread_id=thread_id, run_id=run.id)
+        timings.observe(run.status)
+
+        if run.status == "requires_action" and isinstance(run.required_action, SubmitToolOutputsAction):
+            tool_calls = run.required_action.submit_tool_outputs.tool_calls
+            if not tool_calls or handle_tool_calls is None:
+                log("run_cancelled", level="warning", run_id=run.id, reason="no tool calls")
+                await asyncio.to_thread(agents.cancel_run, thread_id=thread_id, run_id=run.id)
+                break
+
+            if asyncio.iscoroutinefunction(handle_tool_calls):
+                tool_outputs = await handle_tool_calls(tool_calls)
+            else:
+                tool_outputs = await asyncio.to_thread(handle_tool_calls, tool_calls)
+
+            if not tool_outputs:
+                log("run_cancelled", level="warning", run_id=run.id, reason="no tool outputs")
+                await asyncio.to_thread(agents.cancel_run, thread_id=thread_id, run_id=run.id)
+                break
+            run = await asyncio.to_thread(agents.submit_tool_outputs_to_run,
+                                          thread_id=thread_id, run_id=run.id, tool_outputs=tool_outputs)
+            timings.observe(run.status)
+            interval = initial_interval
+            continue
+
+        if run.status != previous_status:
+            log("run_status", run_id=run.id, status=run.status)
+            interval = initial_interval
+        else:
+            interval = min(interval * backoff, max_interval)
+
+    timings.finish()
+    timings.record()
+    return run, timings
@@ -0,0 +1,92 @@
+import asyncio
+from history import ConversationHistory
+from rundriver import drive_run, execute_tool_calls
+from telemetry import log
+
+
+class ChatSession:
+    """
+    One user's conversation state, kept in cl.user_session.
+
+    The project client, the agent and the thread pool are built once per
+    process and shared read-only by every session. Everything that belongs to
+    one user (the agent id, the thread and its history cursor) lives here, so
+    concurrent sessions never see each other's thread. A thread accepts one
+    active run at a time, so the turns of a session are serialized by a lock.
+    """
+
+    def __init__(self, thread_pool, agent_id, thread_id):
+        self.thread_pool = thread_pool
+        self.agent_id = agent_id
+        self.history = ConversationHistory(thread_id)
+        self.lock = asyncio.Lock()
+
+    @classmethod
+    async def start(cls, thread_pool, agent_id):
+        """
+        Opens a session on a thread taken from the pool, off the event loop.
+
+        :param thread_pool (ThreadPool): The process-wide thread pool.
+        :param agent_id (str): The shared agent the session talks to.
+        :rtype: ChatSession
+        """
+        thread_id = await asyncio.to_thread(thread_pool.acquire)
+        log("session_started", agent_id=agent_id, thread_id=thread_id)
+        return cls(thread_pool, agent_id, thread_id)
+
+    @property
+    def thread_id(self):
+        return self.history.thread_id
+
+    async def history_for_turn(self):
+        """
+        Marks the session's thread as active before a turn.
+
+        :return: The session's history; a fresh one if the idle thread was reclaimed.
+        :rtype: ConversationHistory
+        """
+        thread_id = await asyncio.to_thread(self.thread_pool.touch, self.history.thread_id)
+        if thread_id != self.history.thread_id:
+            # The idle thread was reclaimed; continue on a fresh one
+            self.history = ConversationHistory(thread_id)
+        return self.history
+
+    async def run_turn(self, project_client, user_input, functions):
+        """
+        Runs one agent turn on the session's thread without streaming; call it holding ``lock``.
+
+        Adds the user's message, creates the run and polls it without blocking
+        the event loop, executing the requested function tools concurrently,
+        then fetches only the messages the run added.
+
+        :param project_client: An AIProjectClient.
+        :param user_input (str): The user's message.
+        :param functions (FunctionTool): The function tools the run may call.
+        :return: The finished run and the agent's reply, None if the run left no reply.
+        :rtype: tuple[ThreadRun, ThreadMessage]
+        """
+        agents = project_client.agents
+        history = await self.history_for_turn()
+        thread_id = history.thread_id
+
+        message = await asyncio.to_thread(agents.create_message, thread_id=thread_id, role="user", content=user_input)
+        log("message_created", thread_id=thread_id, message_id=message.id)
+        history.record(message)
+
+        run = await asyncio.to_thread(agents.create_run, thread_id=thread_id, agent_id=self.agent_id)
+        log("run_created", thread_id=thread_id, run_id=run.id)
+        run, timings = await drive_run(project_client, thread_id, run,
+                                       lambda tool_calls: execute_tool_calls(functions, tool_calls))
+        log("run_finished", run_id=run.id, status=run.status, timings_ms=timings.as_dict())
+
+        reply = None
+        if run.status == "completed":
+            reply = await asyncio.to_thread(history.latest_reply, project_client)
+        return run, reply
+
+    async def compact(self, project_client, summarize=None):
+        await asyncio.to_thread(self.history.compact_if_needed, project_client, self.thread_pool, summarize)
+
+    def end(self):
+        self.thread_pool.release(self.history.thread_id)
+        log("session_ended", agent_id=self.agent_id, thread_id=self.history.thread_id)
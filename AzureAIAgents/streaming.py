@@ -0,0 +1,131 @@
+import asyncio
+import time
+from azure.ai.projects.models import AgentStreamEvent, MessageDeltaChunk, ThreadMessage, ThreadRun
+from rundriver import RunTimings
+from telemetry import stage_latency, record_usage, log
+
+
+class AgentResponseStream:
+    """
+    Streams the text of an agent run as it is generated.
+
+    Iterate it (or ``stream_async()`` from a Chainlit handler) to receive text
+    deltas. Function tools registered with ``create_agent(toolset=...)`` are
+    executed by the SDK while the stream is open. Once the stream is drained,
+    ``message`` holds the completed ThreadMessage, ``run`` the final ThreadRun
+    and ``timings`` the time spent in each run status.
+    """
+
+    def __init__(self, project_client, thread_id, agent_id):
+        self.project_client = project_client
+        self.thread_id = thread_id
+        self.agent_id = agent_id
+        self.message = None
+        self.run = None
+        self.start = None
+        self.first_token_at = None
+        self.end = None
+        self.chunks = 0
+        self.timings = RunTimings()
+
+    def __iter__(self):
+        self.start = time.perf_counter()
+        self.timings = RunTimings()
+        with self.project_client.agents.create_stream(thread_id=self.thread_id, agent_id=self.agent_id) as stream:
+            for event_type, event_data, _ in stream:
+                if isinstance(event_data, MessageDeltaChunk):
+                    if event_data.text:
+                        if self.first_token_at is None:
+                            self.first_token_at = time.perf_counter()
+                        self.chunks += 1
+                        yield event_data.text
+                elif isinstance(event_data, ThreadMessage) and event_data.status == "completed":
+                    self.message = event_data
+                elif isinstance(event_data, ThreadRun):
+                    self.run = event_data
+                    self.timings.observe(event_data.status)
+                    if event_data.status == "failed":
+                        log("run_failed", level="error", run_id=event_data.id, error=event_data.last_error)
+                elif event_type == AgentStreamEvent.ERROR:
+                    log("stream_error", level="error", thread_id=self.thread_id, error=event_data)
+                elif event_type == AgentStreamEvent.DONE:
+                    break
+        self.end = time.perf_counter()
+        self.timings.finish()
+        self.timings.record()
+        stage_latency.observe(self.end - self.start, stage="agent_stream")
+        if self.first_token_at is not None:
+            stage_latency.observe(self.first_token_at - self.start, stage="agent_ttft")
+        record_usage(getattr(self.run, "usage", None), "agent")
+
+    async def stream_async(self):
+        """
+        Yields text deltas on the event loop while the blocking SDK stream runs in a worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+
+        def produce():
+            try:
+                for delta in self:
+                    loop.call_soon_threadsafe(queue.put_nowait, delta)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        worker = loop.run_in_executor(None, produce)
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                await worker
+                raise item
+            yield item
+        await worker
+
+    @property
+    def ttft_ms(self):
+        if self.first_token_at is None:
+            return None
+        return (self.first_token_at - self.start) * 1000
+
+    @property
+    def tokens(self):
+        # Prefer the run's reported usage; fall back to the number of deltas
+        usage = getattr(self.run, "usage", None)
+        if usage is not None and usage.completion_tokens:
+            return usage.completion_tokens
+        return self.chunks
+
+    @property
+    def tokens_per_second(self):
+        if self.first_token_at is None or self.end is None or self.end <= self.first_token_at:
+            return None
+        return self.tokens / (self.end - self.first_token_at)
+
+
+def stream_agent(user_input, project_client, thread_id, agent_id, history=None):
+    """
+    Adds the user's message to the thread and returns a stream over the agent's answer.
+
+    :param user_input (str): The user's message.
+    :param project_client: An AIProjectClient.
+    :param thread_id (str): The thread to run on.
+    :param agent_id (str): The agent to run.
+    :param history (ConversationHistory): Optional, records the user's message.
+    :return: The response stream; the run starts when it is iterated.
+    :rtype: AgentResponseStream
+    """
+    message = project_client.agents.create_message(
+        thread_id=thread_id,
+        role="user",
+        content=user_input,
+    )
+    log("message_created", thread_id=thread_id, message_id=message.id)
+    if history is not None:
+        history.record(message)
+
+    return AgentResponseStream(project_client, thread_id, agent_id)
@@ -0,0 +1,150 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from telemetry import stage_latency, log
+
+# Refresh cached tokens this many seconds before they expire
+token_refresh_margin = float(os.getenv("TOKEN_REFRESH_MARGIN") or 300)
+# Use one credential instead of walking the DefaultAzureCredential chain: cli, managed_identity, environment, workload_identity
+azure_credential_type = os.getenv("AZURE_CREDENTIAL_TYPE")
+
+# Scopes the AIProjectClient requests tokens for
+project_scopes = (("https://management.azure.com/.default",), ("https://ml.azure.com/.default",))
+
+
+class BootReport:
+    """
+    Times the phases of process startup (imports, credential, client, agent, ...).
+
+    Each phase is also recorded as a boot_<phase> sample of
+    stage_latency_seconds, so a slow cold start shows up on the dashboard.
+    For a per-module breakdown of the import phase, run the app once with
+    ``python -X importtime``.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+            stage_latency.observe(seconds, stage=f"boot_{name}")
+
+    def as_dict(self):
+        report = {f"{name}_ms": round(seconds * 1000, 1) for name, seconds in self.phases.items()}
+        report["total_ms"] = round((time.perf_counter() - self.start) * 1000, 1)
+        return report
+
+    def report(self):
+        log("boot_report", sampled=False, **self.as_dict())
+
+
+# Started when the app imports this module, before its heavy imports
+boot = BootReport()
+
+
+class CachedCredential:
+    """
+    TokenCredential that fetches each token once and refreshes it in the background.
+
+    The SDK's bearer token policy refreshes a token on the request that finds
+    it close to expiry, so that request waits for the identity endpoint. Here
+    a timer refreshes it ``refresh_margin`` seconds early, and requests only
+    read the cached token. warm() fetches the tokens at boot.
+    """
+
+    def __init__(self, credential, refresh_margin=token_refresh_margin):
+        self.credential = credential
+        self.refresh_margin = refresh_margin
+        self._tokens = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def get_token(self, *scopes, **kwargs):
+        # Claims challenges and other tenants go to the wrapped credential as they are
+        if kwargs.get("claims") or kwargs.get("tenant_id"):
+            return self.credential.get_token(*scopes, **kwargs)
+        with self._lock:
+            token = self._tokens.get(scopes)
+        if token is not None and token.expires_on - time.time() > 60:
+            return token
+        return self._refresh(scopes)
+
+    def _refresh(self, scopes):
+        token = self.credential.get_token(*scopes)
+        delay = max(token.expires_on - time.time() - self.refresh_margin, 30)
+        timer = threading.Timer(delay, self._refresh_in_background, [scopes])
+        timer.daemon = True
+        with self._lock:
+            self._tokens[scopes] = token
+            previous = self._timers.pop(scopes, None)
+            self._timers[scopes] = timer
+        if previous is not None:
+            previous.cancel()
+        timer.start()
+        return token
+
+    def _refresh_in_background(self, scopes):
+        try:
+            self._refresh(scopes)
+        except Exception as e:
+            # Try again shortly; the cached token is still valid for refresh_margin seconds
+            log("token_refresh_failed", level="warning", scopes=scopes, error=str(e))
+            timer = threading.Timer(30, self._refresh_in_background, [scopes])
+            timer.daemon = True
+            with self._lock:
+                self._timers[scopes] = timer
+            timer.start()
+
+    def warm(self, *scope_sets):
+        """
+        Fetches a token for each scope set now, so the first request doesn't wait for one.
+
+        :param scope_sets (tuple[str]): The scopes of each token, e.g. project_scopes.
+        """
+        for scopes in scope_sets:
+            try:
+                self.get_token(*scopes)
+            except Exception as e:
+                # The first request fetches it instead
+                log("token_warmup_failed", level="warning", scopes=scopes, error=str(e))
+
+    def close(self):
+        with self._lock:
+            timers = list(self._timers.values())
+            self._timers.clear()
+        for timer in timers:
+            timer.cancel()
+
+
+def build_credential(credential_type=azure_credential_type):
+    """
+    Builds the app's credential, wrapped in a CachedCredential.
+
+    DefaultAzureCredential tries environment, workload identity, managed
+    identity, CLI and other credentials in turn until one works. Setting
+    AZURE_CREDENTIAL_TYPE skips straight to the one the deployment uses.
+
+    :rtype: CachedCredential
+    """
+    # Only the chosen credential class is used; azure.identity is imported here rather than by every importer
+    import azure.identity as identity
+    credential_types = {
+        "cli": identity.AzureCliCredential,
+        "managed_identity": identity.ManagedIdentityCredential,
+        "environment": identity.EnvironmentCredential,
+        "workload_identity": identity.WorkloadIdentityCredential,
+    }
+    return CachedCredential(credential_types.get(credential_type, identity.DefaultAzureCredential)())
+
+def warm_tokenizer():
+    # Load the token encoding used by the history and context packing now rather than on the first message
+    from contextpacker import count_tokens
+    count_tokens("warmup")
@@ -0,0 +1,399 @@
+from dotenv import load_dotenv
+import os
+import csv
+import sys
+import glob
+import json
+import time
+import asyncio
+import hashlib
+import inspect
+import typing
+import argparse
+import threading
+# The judge cache uses the sqlite store kept in AzureCosmosDB
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "AzureCosmosDB"))
+from sqlitestore import SqliteStore
+
+load_dotenv() # take environment variables from .env.
+
+# Runner settings, tunable from the environment
+eval_max_concurrency = int(os.getenv("EVAL_MAX_CONCURRENCY") or 16)
+eval_requests_per_minute = float(os.getenv("EVAL_REQUESTS_PER_MINUTE") or 300)
+eval_cache_path = os.getenv("EVAL_CACHE_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "Data", "output", "evalcache.sqlite")
+
+# Evaluators computed locally from the response and ground truth; they don't count against the rate limit
+local_evaluators = {"f1_score", "rouge_score", "bleu_score", "meteor_score", "gleu_score"}
+
+
+def package_version(module_name):
+    # The closest enclosing package that declares a version; azure-* packages keep it in <package>._version.VERSION
+    parts = module_name.split(".")
+    for end in range(len(parts), 0, -1):
+        prefix = ".".join(parts[:end])
+        for module in (sys.modules.get(prefix), sys.modules.get(f"{prefix}._version")):
+            version = getattr(module, "__version__", None) or getattr(module, "VERSION", None)
+            if isinstance(version, str):
+                return version
+    return ""
+
+def evaluator_version(evaluator, version=None):
+    """
+    Identifies what an evaluator's result depends on besides its inputs.
+
+    That is the evaluator class, the installed package version and a hash of
+    the prompty files shipped next to it, so upgrading the package or editing
+    a prompt invalidates the cached results. ``version`` adds an explicit tag,
+    e.g. for a custom evaluator whose prompt lives elsewhere.
+
+    :rtype: str
+    """
+    cls = type(evaluator)
+    parts = [f"{cls.__module__}.{cls.__qualname__}", package_version(cls.__module__)]
+    try:
+        folder = os.path.dirname(inspect.getfile(cls))
+        digest = hashlib.sha256()
+        for path in sorted(glob.glob(os.path.join(folder, "*.prompty"))):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        parts.append(digest.hexdigest()[:16])
+    except (TypeError, OSError):
+        pass
+    if version:
+        parts.append(str(version))
+    return "|".join(parts)
+
+def judge_key(name, version, model, inputs):
+    # Prefixed with the evaluator name, so one evaluator's results can be cleared
+    raw = json.dumps({"evaluator": name, "version": version, "model": model, "inputs": inputs}, sort_keys=True)
+    return f"{name}|{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+class JudgeCache:
+    """
+    Persistent store of evaluator results, keyed by evaluator, version, judge model and inputs.
+
+    A row evaluated before with the same evaluator and prompt is answered
+    from the sqlite file instead of calling the judge again.
+    """
+
+    def __init__(self, path=eval_cache_path):
+        self.store = SqliteStore(path, "judge_results")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.store.get(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(entry[0])
+
+    def put(self, key, result):
+        self.store.put(key, json.dumps(result).encode("utf-8"))
+
+    def clear(self, evaluator=None):
+        # Drop one evaluator's results, or everything
+        self.store.delete_prefix("" if evaluator is None else f"{evaluator}|")
+
+    def close(self):
+        self.store.close()
+
+
+class RateLimiter:
+    """
+    Token bucket spacing judge calls to at most ``requests_per_minute``, with short bursts allowed.
+    """
+
+    def __init__(self, requests_per_minute, burst=None):
+        self.rate = requests_per_minute / 60
+        self.capacity = burst or max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def read_jsonl(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def row_hash(row):
+    return hashlib.sha256(json.dumps(row, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def completed_rows(output_path, rows, versions):
+    """
+    Reads the rows an earlier (possibly interrupted) run already wrote.
+
+    A row counts as done when its inputs are unchanged and every evaluator
+    succeeded on it with the current evaluator version.
+
+    :param rows (list[dict]): The dataset rows.
+    :param versions (dict): evaluator_version() per evaluator name.
+    :return: The last result line per row index, for the rows that are done.
+    :rtype: dict[int, dict]
+    """
+    if not os.path.exists(output_path):
+        return {}
+    written = {}
+    with open(output_path, "r") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # A line cut short by the interruption
+                continue
+            written[row["row_index"]] = row
+    return {index: row for index, row in written.items()
+            if index < len(rows) and row.get("row_hash") == row_hash(rows[index])
+            and all(row.get("versions", {}).get(name) == version for name, version in versions.items())}
+
+
+class EvaluationRunner:
+    """
+    Evaluates a JSONL dataset with many evaluators, concurrently and resumably.
+
+    Every (row, evaluator) pair is a task. Tasks run in worker threads, at most
+    ``max_concurrency`` at once, and calls to LLM judges and the safety service
+    are spaced by a rate limiter. Results are cached per evaluator version and
+    inputs, so re-running after changing one evaluator only calls that one.
+    Each row is appended to the output JSONL as soon as all of its evaluators
+    are done; a restarted run skips the rows already there.
+    """
+
+    def __init__(self, evaluators, column_mapping=None, cache=None, judge_model=None, versions=None,
+                 max_concurrency=eval_max_concurrency, requests_per_minute=eval_requests_per_minute):
+        """
+        :param evaluators (dict): Evaluator callables by name, as passed to evaluate().
+        :param column_mapping (dict): Evaluator argument -> dataset column; defaults to the same name.
+        :param cache (JudgeCache): Where results are cached; None disables caching.
+        :param judge_model (str): The judge deployment, part of the cache key.
+        :param versions (dict): Optional extra version tag per evaluator name, e.g. after editing a prompt.
+        """
+        self.evaluators = evaluators
+        self.column_mapping = column_mapping or {}
+        self.cache = cache
+        self.judge_model = judge_model
+        self.versions = {name: evaluator_version(evaluator, (versions or {}).get(name))
+                         for name, evaluator in evaluators.items()}
+        self.parameters = {name: self._parameters(evaluator) for name, evaluator in evaluators.items()}
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.stats = {"rows": 0, "resumed": 0, "cached": 0, "called": 0, "errors": 0}
+
+    def _parameters(self, evaluator):
+        """
+        Lists the input sets an evaluator accepts, as (parameters, required parameters) pairs.
+
+        azure-ai-evaluation evaluators are called as ``(*args, **kwargs)`` and
+        declare their inputs as typing overloads (e.g. groundedness takes
+        response/context/query, or a conversation), so those are read first.
+        Plain functions and classes with an explicit ``__call__`` are read from
+        their signature. None means the inputs aren't known.
+        """
+        call = evaluator if inspect.isfunction(evaluator) else type(evaluator).__call__
+        get_overloads = getattr(typing, "get_overloads", None)
+        signatures = []
+        for function in (get_overloads(call) if get_overloads else []) or [call]:
+            try:
+                signatures.append(inspect.signature(function))
+            except (TypeError, ValueError):
+                return None
+        input_sets = []
+        for signature in signatures:
+            if any(parameter.kind == parameter.VAR_KEYWORD for parameter in signature.parameters.values()):
+                return None
+            parameters = [parameter for name, parameter in signature.parameters.items()
+                          if name != "self" and parameter.kind in (parameter.KEYWORD_ONLY,
+                                                                   parameter.POSITIONAL_OR_KEYWORD)]
+            input_sets.append(([parameter.name for parameter in parameters],
+                               [parameter.name for parameter in parameters if parameter.default is parameter.empty]))
+        return input_sets
+
+    def inputs_for(self, name, row):
+        # Pass only the arguments the evaluator takes, so an unrelated column doesn't change its cache key
+        input_sets = self.parameters[name] or [(["query", "response", "context", "ground_truth"], [])]
+        columns = {parameter: self.column_mapping.get(parameter, parameter)
+                   for parameters, required in input_sets for parameter in parameters}
+        # The first input set whose required columns the row has, e.g. response/context rather than conversation
+        parameters = next((parameters for parameters, required in input_sets
+                           if all(columns[parameter] in row for parameter in required)), input_sets[0][0])
+        return {parameter: row[columns[parameter]] for parameter in parameters if columns[parameter] in row}
+
+    async def evaluate_one(self, name, row, semaphore, limiter):
+        evaluator = self.evaluators[name]
+        inputs = self.inputs_for(name, row)
+        key = judge_key(name, self.versions[name], self.judge_model, inputs)
+        if self.cache is not None:
+            result = await asyncio.to_thread(self.cache.get, key)
+            if result is not None:
+                self.stats["cached"] += 1
+                return result
+
+        async with semaphore:
+            if name not in local_evaluators:
+                await limiter.acquire()
+            try:
+                result = await asyncio.to_thread(evaluator, **inputs)
+            except Exception as e:
+                # Not cached, so a re-run tries this pair again
+                self.stats["errors"] += 1
+                return {"error": f"{type(e).__name__}: {e}"}
+        self.stats["called"] += 1
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, key, result)
+        return result
+
+    async def evaluate_row(self, index, row, semaphore, limiter, write):
+        names = list(self.evaluators)
+        results = await asyncio.gather(*(self.evaluate_one(name, row, semaphore, limiter) for name in names))
+        record = {"row_index": index, "row_hash": row_hash(row), "versions": {}}
+        record.update({f"inputs.{column}": value for column, value in row.items()})
+        for name, result in zip(names, results):
+            if not (isinstance(result, dict) and "error" in result and len(result) == 1):
+                record["versions"][name] = self.versions[name]
+            for key, value in (result or {}).items():
+                record[f"outputs.{name}.{key}"] = value
+        write(record)
+
+    async def run_async(self, data_path, output_path):
+        """
+        Evaluates every row of data_path that output_path doesn't hold yet.
+
+        :return: The result rows in dataset order, one per input row.
+        :rtype: list[dict]
+        """
+        rows = read_jsonl(data_path)
+        done = completed_rows(output_path, rows, self.versions)
+        self.stats["rows"] = len(rows)
+        self.stats["resumed"] = len(done)
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        limiter = RateLimiter(self.requests_per_minute)
+        write_lock = threading.Lock()
+        results = dict(done)
+
+        with open(output_path, "a") as output:
+            def write(record):
+                with write_lock:
+                    output.write(json.dumps(record, default=str) + "\n")
+                    output.flush()
+                    results[record["row_index"]] = record
+
+            await asyncio.gather(*(self.evaluate_row(index, row, semaphore, limiter, write)
+                                   for index, row in enumerate(rows) if index not in done))
+
+        return [results[index] for index in sorted(results)]
+
+    def run(self, data_path, output_path):
+        start = time.perf_counter()
+        rows = asyncio.run(self.run_async(data_path, output_path))
+        self.stats["elapsed_s"] = round(time.perf_counter() - start, 1)
+        if self.cache is not None:
+            self.stats["cache_hit_rate"] = round(self.cache.hits / max(self.cache.hits + self.cache.misses, 1), 3)
+        return rows
+
+
+def write_csv(rows, path):
+    """
+    Writes result rows to a CSV laid out like evaluate()'s rows (inputs.*, then outputs.*).
+    """
+    columns = []
+    for row in rows:
+        for column in row:
+            if column not in ("row_index", "row_hash", "versions") and column not in columns:
+                columns.append(column)
+    columns.sort(key=lambda column: not column.startswith("inputs."))
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+def build_evaluators(model_config, azure_ai_project=None, credential=None, names=None):
+    """
+    Builds the evaluators used in 02_RAG-Evaluation.ipynb, optionally only the named ones.
+
+    :rtype: dict
+    """
+    from azure.ai.evaluation import (GroundednessEvaluator, RetrievalEvaluator, RelevanceEvaluator, CoherenceEvaluator,
+                                     FluencyEvaluator, SimilarityEvaluator, F1ScoreEvaluator, RougeScoreEvaluator,
+                                     RougeType, BleuScoreEvaluator, MeteorScoreEvaluator, GleuScoreEvaluator)
+    factories = {
+        "groundedness": lambda: GroundednessEvaluator(model_config),
+        "retrieval": lambda: RetrievalEvaluator(model_config),
+        "relevance": lambda: RelevanceEvaluator(model_config),
+        "coherence": lambda: CoherenceEvaluator(model_config),
+        "fluency": lambda: FluencyEvaluator(model_config),
+        "similarity": lambda: SimilarityEvaluator(model_config),
+        "f1_score": lambda: F1ScoreEvaluator(),
+        "rouge_score": lambda: RougeScoreEvaluator(rouge_type=RougeType.ROUGE_1),
+        "bleu_score": lambda: BleuScoreEvaluator(),
+        "meteor_score": lambda: MeteorScoreEvaluator(alpha=0.9, beta=3.0, gamma=0.5),
+        "gleu_score": lambda: GleuScoreEvaluator(),
+    }
+    if azure_ai_project is not None:
+        from azure.ai.evaluation import ViolenceEvaluator, HateUnfairnessEvaluator, SelfHarmEvaluator, SexualEvaluator
+        if credential is None:
+            from azure.identity import DefaultAzureCredential
+            credential = DefaultAzureCredential()
+        factories.update({
+            "violence_score": lambda: ViolenceEvaluator(azure_ai_project=azure_ai_project, credential=credential),
+            "hateunfairness_score": lambda: HateUnfairnessEvaluator(azure_ai_project=azure_ai_project, credential=credential),
+            "selfharm_score": lambda: SelfHarmEvaluator(azure_ai_project=azure_ai_project, credential=credential),
+            "sexual_score": lambda: SexualEvaluator(azure_ai_project=azure_ai_project, credential=credential),
+        })
+    return {name: factory() for name, factory in factories.items() if names is None or name in names}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the RAG evaluators over a JSONL dataset, concurrently and resumably.")
+    parser.add_argument("--data", default="../Data/output/nasaeval.jsonl")
+    parser.add_argument("--output", default="../Data/output/nasaevalresult.jsonl",
+                        help="Result rows are appended here as they finish; re-running resumes from it")
+    parser.add_argument("--csv", default="../Data/output/nasaevalresult.csv")
+    parser.add_argument("--evaluators", nargs="+", default=None, help="Only run these evaluators")
+    parser.add_argument("--no-safety", action="store_true", help="Skip the safety evaluators")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--max-concurrency", type=int, default=eval_max_concurrency)
+    parser.add_argument("--requests-per-minute", type=float, default=eval_requests_per_minute)
+    args = parser.parse_args()
+
+    azure_openai_deployment = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME")
+    model_config = {
+        "azure_endpoint": os.getenv("AZURE_OPENAI_ENDPOINT"),
+        "api_key": os.getenv("AZURE_OPENAI_API_KEY"),
+        "azure_deployment": azure_openai_deployment,
+    }
+    azure_ai_project = None if args.no_safety else {
+        "subscription_id": os.getenv("AZURE_SUBSCRIPTION_ID"),
+        "resource_group_name": os.getenv("AZURE_RESOURCE_GROUP_NAME"),
+        "project_name": os.getenv("AZURE_PROJECT_NAME"),
+    }
+
+    runner = EvaluationRunner(build_evaluators(model_config, azure_ai_project, names=args.evaluators),
+                              cache=None if args.no_cache else JudgeCache(),
+                              judge_model=azure_openai_deployment,
+                              max_concurrency=args.max_concurrency,
+                              requests_per_minute=args.requests_per_minute)
+    rows = runner.run(args.data, args.output)
+    write_csv(rows, args.csv)
+    print(json.dumps(runner.stats))
+    print(f"Results have been saved to {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+from dotenv import load_dotenv
+import os
+import re
+import sys
+import json
+import string
+import argparse
+import threading
+from itertools import chain
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+load_dotenv() # take environment variables from .env.
+
+# Worker processes for large datasets, and the rows each one scores at a time
+lexical_workers = int(os.getenv("LEXICAL_METRIC_WORKERS") or os.cpu_count() or 1)
+lexical_chunk_rows = int(os.getenv("LEXICAL_METRIC_CHUNK_ROWS") or 500)
+
+# The local evaluators this engine computes, by their name in evaluate() / evalrunner
+lexical_metrics = ("f1_score", "rouge_score", "bleu_score", "gleu_score", "meteor_score")
+
+# SQuAD normalization used by F1ScoreEvaluator
+_punctuation = str.maketrans("", "", string.punctuation)
+_articles = re.compile(r"\b(a|an|the)\b")
+# Tokenization used by RougeScoreEvaluator (the vendored rouge_score, without stemming)
+_non_alphanum = re.compile(r"[^a-z0-9]+")
+
+_nltk_lock = threading.Lock()
+_nltk_ready = False
+_nist_tokenizer = None
+
+
+def ensure_nltk_data():
+    # The evaluators check for the NLTK data on every call; once per process is enough
+    global _nltk_ready
+    if _nltk_ready:
+        return
+    import nltk
+    with _nltk_lock:
+        for package, resource in (("wordnet", "corpora/wordnet.zip"), ("perluniprops", "misc/perluniprops.zip"),
+                                  ("punkt", "tokenizers/punkt.zip"), ("punkt_tab", "tokenizers/punkt_tab.zip")):
+            try:
+                nltk.find(resource)
+            except LookupError:
+                nltk.download(package, quiet=True)
+        _nltk_ready = True
+
+def nltk_tokens(text):
+    # The tokens BleuScoreEvaluator, GleuScoreEvaluator and MeteorScoreEvaluator score
+    global _nist_tokenizer
+    if not text.isascii():
+        if _nist_tokenizer is None:
+            from nltk.tokenize.nist import NISTTokenizer
+            _nist_tokenizer = NISTTokenizer()
+        return list(_nist_tokenizer.international_tokenize(text))
+    import nltk
+    return list(nltk.word_tokenize(text))
+
+def squad_tokens(text):
+    # Lowercase, drop punctuation and articles, split on whitespace (F1ScoreEvaluator)
+    return _articles.sub(" ", text.lower().translate(_punctuation)).split()
+
+def rouge_tokens(text):
+    # Everything but [a-z0-9] becomes a space, so splitting on whitespace leaves only valid tokens
+    return _non_alphanum.sub(" ", text.lower()).split()
+
+
+def ngram_overlaps(responses, references, orders):
+    """
+    Counts clipped n-gram matches between each response and its reference, for every order at once.
+
+    Tokens are mapped to integer ids over the whole batch and each n-gram of
+    order n gets an id built from its (n-1)-gram prefix id and its last token,
+    so n-grams are compared as integers. Per-row counts are then a sparse
+    (row, n-gram) -> count table built with np.unique, and the clipped match
+    count of a row is the sum over n-grams of min(response count, reference count).
+
+    :param responses (list[list[str]]): The tokens of each response.
+    :param references (list[list[str]]): The tokens of each reference, row for row.
+    :param orders (int): The highest n-gram order counted.
+    :return: matches, response n-grams and reference n-grams, each an int array of shape (orders, rows).
+    :rtype: tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    rows = len(responses)
+    sequences = responses + references
+    # dict.fromkeys and map keep the per-token work out of the interpreter loop
+    vocabulary = dict.fromkeys(chain.from_iterable(sequences))
+    vocabulary = dict(zip(vocabulary, range(len(vocabulary))))
+    tokens = np.fromiter(map(vocabulary.__getitem__, chain.from_iterable(sequences)), dtype=np.int64)
+    lengths = np.fromiter((len(sequence) for sequence in sequences), dtype=np.int64, count=len(sequences))
+    sequence_of = np.repeat(np.arange(len(sequences), dtype=np.int64), lengths)
+    # Tokens left in the sequence from each position, including the token itself
+    remaining = np.repeat(lengths, lengths) - (np.arange(len(tokens)) - np.repeat(np.cumsum(lengths) - lengths, lengths))
+
+    matches = np.zeros((orders, rows), dtype=np.int64)
+    response_totals = np.zeros((orders, rows), dtype=np.int64)
+    reference_totals = np.zeros((orders, rows), dtype=np.int64)
+    starts = np.arange(len(tokens), dtype=np.int64)
+    grams = tokens
+    for n in range(1, orders + 1):
+        if n > 1:
+            # Extend each (n-1)-gram that has room by one token, then renumber densely to keep ids small
+            keep = remaining[starts] >= n
+            starts = starts[keep]
+            extended = grams[keep] * (len(vocabulary) + 1) + tokens[starts + n - 1]
+            grams = np.unique(extended, return_inverse=True)[1].astype(np.int64)
+        if len(starts) == 0:
+            break
+        sequence = sequence_of[starts]
+        is_reference = sequence >= rows
+        row = np.where(is_reference, sequence - rows, sequence)
+        width = int(grams.max()) + 1
+        keys = row * width + grams
+        response_keys, response_counts = np.unique(keys[~is_reference], return_counts=True)
+        reference_keys, reference_counts = np.unique(keys[is_reference], return_counts=True)
+        _, in_response, in_reference = np.intersect1d(response_keys, reference_keys, assume_unique=True,
+                                                      return_indices=True)
+        clipped = np.minimum(response_counts[in_response], reference_counts[in_reference])
+        matches[n - 1] = np.bincount(response_keys[in_response] // width, weights=clipped, minlength=rows)
+        response_totals[n - 1] = np.bincount(row[~is_reference], minlength=rows)
+        reference_totals[n - 1] = np.bincount(row[is_reference], minlength=rows)
+    return matches, response_totals, reference_totals
+
+
+def f1_scores(response_tokens, reference_tokens):
+    matches, predicted, actual = (counts[0] for counts in ngram_overlaps(response_tokens, reference_tokens, 1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = 1.0 * matches / predicted
+        recall = 1.0 * matches / actual
+        f1 = (2.0 * precision * recall) / (precision + recall)
+    return {"f1_score": np.where(matches > 0, f1, 0.0)}
+
+def rouge_scores(response_tokens, reference_tokens, n=1):
+    matches, predicted, actual = (counts[n - 1] for counts in ngram_overlaps(response_tokens, reference_tokens, n))
+    precision = matches / np.maximum(predicted, 1)
+    recall = matches / np.maximum(actual, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fmeasure = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return {"rouge_precision": precision, "rouge_recall": recall, "rouge_f1_score": fmeasure}
+
+def bleu_and_gleu_scores(response_tokens, reference_tokens):
+    """
+    Sentence BLEU (uniform 4-gram weights, smoothing method 4) and sentence GLEU, from one overlap count.
+
+    :return: {"bleu_score": array, "gleu_score": array}
+    :rtype: dict
+    """
+    matches, predicted, actual = ngram_overlaps(response_tokens, reference_tokens, 4)
+    response_length = predicted[0].astype(np.float64)
+    reference_length = actual[0].astype(np.float64)
+
+    # Modified precision per order; an order without matches gets the method 4 count,
+    # 1 / (2^k * 5 / ln(len)) where k numbers the unmatched orders of the row
+    denominators = np.maximum(predicted, 1).astype(np.float64)
+    unmatched = matches == 0
+    k = np.cumsum(unmatched, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        smoothed = 1.0 / (2.0 ** k * 5 / np.log(response_length)) / denominators
+        precisions = np.where(unmatched, np.where(response_length > 1, smoothed, 0.0), matches / denominators)
+        log_precisions = np.where(precisions > 0, 0.25 * np.log(precisions), 0.0)
+        brevity_penalty = np.where(response_length > reference_length, 1.0,
+                                   np.exp(1 - reference_length / response_length))
+    bleu = np.where(matches[0] > 0, brevity_penalty * np.exp(log_precisions.sum(axis=0)), 0.0)
+
+    # GLEU pools the matches of orders 1 to 4 over the larger of the two n-gram counts
+    pooled = np.maximum(predicted.sum(axis=0), actual.sum(axis=0))
+    gleu = np.where(pooled > 0, matches.sum(axis=0) / np.maximum(pooled, 1), 0.0)
+    return {"bleu_score": bleu, "gleu_score": gleu}
+
+def meteor_scores(response_tokens, reference_tokens, alpha=0.9, beta=3.0, gamma=0.5):
+    # METEOR aligns stems and WordNet synonyms, which doesn't reduce to n-gram counts; it reuses the BLEU tokens
+    from nltk.translate.meteor_score import meteor_score
+    return {"meteor_score": np.array([meteor_score([reference], response, alpha=alpha, beta=beta, gamma=gamma)
+                                      for response, reference in zip(response_tokens, reference_tokens)],
+                                     dtype=np.float64)}
+
+
+def score_chunk(responses, references, metrics=lexical_metrics, rouge_n=1):
+    """
+    Scores one chunk of rows in this process, tokenizing each text once per tokenizer.
+
+    :return: Score arrays by evaluator name, then by result key.
+    :rtype: dict[str, dict[str, np.ndarray]]
+    """
+    results = {}
+    if "f1_score" in metrics:
+        results["f1_score"] = f1_scores([squad_tokens(text) for text in responses],
+                                        [squad_tokens(text) for text in references])
+    if "rouge_score" in metrics:
+        results["rouge_score"] = rouge_scores([rouge_tokens(text) for text in responses],
+                                              [rouge_tokens(text) for text in references], rouge_n)
+    if {"bleu_score", "gleu_score", "meteor_score"} & set(metrics):
+        ensure_nltk_data()
+        # Shared by BLEU, GLEU and METEOR, which each tokenize again when called per row
+        response_tokens = [nltk_tokens(text) for text in responses]
+        reference_tokens = [nltk_tokens(text) for text in references]
+        if {"bleu_score", "gleu_score"} & set(metrics):
+            scores = bleu_and_gleu_scores(response_tokens, reference_tokens)
+            results.update({name: {name: scores[name]} for name in ("bleu_score", "gleu_score") if name in metrics})
+        if "meteor_score" in metrics:
+            results["meteor_score"] = meteor_scores(response_tokens, reference_tokens)
+    return results
+
+def score_rows(rows, metrics=lexical_metrics, response_column="response", ground_truth_column="ground_truth",
+               rouge_type="rouge1", workers=lexical_workers, chunk_rows=lexical_chunk_rows):
+    """
+    Computes the lexical evaluators over a whole dataset.
+
+    Gives the same scores as calling F1ScoreEvaluator, RougeScoreEvaluator,
+    BleuScoreEvaluator, GleuScoreEvaluator and MeteorScoreEvaluator (with the
+    notebook's settings) on each row. Datasets larger than ``chunk_rows`` are
+    split into chunks scored in ``workers`` processes.
+
+    :param rows (list[dict]): The dataset rows.
+    :param metrics (tuple[str]): Which of lexical_metrics to compute.
+    :param rouge_type (str): rouge1 to rouge9; the notebooks use rouge1.
+    :return: One dict per row, evaluator name -> result key -> score, as the evaluators return them.
+    :rtype: list[dict]
+    """
+    unknown = set(metrics) - set(lexical_metrics)
+    if unknown:
+        raise ValueError(f"Not a lexical metric: {', '.join(sorted(unknown))}")
+    rouge_type = getattr(rouge_type, "value", rouge_type)
+    if not re.fullmatch(r"rouge[1-9]", rouge_type):
+        raise ValueError(f"Only ROUGE-N is computed in batch, not {rouge_type}; use RougeScoreEvaluator")
+
+    responses = [str(row.get(response_column) or "") for row in rows]
+    references = [str(row.get(ground_truth_column) or "") for row in rows]
+    rouge_n = int(rouge_type[5:])
+    bounds = [(start, min(start + chunk_rows, len(rows))) for start in range(0, len(rows), max(chunk_rows, 1))]
+    if workers > 1 and len(bounds) > 1:
+        with ProcessPoolExecutor(min(workers, len(bounds))) as pool:
+            chunks = list(pool.map(score_chunk, *zip(*[(responses[start:end], references[start:end], metrics, rouge_n)
+                                                       for start, end in bounds])))
+    else:
+        chunks = [score_chunk(responses[start:end], references[start:end], metrics, rouge_n) for start, end in bounds]
+
+    results = [{} for _ in rows]
+    for (start, end), chunk in zip(bounds, chunks):
+        for name, scores in chunk.items():
+            for key, values in scores.items():
+                for offset, value in enumerate(values.tolist()):
+                    results[start + offset].setdefault(name, {})[key] = value
+    return results
+
+
+def main():
+    from evalrunner import read_jsonl, write_csv
+    parser = argparse.ArgumentParser(description="Compute the lexical evaluators over a whole JSONL dataset in batch.")
+    parser.add_argument("--data", default="../Data/output/nasaeval.jsonl")
+    parser.add_argument("--output", default="../Data/output/nasaevallexical.jsonl")
+    parser.add_argument("--csv", default=None)
+    parser.add_argument("--metrics", nargs="+", default=list(lexical_metrics), choices=lexical_metrics)
+    parser.add_argument("--workers", type=int, default=lexical_workers)
+    parser.add_argument("--chunk-rows", type=int, default=lexical_chunk_rows)
+    args = parser.parse_args()
+
+    rows = read_jsonl(args.data)
+    scores = score_rows(rows, tuple(args.metrics), workers=args.workers, chunk_rows=args.chunk_rows)
+    records = []
+    for index, (row, result) in enumerate(zip(rows, scores)):
+        record = {"row_index": index}
+        record.update({f"inputs.{column}": value for column, value in row.items()})
+        record.update({f"outputs.{name}.{key}": value for name, values in result.items() for key, value in values.items()})
+        records.append(record)
+    with open(args.output, "w") as f:
+        for record in records:
+            f.write(json.dumps(record, default=str) + "\n")
+    if args.csv:
+        write_csv(records, args.csv)
+    print(f"Scored {len(rows)} rows; results have been saved to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+from dotenv import load_dotenv
+import os
+import sys
+import glob
+import time
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+# The vector cache and the top-k selection are shared with AzureCosmosDB
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "AzureCosmosDB"))
+from sqlitestore import SqliteStore
+from localindex import top_k
+
+load_dotenv() # take environment variables from .env.
+
+azure_computer_vision_endpoint = os.getenv("AZURE_COMPUTER_VISION_ENDPOINT")
+azure_computer_vision_key = os.getenv("AZURE_COMPUTER_VISION_KEY")
+vision_api_version = "2024-02-01"
+vision_model_version = os.getenv("VISION_MODEL_VERSION") or "2023-04-15"
+
+# Concurrent vectorize requests, and the sqlite file vectors are kept in between runs
+vision_max_concurrency = int(os.getenv("VISION_MAX_CONCURRENCY") or 8)
+vision_embedding_cache_path = os.getenv("VISION_EMBEDDING_CACHE_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "Data", "output", "imageembeddings.sqlite")
+
+image_extensions = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tiff", ".webp")
+default_image_patterns = ["../Data/customclassification*/**/*", "../Data/face/**/*"]
+
+
+def content_key(kind, content, model_version):
+    # Keyed by content rather than path, so a renamed or copied file is not vectorized again
+    digest = hashlib.sha256(content).hexdigest()
+    return f"{kind}|{model_version}|{digest}"
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def retry_after_seconds(response, attempt):
+    # Retry-After is either seconds or an HTTP date; back off exponentially when it is missing or unreadable
+    value = response.headers.get("Retry-After")
+    if value:
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+        except (TypeError, ValueError):
+            pass
+    return float(2 ** attempt)
+
+
+class ImageVectorCache:
+    """
+    sqlite file of float32 vectors keyed by content hash and model version.
+    """
+
+    def __init__(self, path):
+        self.store = SqliteStore(path, "image_vectors")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.store.get(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return np.frombuffer(entry[0], dtype=np.float32)
+
+    def put(self, key, vector):
+        self.store.put(key, np.asarray(vector, dtype=np.float32).tobytes())
+
+    def close(self):
+        self.store.close()
+
+
+class VisionEmbeddingClient:
+    """
+    Calls the Azure AI Vision multimodal embeddings API over one pooled HTTP session.
+
+    vectorizeImage and vectorizeText requests reuse the session's keep-alive
+    connections, run up to ``max_concurrency`` at a time, and are retried on
+    429 after the Retry-After delay. Vectors are cached by the content's hash
+    and the model version, so unchanged images are not vectorized again on the
+    next run, and a new model version re-vectorizes everything.
+    """
+
+    def __init__(self, endpoint=azure_computer_vision_endpoint, key=azure_computer_vision_key,
+                 model_version=vision_model_version, cache_path=vision_embedding_cache_path,
+                 max_concurrency=vision_max_concurrency, max_attempts=5):
+        self.endpoint = (endpoint or "").rstrip("/")
+        self.model_version = model_version
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.session = requests.Session()
+        self.session.headers["Ocp-Apim-Subscription-Key"] = key or ""
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.cache = ImageVectorCache(cache_path) if cache_path else None
+        self.stats = {"requests": 0, "cached": 0, "throttled": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _post(self, operation, **kwargs):
+        url = f"{self.endpoint}/computervision/retrieval:{operation}"
+        params = {"api-version": vision_api_version, "model-version": self.model_version}
+        for attempt in range(self.max_attempts):
+            response = self.session.post(url, params=params, timeout=60, **kwargs)
+            self._count("requests")
+            if response.status_code != 429 or attempt == self.max_attempts - 1:
+                break
+            self._count("throttled")
+            time.sleep(retry_after_seconds(response, attempt))
+        response.raise_for_status()
+        return np.asarray(response.json()["vector"], dtype=np.float32)
+
+    def _cached(self, key, compute):
+        if self.cache is not None:
+            vector = self.cache.get(key)
+            if vector is not None:
+                self._count("cached")
+                return vector
+        vector = compute()
+        if self.cache is not None:
+            self.cache.put(key, vector)
+        return vector
+
+    def vectorize_image(self, image_source, is_url=False):
+        """
+        Vectorizes an image file, or an image URL when is_url is True.
+
+        :return: The image's embedding.
+        :rtype: np.ndarray
+        """
+        if is_url:
+            return self._cached(content_key("url", image_source.encode("utf-8"), self.model_version),
+                                lambda: self._post("vectorizeImage", json={"url": image_source}))
+        with open(image_source, "rb") as image_file:
+            image_data = image_file.read()
+        return self._cached(content_key("image", image_data, self.model_version),
+                            lambda: self._post("vectorizeImage", data=image_data,
+                                               headers={"Content-Type": "application/octet-stream"}))
+
+    def vectorize_text(self, text):
+        return self._cached(content_key("text", text.encode("utf-8"), self.model_version),
+                            lambda: self._post("vectorizeText", json={"text": text}))
+
+    def vectorize_images(self, image_sources, is_url=False):
+        """
+        Vectorizes many images concurrently.
+
+        :return: A float32 matrix with one L2-normalized row per image, in order.
+        :rtype: np.ndarray
+        """
+        if not image_sources:
+            return np.empty((0, 0), dtype=np.float32)
+        with ThreadPoolExecutor(self.max_concurrency) as pool:
+            vectors = list(pool.map(lambda source: self.vectorize_image(source, is_url), image_sources))
+        return normalize_rows(np.vstack(vectors).astype(np.float32))
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+def find_images(patterns=None):
+    return sorted({path for pattern in patterns or default_image_patterns
+                   for path in glob.glob(pattern, recursive=True)
+                   if os.path.isfile(path) and path.lower().endswith(image_extensions)})
+
+
+class ImageIndex:
+    """
+    Nearest-neighbour search over image embeddings kept in one normalized float32 matrix.
+
+    Rows are L2-normalized, so the cosine similarity of a query against every
+    image is one matrix-vector product, and of every image against every
+    other one matrix product.
+    """
+
+    def __init__(self, paths, matrix, client=None):
+        self.paths = paths
+        self.matrix = matrix
+        self.client = client
+
+    @classmethod
+    def build(cls, client, patterns=None):
+        """
+        Vectorizes every image matching the glob patterns (cached ones are read from disk).
+
+        :param patterns (list[str]): Defaults to Data/customclassification* and Data/face.
+        :rtype: ImageIndex
+        """
+        paths = find_images(patterns)
+        return cls(paths, client.vectorize_images(paths), client)
+
+    def search_vector(self, vector, k=5):
+        query = normalize_rows(np.asarray(vector, dtype=np.float32))
+        scores = self.matrix @ query
+        return [(self.paths[row], float(scores[row])) for row in top_k(scores, k)]
+
+    def search_text(self, text, k=5):
+        return self.search_vector(self.client.vectorize_text(text), k)
+
+    def search_image(self, image_source, k=5, is_url=False):
+        return self.search_vector(self.client.vectorize_image(image_source, is_url), k)
+
+    def similarities(self):
+        """
+        Cosine similarity of every image against every other one.
+
+        :rtype: np.ndarray
+        """
+        return self.matrix @ self.matrix.T
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorize the sample images and find the nearest ones to a text or image.")
+    parser.add_argument("--images", nargs="+", default=default_image_patterns, help="Glob patterns of images to index")
+    parser.add_argument("--text", help="Find the images closest to this text")
+    parser.add_argument("--image", help="Find the images closest to this image file")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--max-concurrency", type=int, default=vision_max_concurrency)
+    args = parser.parse_args()
+
+    client = VisionEmbeddingClient(max_concurrency=args.max_concurrency)
+    try:
+        start = time.perf_counter()
+        index = ImageIndex.build(client, args.images)
+        print(f"Indexed {len(index.paths)} images in {time.perf_counter() - start:.2f}s "
+              f"({client.stats['requests']} requests, {client.stats['cached']} from cache)", file=sys.stderr)
+        if args.text:
+            results = index.search_text(args.text, args.k)
+        elif args.image:
+            results = index.search_image(args.image, args.k)
+        else:
+            return
+        for path, score in results:
+            print(f"{score:.4f}  {path}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
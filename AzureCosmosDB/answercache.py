@@ -0,0 +1,196 @@
+from dotenv import load_dotenv
+import os
+import json
+import time
+import threading
+import numpy as np
+
+load_dotenv() # take environment variables from .env.
+
+# Cache settings, tunable from the environment. The cache is opt-in: a close paraphrase gets
+# another query's answer and sources, so it stays off (size 0) unless ANSWER_CACHE_SIZE is set
+answer_cache_size = int(os.getenv("ANSWER_CACHE_SIZE") or 0)
+answer_cache_threshold = float(os.getenv("ANSWER_CACHE_THRESHOLD") or 0.95)
+answer_cache_ttl = float(os.getenv("ANSWER_CACHE_TTL") or 86400)  # 1 day
+# Manifest written by ingest.py --incremental; entries citing a changed document are dropped
+answer_cache_manifest = os.getenv("ANSWER_CACHE_MANIFEST")
+
+
+class SemanticAnswerCache:
+    """
+    Reuses generated answers for queries whose embeddings are close enough.
+
+    Query embeddings are L2-normalized into a preallocated float32 matrix, so
+    a lookup is one matrix-vector product over at most ``capacity`` rows. When
+    the cache is full, the least recently used entry is evicted. Each entry
+    keeps the ids of the documents it cited; invalidate_sources() drops those
+    entries, and so does a change to the ingestion manifest's hash for any
+    cited document.
+    """
+
+    def __init__(self, capacity=answer_cache_size, threshold=answer_cache_threshold, ttl=answer_cache_ttl,
+                 dimensions=1536, manifest_path=answer_cache_manifest, manifest_check_interval=5.0):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.matrix = np.zeros((capacity, dimensions), dtype=np.float32)
+        self.used = np.zeros(capacity, dtype=bool)
+        self.expires = np.zeros(capacity, dtype=np.float64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.entries = [None] * capacity
+        self.by_source = {}
+        self.manifest_path = manifest_path
+        self.manifest_check_interval = manifest_check_interval
+        self._manifest_mtime = None
+        self._manifest_checked = 0.0
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lookup_ms = 0.0
+        self.saved_ms = 0.0
+
+    @property
+    def enabled(self):
+        return self.capacity > 0
+
+    def _normalize(self, embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, slot):
+        entry = self.entries[slot]
+        for source_id in entry["versions"]:
+            slots = self.by_source.get(source_id)
+            if slots is not None:
+                slots.discard(slot)
+                if not slots:
+                    del self.by_source[source_id]
+        self.entries[slot] = None
+        self.used[slot] = False
+
+    def _check_manifest(self, now):
+        # Called with the lock held; stat the manifest at most every few seconds
+        if not self.manifest_path or now - self._manifest_checked < self.manifest_check_interval:
+            return
+        self._manifest_checked = now
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._manifest_mtime:
+            return
+        with open(self.manifest_path, "r", encoding="utf-8") as file:
+            self._versions = json.load(file).get("documents", {})
+        self._manifest_mtime = mtime
+        for slot in np.flatnonzero(self.used):
+            versions = self.entries[slot]["versions"]
+            if any(self._versions.get(source_id) != version for source_id, version in versions.items()):
+                self._remove(slot)
+                self.invalidations += 1
+
+    def lookup(self, embedding):
+        """
+        Returns the cached entry most similar to the query embedding, if it clears the threshold.
+
+        :param embedding (list[float]): The query embedding.
+        :return: The entry (query, answer, sources, similarity), or None on a miss.
+        :rtype: dict
+        """
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        query = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            self._check_manifest(now)
+            hit = None
+            valid = self.used & (self.expires > now)
+            if valid.any():
+                scores = self.matrix @ query
+                scores[~valid] = -np.inf
+                slot = int(np.argmax(scores))
+                if scores[slot] >= self.threshold:
+                    self.last_used[slot] = now
+                    hit = dict(self.entries[slot], similarity=float(scores[slot]))
+            elapsed = (time.perf_counter() - start) * 1000
+            self.lookup_ms += elapsed
+            if hit is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.saved_ms += max(hit["generation_ms"] - elapsed, 0.0)
+        return hit
+
+    def put(self, query, embedding, answer, sources, generation_ms):
+        """
+        Stores a generated answer with the documents it was grounded on.
+
+        :param query (str): The user's query.
+        :param embedding (list[float]): The query embedding.
+        :param answer (str): The generated answer.
+        :param sources (list[dict]): The retrieved documents; each needs an "id".
+        :param generation_ms (float): Retrieval plus completion time, reported as saved on later hits.
+        """
+        if not self.enabled:
+            return
+        vector = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            self._check_manifest(now)
+            free = np.flatnonzero(~self.used | (self.expires <= now))
+            if len(free):
+                slot = int(free[0])
+                if self.used[slot]:
+                    self._remove(slot)
+            else:
+                slot = int(np.argmin(self.last_used))
+                self._remove(slot)
+                self.evictions += 1
+            versions = {source["id"]: self._versions.get(source["id"]) for source in sources if "id" in source}
+            self.matrix[slot] = vector
+            self.used[slot] = True
+            self.expires[slot] = now + self.ttl
+            self.last_used[slot] = now
+            self.entries[slot] = {"query": query, "answer": answer, "sources": sources,
+                                  "versions": versions, "generation_ms": generation_ms}
+            for source_id in versions:
+                self.by_source.setdefault(source_id, set()).add(slot)
+
+    def invalidate_sources(self, source_ids):
+        """
+        Drops every cached answer that cited one of the given documents.
+
+        :return: The number of entries dropped.
+        :rtype: int
+        """
+        with self._lock:
+            slots = set()
+            for source_id in source_ids:
+                slots |= self.by_source.get(source_id, set())
+            for slot in slots:
+                self._remove(slot)
+            self.invalidations += len(slots)
+            return len(slots)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": int(self.used.sum()), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "evictions": self.evictions, "invalidations": self.invalidations,
+                    "average_lookup_ms": self.lookup_ms / lookups if lookups else 0.0,
+                    "saved_ms": self.saved_ms}
+
+    def clear(self):
+        with self._lock:
+            self.used[:] = False
+            self.entries = [None] * self.capacity
+            self.by_source.clear()
+
+
+# Shared by every RAG call in the process
+answer_cache = SemanticAnswerCache()
@@ -1,7 +1,15 @@
-from openai import AzureOpenAI
 from dotenv import load_dotenv
 import os
-from azure.cosmos import CosmosClient
+import time
+import asyncio
+from clientpool import get_container_client, get_openai_client, get_async_container_client, get_async_openai_client
+from embeddingcache import embedding_cache
+from answercache import answer_cache
+from contextpacker import pack_context
+from telemetry import span, traced, record_usage, log
+from cosmosquery import (build_hybrid_query, build_inline_hybrid_query, build_vector_query,
+                         build_full_text_query, rrf_fuse, run_query, run_query_async)
+from streaming import StreamStats, stream_chat_completion, stream_chat_completion_async
 
 load_dotenv() # take environment variables from .env.
 
@@ -16,85 +24,292 @@ azure_cosmosdb_endpoint = os.getenv("AZURE_COSMOSDB_ENDPOINT")
 azure_cosmosdb_key = os.getenv("AZURE_COSMOSDB_KEY")
 azure_cosmosdb_database = "azureservicesdatabase01"
 azure_cosmosdb_container = "azureservicescontainer01"
+cosmos_query_mode = os.getenv("COSMOS_QUERY_MODE") or "parameterized"
 
-def hybrid_search(user_query, num_results):
+# "cosmos" queries the container; "local" searches the vectors file in-process
+retrieval_backend = os.getenv("RETRIEVAL_BACKEND") or "cosmos"
+local_index_path = os.getenv("LOCAL_INDEX_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "Data", "azureservices", "AzureServicesVectors.json")
+# Comma-separated fields the local full-text leg scores; title matches the Cosmos query, pdfingest.py chunks need content
+local_index_text_fields = tuple((os.getenv("LOCAL_INDEX_TEXT_FIELDS") or "title").split(","))
+# The vectors file isn't checked in; fail at startup rather than on the first query
+if retrieval_backend == "local" and not os.path.exists(local_index_path):
+    raise FileNotFoundError(
+        f"RETRIEVAL_BACKEND=local but the index {local_index_path} doesn't exist. Create it with the "
+        "vectorization step of 01_Azure-Cosmos-DB-RAG.ipynb or ingest.py --vectors-output, "
+        "or set LOCAL_INDEX_PATH to a *Vectors.json file or a vectorstore.py directory.")
 
-    # Setup the connection
-    cosmos_client = CosmosClient(url=azure_cosmosdb_endpoint, credential=azure_cosmosdb_key)
-    database = cosmos_client.get_database_client(azure_cosmosdb_database)
-    container = container = database.get_container_client(azure_cosmosdb_container)
+# Provide instructions to the model
+SYSTEM_PROMPT="""
+You are an AI assistant that helps users learn from the information found in the source material.
+Answer the query using only the sources provided below.
+Use bullets if the answer has multiple points.
+If the answer is longer than 3 sentences, provide a summary.
+Answer ONLY with the facts listed in the list of sources below. Cite your source when you answer the question
+If there isn't enough information below, say you don't know.
+Do not generate answers that don't use the sources below.
+Query: {query}
+Sources:\n{sources}
+"""
 
-    # Azure OpenAI client
-    openai_client = AzureOpenAI(
-    api_version=azure_openai_api_version,
-    azure_endpoint=azure_openai_endpoint,
-    azure_deployment=azure_openai_embeddings_deployment,
-    api_key=azure_openai_key)
+def format_sources(results):
+    # Use a unique separator to make the sources distinct. 
+    # We chose repeated equal signs (=) followed by a newline because it's unlikely the source documents contain this sequence.
+    return "=================\n".join([f"TITLE: {document['title']}, CONTENT: {document['content']}, CATEGORY: {document['category']}" for document in results])
+
+def pack_sources(results):
+    # Fit the retrieved documents into the prompt's token budget before formatting them
+    packed, stats = pack_context(results, "content")
+    log("context_packed", **stats.as_dict())
+    return format_sources(packed)
+
+def get_local_index():
+    # Imported lazily so the Cosmos path doesn't need NumPy
+    from localindex import get_local_index as load_index
+    return load_index(local_index_path, text_fields=local_index_text_fields)
+
+@traced("hybrid_search")
+def hybrid_search_with_stats(user_query, num_results, fields=None, max_content_chars=None, query_mode=None,
+                             embedding=None):
+
+    # Look up the query embedding in the cache before calling the embeddings API, unless the caller has it
+    if embedding is None:
+        embedding = embedding_cache.get_or_create(get_openai_client(), user_query,
+                                                  azure_openai_embeddings_deployment,
+                                                  azure_openai_embedding_size)
 
-    response = openai_client.embeddings.create(input=user_query, 
-                                               model=azure_openai_embeddings_deployment, 
-                                               dimensions=1536)
-    embedding = response.data[0].embedding
+    if retrieval_backend == "local":
+        with span("local_search"):
+            return get_local_index().search_with_stats(user_query, embedding, num_results,
+                                                       fields, max_content_chars)
 
+    # Reuse the pooled connection
+    container = get_container_client(azure_cosmosdb_database, azure_cosmosdb_container)
 
-    # Build the query with str.format() method
-    query = '''
-        SELECT TOP {0} c.id, c.title, c.category, c.content
-        FROM c
-        ORDER BY RANK RRF 
-            (VectorDistance(c.contentVector, {1}), FullTextScore(c.title, ['{2}']))
-    '''.format(num_results, embedding, user_query)
+    # Send the embedding and the user query as parameters; "inline" keeps the old str.format() query
+    if (query_mode or cosmos_query_mode) == "inline":
+        query, parameters = build_inline_hybrid_query(user_query, embedding, num_results,
+                                                      fields=fields, max_content_chars=max_content_chars)
+    else:
+        query, parameters = build_hybrid_query(user_query, embedding, num_results,
+                                               fields=fields, max_content_chars=max_content_chars)
 
-    results = container.query_items(
-            query=query,
-            enable_cross_partition_query=True)
+    return run_query(container, query, parameters)
 
-    items = [item for item in results]
+def hybrid_search(user_query, num_results, fields=None, max_content_chars=None, embedding=None):
+
+    items, stats = hybrid_search_with_stats(user_query, num_results, fields, max_content_chars,
+                                            embedding=embedding)
     
     return items
 
+@traced("rag")
 def RAG_CosmosDb(user_query):
     
-    # Azure OpenAI client
-    openai_client = AzureOpenAI(
-        api_version=azure_openai_api_version,
-        azure_endpoint=azure_openai_endpoint,
-        api_key=azure_openai_key)
-
-    # Provide instructions to the model
-    SYSTEM_PROMPT="""
-    You are an AI assistant that helps users learn from the information found in the source material.
-    Answer the query using only the sources provided below.
-    Use bullets if the answer has multiple points.
-    If the answer is longer than 3 sentences, provide a summary.
-    Answer ONLY with the facts listed in the list of sources below. Cite your source when you answer the question
-    If there isn't enough information below, say you don't know.
-    Do not generate answers that don't use the sources below.
-    Query: {query}
-    Sources:\n{sources}
-    """
+    # Reuse the pooled Azure OpenAI client
+    openai_client = get_openai_client()
 
     # User Query
     query = user_query
 
-    results = hybrid_search(query, 5)
+    # Answer paraphrases of earlier questions from the semantic cache
+    start = time.perf_counter()
+    embedding = embedding_cache.get_or_create(openai_client, query,
+                                              azure_openai_embeddings_deployment,
+                                              azure_openai_embedding_size)
+    cached = answer_cache.lookup(embedding)
+    if cached is not None:
+        log("answer_cache_hit", query=query, similarity=cached["similarity"])
+        print(cached["answer"])
+        return
 
-    # Use a unique separator to make the sources distinct. 
-    # We chose repeated equal signs (=) followed by a newline because it's unlikely the source documents contain this sequence.
-    sources_formatted = "=================\n".join([f"TITLE: {document['title']}, CONTENT: {document['content']}, CATEGORY: {document['category']}" for document in results])
+    # Search with the same embedding rather than computing it again
+    results = hybrid_search(query, 5, embedding=embedding)
+
+    sources_formatted = pack_sources(results)
+
+    with span("completion", model=azure_openai_deployment) as current:
+        response = openai_client.chat.completions.create(
+            messages=[
+                {
+                    "role": "user",
+                    "content": SYSTEM_PROMPT.format(query=query, sources=sources_formatted)
+                }
+            ],
+            model=azure_openai_deployment
+        )
+        record_usage(response.usage, azure_openai_deployment, current)
+
+    answer = response.choices[0].message.content
+    answer_cache.put(query, embedding, answer, results, (time.perf_counter() - start) * 1000)
+
+    print(answer)
+
+@traced("hybrid_search")
+async def hybrid_search_with_stats_async(user_query, num_results, fields=None, max_content_chars=None, split_legs=False,
+                                         embedding=None):
+
+    if embedding is not None:
+        embedding_task = asyncio.get_running_loop().create_future()
+        embedding_task.set_result(embedding)
+    else:
+        # Async clients live on the caller's event loop (e.g. Chainlit's)
+        embedding_task = asyncio.create_task(
+            embedding_cache.get_or_create_async(get_async_openai_client(), user_query,
+                                                azure_openai_embeddings_deployment,
+                                                azure_openai_embedding_size))
+
+    if retrieval_backend == "local":
+        # Load the index (first call only) while the embedding is in flight
+        index = await asyncio.to_thread(get_local_index)
+        embedding = await embedding_task
+        with span("local_search"):
+            return index.search_with_stats(user_query, embedding, num_results, fields, max_content_chars)
+
+    container = get_async_container_client(azure_cosmosdb_database, azure_cosmosdb_container)
+
+    if not split_legs:
+        # Single server-side RRF query once the embedding is available
+        embedding = await embedding_task
+        query, parameters = build_hybrid_query(user_query, embedding, num_results,
+                                               fields=fields, max_content_chars=max_content_chars)
+        return await run_query_async(container, query, parameters)
+
+    async def vector_leg():
+        embedding = await embedding_task
+        query, parameters = build_vector_query(embedding, num_results, fields, max_content_chars)
+        return await run_query_async(container, query, parameters)
+
+    # Run the full-text leg while the embedding is being computed, then fuse client-side
+    query, parameters = build_full_text_query(user_query, num_results, fields, max_content_chars)
+    (vector_items, vector_stats), (full_text_items, full_text_stats) = await asyncio.gather(
+        vector_leg(), run_query_async(container, query, parameters))
+
+    items = rrf_fuse([vector_items, full_text_items], num_results)
+    stats = {key: vector_stats[key] + full_text_stats[key] for key in vector_stats}
+    stats["elapsed_ms"] = max(vector_stats["elapsed_ms"], full_text_stats["elapsed_ms"])
+
+    return items, stats
+
+async def hybrid_search_async(user_query, num_results, fields=None, max_content_chars=None, split_legs=False,
+                              embedding=None):
+
+    items, stats = await hybrid_search_with_stats_async(user_query, num_results, fields,
+                                                        max_content_chars, split_legs, embedding)
+
+    return items
+
+@traced("rag")
+async def RAG_CosmosDb_with_sources_async(user_query):
+
+    openai_client = get_async_openai_client()
+
+    start = time.perf_counter()
+    embedding = await embedding_cache.get_or_create_async(openai_client, user_query,
+                                                          azure_openai_embeddings_deployment,
+                                                          azure_openai_embedding_size)
+    cached = answer_cache.lookup(embedding)
+    if cached is not None:
+        log("answer_cache_hit", query=user_query, similarity=cached["similarity"])
+        return cached["answer"], pack_sources(cached["sources"])
+
+    results = await hybrid_search_async(user_query, 5, embedding=embedding)
+
+    # Returned as well, so callers see the sources exactly as the model did
+    sources_formatted = pack_sources(results)
+
+    with span("completion", model=azure_openai_deployment) as current:
+        response = await openai_client.chat.completions.create(
+            messages=[
+                {
+                    "role": "user",
+                    "content": SYSTEM_PROMPT.format(query=user_query, sources=sources_formatted)
+                }
+            ],
+            model=azure_openai_deployment
+        )
+        record_usage(response.usage, azure_openai_deployment, current)
+
+    answer = response.choices[0].message.content
+    answer_cache.put(user_query, embedding, answer, results, (time.perf_counter() - start) * 1000)
+
+    return answer, sources_formatted
+
+async def RAG_CosmosDb_async(user_query):
+
+    answer, sources = await RAG_CosmosDb_with_sources_async(user_query)
+
+    return answer
+
+def RAG_CosmosDb_stream(user_query, stats=None):
+
+    openai_client = get_openai_client()
+
+    stats = stats or StreamStats()
+    embedding = embedding_cache.get_or_create(openai_client, user_query,
+                                              azure_openai_embeddings_deployment,
+                                              azure_openai_embedding_size)
+    cached = answer_cache.lookup(embedding)
+    if cached is not None:
+        # A cache hit arrives as a single delta
+        stats.on_token()
+        yield cached["answer"]
+        stats.finish()
+        return
+
+    results = hybrid_search(user_query, 5, embedding=embedding)
+
+    messages = [
+        {
+            "role": "user",
+            "content": SYSTEM_PROMPT.format(query=user_query, sources=pack_sources(results))
+        }
+    ]
+
+    # Yield tokens as they arrive instead of waiting for the full answer
+    parts = []
+    for delta in stream_chat_completion(openai_client, messages, azure_openai_deployment, stats):
+        parts.append(delta)
+        yield delta
+    answer_cache.put(user_query, embedding, "".join(parts), results, (stats.end - stats.start) * 1000)
+
+async def RAG_CosmosDb_stream_async(user_query, stats=None):
+
+    openai_client = get_async_openai_client()
+
+    stats = stats or StreamStats()
+    embedding = await embedding_cache.get_or_create_async(openai_client, user_query,
+                                                          azure_openai_embeddings_deployment,
+                                                          azure_openai_embedding_size)
+    cached = answer_cache.lookup(embedding)
+    if cached is not None:
+        stats.on_token()
+        yield cached["answer"]
+        stats.finish()
+        return
+
+    results = await hybrid_search_async(user_query, 5, embedding=embedding)
 
-    response = openai_client.chat.completions.create(
-        messages=[
-            {
-                "role": "user",
-                "content": SYSTEM_PROMPT.format(query=query, sources=sources_formatted)
-            }
-        ],
-        model=azure_openai_deployment
-    )
+    messages = [
+        {
+            "role": "user",
+            "content": SYSTEM_PROMPT.format(query=user_query, sources=pack_sources(results))
+        }
+    ]
 
-    print(response.choices[0].message.content)
+    parts = []
+    async for delta in stream_chat_completion_async(openai_client, messages, azure_openai_deployment, stats):
+        parts.append(delta)
+        yield delta
+    answer_cache.put(user_query, embedding, "".join(parts), results, (stats.end - stats.start) * 1000)
 
 if __name__ == "__main__":
     user_query = input("Enter your query: ")
-    RAG_CosmosDb(user_query)
+    stats = StreamStats()
+    for delta in RAG_CosmosDb_stream(user_query, stats):
+        print(delta, end="", flush=True)
+    print()
+    if stats.tokens_per_second is not None:
+        # Retrieval runs before the completion request and is reported on its own
+        print(f"\nRetrieval: {stats.retrieval_ms:.0f} ms, time to first token: {stats.ttft_ms:.0f} ms, "
+              f"{stats.tokens_per_second:.1f} tokens/sec")
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+from azurecosmos import RAG_CosmosDb_with_sources_async
+from clientpool import async_registry
+
+
+def read_queries(input_path, query_field="query"):
+    """
+    Streams (line number, query, error) tuples from a JSONL file without loading it all.
+
+    A line that isn't JSON or has no query field comes back with the query set
+    to None and the reason in error, so one bad line doesn't stop the batch.
+
+    :param input_path (str): The JSONL file with one query object per line.
+    :param query_field (str): The field holding the query text.
+    :return: A generator of (line, query, error) tuples.
+    """
+    with open(input_path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                query, error = json.loads(line)[query_field], None
+            except (ValueError, KeyError, TypeError) as e:
+                query, error = None, f"{type(e).__name__}: {e}"
+            yield line_number, query, error
+
+def load_checkpoint(output_path):
+    """
+    Returns the line numbers already answered in an existing output file.
+
+    The output file is the checkpoint: a line is done once its record has been
+    written without an error. A record cut off by a crash is dropped so appends
+    continue on a clean line. Failed lines are answered again on every resume,
+    so when the file holds failed or repeated records it is rewritten with only
+    the last successful record of each line.
+
+    :return: The set of completed input line numbers.
+    :rtype: set[int]
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    latest = {}
+    records = 0
+    valid_bytes = 0
+    with open(output_path, "rb") as file:
+        for raw in file:
+            if not raw.endswith(b"\n"):
+                break
+            valid_bytes += len(raw)
+            try:
+                record = json.loads(raw)
+            except ValueError:
+                continue
+            records += 1
+            latest[record["line"]] = (record, raw)
+
+    completed = {line for line, (record, raw) in latest.items() if "error" not in record}
+    if records > len(completed):
+        # Compact, so retried lines don't pile up a record per run
+        with open(f"{output_path}.tmp", "wb") as file:
+            for line in sorted(completed):
+                file.write(latest[line][1])
+        os.replace(f"{output_path}.tmp", output_path)
+    elif valid_bytes < os.path.getsize(output_path):
+        with open(output_path, "r+b") as file:
+            file.truncate(valid_bytes)
+
+    return completed
+
+async def answer(line_number, query):
+    start = time.perf_counter()
+    try:
+        # The context is the packed sources the model answered from, so groundedness is scored against them
+        response, context = await RAG_CosmosDb_with_sources_async(query)
+        record = {"line": line_number, "query": query, "response": response, "context": context}
+    except Exception as e:
+        record = {"line": line_number, "query": query, "error": f"{type(e).__name__}: {e}"}
+    record["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return record
+
+async def run_batch(input_path, output_path, concurrency=8, query_field="query", fsync_every=50):
+    """
+    Answers every query in a JSONL file through the RAG path and appends results to a JSONL file.
+
+    Queries already answered in ``output_path`` are skipped, so an interrupted run
+    resumes where it stopped. At most ``concurrency`` queries are in flight.
+
+    :return: Counts of completed, failed and skipped queries.
+    :rtype: dict
+    """
+    completed = load_checkpoint(output_path)
+    counts = {"completed": 0, "failed": 0, "skipped": 0}
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    start = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as output:
+
+        def write(record):
+            output.write(json.dumps(record) + "\n")
+            counts["failed" if "error" in record else "completed"] += 1
+            done = counts["completed"] + counts["failed"]
+            if done % fsync_every == 0:
+                output.flush()
+                os.fsync(output.fileno())
+                elapsed = time.perf_counter() - start
+                print(f"{done} queries answered, {done / elapsed:.1f} queries/sec")
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    queue.task_done()
+                    return
+                write(await answer(*item))
+                queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+
+        # The bounded queue keeps only a few queries in memory at a time
+        try:
+            for line_number, query, error in read_queries(input_path, query_field):
+                if line_number in completed:
+                    counts["skipped"] += 1
+                    continue
+                if error:
+                    write({"line": line_number, "error": error})
+                    continue
+                await queue.put((line_number, query))
+        finally:
+            # Stop the workers even if reading the input fails
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        output.flush()
+        os.fsync(output.fileno())
+
+    await async_registry.close()
+
+    elapsed = time.perf_counter() - start
+    answered = counts["completed"] + counts["failed"]
+    print(f"Answered {answered} queries in {elapsed:.1f}s "
+          f"({answered / elapsed if elapsed else 0:.1f} queries/sec), "
+          f"{counts['failed']} failed, {counts['skipped']} already done")
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of queries with the Cosmos DB RAG pipeline.")
+    parser.add_argument("input", help="JSONL file with one query per line, e.g. ../Data/output/nasaeval.jsonl")
+    parser.add_argument("output", help="JSONL file to append results to; re-run with the same file to resume")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--query-field", default="query")
+    args = parser.parse_args()
+
+    asyncio.run(run_batch(args.input, args.output, args.concurrency, args.query_field))
@@ -0,0 +1,239 @@
+from openai import AzureOpenAI, AsyncAzureOpenAI
+from dotenv import load_dotenv
+import os
+import asyncio
+import threading
+import aiohttp
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.pipeline.transport import RequestsTransport, AioHttpTransport
+from azure.cosmos import CosmosClient
+from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
+
+load_dotenv() # take environment variables from .env.
+
+azure_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+azure_openai_key = os.getenv("AZURE_OPENAI_API_KEY")
+azure_openai_api_version = "2024-10-01-preview"
+
+azure_cosmosdb_endpoint = os.getenv("AZURE_COSMOSDB_ENDPOINT")
+azure_cosmosdb_key = os.getenv("AZURE_COSMOSDB_KEY")
+azure_cosmosdb_database = "azureservicesdatabase01"
+azure_cosmosdb_container = "azureservicescontainer01"
+
+# Connection pool sizes, tunable from the environment
+cosmos_pool_connections = int(os.getenv("COSMOS_POOL_CONNECTIONS", "10"))
+cosmos_pool_maxsize = int(os.getenv("COSMOS_POOL_MAXSIZE", "50"))
+openai_max_connections = int(os.getenv("OPENAI_MAX_CONNECTIONS", "50"))
+openai_max_keepalive_connections = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+openai_keepalive_expiry = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+
+
+class ClientRegistry:
+    """
+    Thread-safe registry of long-lived Cosmos DB and Azure OpenAI clients.
+
+    Clients are built once per endpoint and shared by every caller, so the TLS
+    handshake, Cosmos account metadata lookup and HTTP pool setup are only paid
+    on the first (cold) request. Later (warm) lookups return the same client.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cosmos_clients = {}
+        self._cosmos_sessions = {}
+        self._containers = {}
+        self._openai_clients = {}
+        self._counts = {"cold": 0, "warm": 0}
+
+    def _count(self, created):
+        self._counts["cold" if created else "warm"] += 1
+
+    def get_cosmos_client(self, endpoint=None, key=None):
+        endpoint = endpoint or azure_cosmosdb_endpoint
+        key = key or azure_cosmosdb_key
+        with self._lock:
+            client = self._cosmos_clients.get(endpoint)
+            self._count(client is None)
+            if client is None:
+                # Keep-alive session with a bounded connection pool
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=cosmos_pool_connections,
+                                      pool_maxsize=cosmos_pool_maxsize)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                transport = RequestsTransport(session=session, session_owner=False)
+                client = CosmosClient(url=endpoint, credential=key, transport=transport)
+                self._cosmos_sessions[endpoint] = session
+                self._cosmos_clients[endpoint] = client
+            return client
+
+    def get_container_client(self, database_name=None, container_name=None, endpoint=None, key=None):
+        endpoint = endpoint or azure_cosmosdb_endpoint
+        database_name = database_name or azure_cosmosdb_database
+        container_name = container_name or azure_cosmosdb_container
+        cosmos_client = self.get_cosmos_client(endpoint, key)
+        cache_key = (endpoint, database_name, container_name)
+        with self._lock:
+            container = self._containers.get(cache_key)
+            if container is None:
+                database = cosmos_client.get_database_client(database_name)
+                container = database.get_container_client(container_name)
+                self._containers[cache_key] = container
+            return container
+
+    def get_openai_client(self, endpoint=None, key=None, api_version=None):
+        endpoint = endpoint or azure_openai_endpoint
+        key = key or azure_openai_key
+        api_version = api_version or azure_openai_api_version
+        cache_key = (endpoint, api_version)
+        with self._lock:
+            client = self._openai_clients.get(cache_key)
+            self._count(client is None)
+            if client is None:
+                # Keep-alive HTTP pool shared by every deployment on this endpoint
+                http_client = httpx.Client(
+                    limits=httpx.Limits(max_connections=openai_max_connections,
+                                        max_keepalive_connections=openai_max_keepalive_connections,
+                                        keepalive_expiry=openai_keepalive_expiry))
+                client = AzureOpenAI(
+                    api_version=api_version,
+                    azure_endpoint=endpoint,
+                    api_key=key,
+                    http_client=http_client)
+                self._openai_clients[cache_key] = client
+            return client
+
+    def stats(self):
+        """
+        Returns warm/cold client lookups and Cosmos connection reuse counters.
+
+        :return: A dict with client lookup counts and, per Cosmos endpoint, the number of
+            HTTP requests sent versus new TCP connections opened.
+        :rtype: dict
+        """
+        with self._lock:
+            cosmos = {}
+            for endpoint, session in self._cosmos_sessions.items():
+                opened = sent = 0
+                for adapter in set(session.adapters.values()):
+                    pools = adapter.poolmanager.pools
+                    # urllib3 2.x refuses to iterate the pool container's values, so look each key up
+                    with pools.lock:
+                        connection_pools = [pools.get(pool_key) for pool_key in list(pools.keys())]
+                    for pool in connection_pools:
+                        if pool is not None:
+                            opened += pool.num_connections
+                            sent += pool.num_requests
+                cosmos[endpoint] = {"requests": sent, "connections": opened,
+                                    "reused": max(sent - opened, 0)}
+            return {"clients": dict(self._counts), "cosmos_connections": cosmos}
+
+    def close(self):
+        with self._lock:
+            for client in self._openai_clients.values():
+                client.close()
+            for session in self._cosmos_sessions.values():
+                session.close()
+            self._openai_clients.clear()
+            self._cosmos_clients.clear()
+            self._cosmos_sessions.clear()
+            self._containers.clear()
+
+
+class AsyncClientRegistry:
+    """
+    Registry of azure.cosmos.aio and AsyncAzureOpenAI clients.
+
+    Async clients are bound to the event loop that created them, so clients are
+    kept per running loop (e.g. the Chainlit server loop) and reused by every
+    coroutine scheduled on it. Clients of a loop that has since closed (e.g.
+    an earlier asyncio.run) are dropped on the next lookup.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._sessions = {}
+        self._counts = {"cold": 0, "warm": 0}
+
+    def _evict_closed_loops(self):
+        # Their clients can't be awaited any more; detach the sessions so they don't warn as unclosed
+        for key in [key for key in self._clients if key[0].is_closed()]:
+            del self._clients[key]
+        for key in [key for key in self._sessions if key[1].is_closed()]:
+            self._sessions.pop(key).detach()
+
+    def _get(self, key, factory):
+        # No await between lookup and insert, so this is safe within one loop
+        self._evict_closed_loops()
+        client = self._clients.get(key)
+        self._counts["cold" if client is None else "warm"] += 1
+        if client is None:
+            client = factory()
+            self._clients[key] = client
+        return client
+
+    def _new_cosmos_client(self, endpoint, key):
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=cosmos_pool_maxsize))
+        self._sessions[endpoint, asyncio.get_running_loop()] = session
+        transport = AioHttpTransport(session=session, session_owner=False)
+        return AsyncCosmosClient(url=endpoint, credential=key, transport=transport)
+
+    def get_container_client(self, database_name=None, container_name=None, endpoint=None, key=None):
+        endpoint = endpoint or azure_cosmosdb_endpoint
+        key = key or azure_cosmosdb_key
+        database_name = database_name or azure_cosmosdb_database
+        container_name = container_name or azure_cosmosdb_container
+        loop = asyncio.get_running_loop()
+        cosmos_client = self._get((loop, "cosmos", endpoint),
+                                  lambda: self._new_cosmos_client(endpoint, key))
+        container_key = (loop, "container", endpoint, database_name, container_name)
+        container = self._clients.get(container_key)
+        if container is None:
+            container = cosmos_client.get_database_client(database_name).get_container_client(container_name)
+            self._clients[container_key] = container
+        return container
+
+    def get_openai_client(self, endpoint=None, key=None, api_version=None):
+        endpoint = endpoint or azure_openai_endpoint
+        key = key or azure_openai_key
+        api_version = api_version or azure_openai_api_version
+        loop = asyncio.get_running_loop()
+        return self._get((loop, "openai", endpoint, api_version), lambda: AsyncAzureOpenAI(
+            api_version=api_version,
+            azure_endpoint=endpoint,
+            api_key=key,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=openai_max_connections,
+                                    max_keepalive_connections=openai_max_keepalive_connections,
+                                    keepalive_expiry=openai_keepalive_expiry))))
+
+    def stats(self):
+        return {"clients": dict(self._counts)}
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        for key in [key for key in self._clients if key[0] is loop]:
+            client = self._clients.pop(key)
+            if key[1] in ("cosmos", "openai"):
+                await client.close()
+        for key in [key for key in self._sessions if key[1] is loop]:
+            await self._sessions.pop(key).close()
+
+
+# Process-wide registries shared by azurecosmos.py and the notebooks
+registry = ClientRegistry()
+async_registry = AsyncClientRegistry()
+
+def get_container_client(database_name=None, container_name=None):
+    return registry.get_container_client(database_name, container_name)
+
+def get_openai_client():
+    return registry.get_openai_client()
+
+def get_async_container_client(database_name=None, container_name=None):
+    return async_registry.get_container_client(database_name, container_name)
+
+def get_async_openai_client():
+    return async_registry.get_openai_client()
@@ -0,0 +1,166 @@
+import os
+import re
+import threading
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+# Prompt budget for the retrieved sources, tunable from the environment
+context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET") or 3000)
+# Word-shingle Jaccard similarity above which a source counts as a near-duplicate
+context_dedup_threshold = float(os.getenv("CONTEXT_DEDUP_THRESHOLD") or 0.8)
+
+word_pattern = re.compile(r"\w+")
+
+
+def get_encoding():
+    """
+    Loads the tiktoken encoding on first use; None when tiktoken isn't installed.
+
+    Loading reads (and the first time downloads) the BPE ranks, so it is left
+    out of import and done by the first count, or up front by a warmup.
+    """
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("o200k_base")
+                except ImportError:
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+def count_tokens(text):
+    encoding = get_encoding()
+    # Roughly 4 characters per token when tiktoken isn't installed
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+def truncate_tokens(text, max_tokens):
+    encoding = get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    return encoding.decode(encoding.encode(text)[:max_tokens])
+
+def shingles(text, size=3):
+    words = word_pattern.findall(text.lower())
+    return {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def strip_overlap(text, kept_text, min_overlap=50):
+    """
+    Removes the part of text that repeats an adjacent chunk of the same document.
+
+    Chunks split with overlap share a run of characters: the end of one
+    chunk is the start of the next. Either side may come first in rank order.
+
+    :return: text without the shared run, or unchanged when there is none.
+    :rtype: str
+    """
+    # kept_text ends with the beginning of text
+    position = kept_text.find(text[:min_overlap])
+    if position != -1 and text.startswith(kept_text[position:]):
+        return text[len(kept_text) - position:]
+    # text ends with the beginning of kept_text
+    position = text.find(kept_text[:min_overlap])
+    if position != -1 and kept_text.startswith(text[position:]):
+        return text[:position]
+    return text
+
+
+class PackStats:
+    """
+    What the packer did to one request's sources.
+    """
+
+    def __init__(self):
+        self.documents_in = 0
+        self.documents_out = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.duplicates = 0
+        self.overlap_chars = 0
+        self.truncated = 0
+
+    @property
+    def tokens_saved(self):
+        return self.tokens_in - self.tokens_out
+
+    def as_dict(self):
+        return {"documents_in": self.documents_in, "documents_out": self.documents_out,
+                "tokens_in": self.tokens_in, "tokens_out": self.tokens_out,
+                "tokens_saved": self.tokens_saved, "duplicates": self.duplicates,
+                "overlap_chars": self.overlap_chars, "truncated": self.truncated}
+
+
+def pack_context(documents, text_field, token_budget=context_token_budget,
+                 dedup_threshold=context_dedup_threshold, group_field="title", min_tokens=50):
+    """
+    Fits retrieved documents into a token budget for the prompt.
+
+    Documents are taken in the order given, which is the fused rank. Text
+    that overlaps an already packed chunk of the same document is cut, and
+    near-duplicates of a packed document are dropped. The last document that
+    doesn't fit is truncated to the remaining budget.
+
+    :param documents (list[dict]): The retrieved documents, best first.
+    :param text_field (str): The field holding the text, e.g. "content" or "chunk".
+    :param token_budget (int): Tokens allowed for the text of all documents.
+    :param dedup_threshold (float): Shingle Jaccard similarity treated as a duplicate.
+    :param group_field (str): Field identifying the source document of a chunk.
+    :param min_tokens (int): Don't include a truncated document shorter than this.
+    :return: The packed documents (copies, in rank order) and what was removed.
+    :rtype: tuple[list[dict], PackStats]
+    """
+    stats = PackStats()
+    packed = []
+    kept_shingles = []
+    remaining = token_budget
+
+    for document in documents:
+        text = document.get(text_field) or ""
+        stats.documents_in += 1
+        stats.tokens_in += count_tokens(text)
+        if remaining < min_tokens:
+            continue
+
+        original_shingles = shingles(text)
+        stripped_chars = 0
+        for kept in packed:
+            if kept.get(group_field) == document.get(group_field):
+                stripped = strip_overlap(text, kept[text_field])
+                stripped_chars += len(text) - len(stripped)
+                text = stripped
+        stats.overlap_chars += stripped_chars
+
+        # Compared as retrieved and after stripping, so a copy of a stripped chunk under another title is caught
+        document_shingles = shingles(text) if stripped_chars else original_shingles
+        if not text.strip() or any(jaccard(candidate, other) >= dedup_threshold
+                                   for candidate in (original_shingles, document_shingles)
+                                   for other in kept_shingles):
+            stats.duplicates += 1
+            continue
+
+        tokens = count_tokens(text)
+        if tokens > remaining:
+            text = truncate_tokens(text, remaining)
+            tokens = count_tokens(text)
+            stats.truncated += 1
+
+        packed.append(dict(document, **{text_field: text}))
+        kept_shingles.append(original_shingles)
+        if stripped_chars:
+            kept_shingles.append(document_shingles)
+        remaining -= tokens
+        stats.tokens_out += tokens
+
+    stats.documents_out = len(packed)
+    return packed, stats
@@ -0,0 +1,186 @@
+import json
+import time
+from telemetry import span, record_request_charge
+
+# Fields returned by hybrid search when no projection is given
+default_fields = ["id", "title", "category", "content"]
+
+
+def round_vector(embedding, digits=7):
+    """
+    Rounds an embedding to float32 precision so it serializes compactly.
+
+    :param embedding (list[float]): The embedding returned by Azure OpenAI.
+    :param digits (int): Significant digits to keep; 7 matches float32.
+    :return: The rounded embedding.
+    :rtype: list[float]
+    """
+    fmt = f".{digits}g"
+    return [float(format(value, fmt)) for value in embedding]
+
+def project_fields(fields, max_content_chars=None):
+    projection = []
+    for field in fields:
+        if field == "content" and max_content_chars:
+            # Truncate server-side so long documents don't inflate the response
+            projection.append("LEFT(c.content, @content_chars) AS content")
+        else:
+            projection.append(f"c.{field}")
+    return ", ".join(projection)
+
+def build_hybrid_query(user_query, embedding, num_results, fields=None, max_content_chars=None):
+    """
+    Builds a parameterized RRF hybrid query over contentVector and the title full-text index.
+
+    The embedding and the user query are sent as @embedding/@terms parameters instead
+    of being formatted into the SQL text, so the query text is identical across
+    requests and quotes in the user query can't break it.
+
+    :return: The query text and its parameters.
+    :rtype: tuple[str, list[dict]]
+    """
+    query = '''
+        SELECT TOP @num_results {0}
+        FROM c
+        ORDER BY RANK RRF
+            (VectorDistance(c.contentVector, @embedding), FullTextScore(c.title, @terms))
+    '''.format(project_fields(fields or default_fields, max_content_chars))
+
+    parameters = [
+        {"name": "@num_results", "value": num_results},
+        {"name": "@embedding", "value": round_vector(embedding)},
+        {"name": "@terms", "value": [user_query]},
+    ]
+    if max_content_chars:
+        parameters.append({"name": "@content_chars", "value": max_content_chars})
+
+    return query, parameters
+
+def build_vector_query(embedding, num_results, fields=None, max_content_chars=None):
+    # Vector half of the hybrid query, used when the two legs run separately
+    query = '''
+        SELECT TOP @num_results {0}
+        FROM c
+        ORDER BY VectorDistance(c.contentVector, @embedding)
+    '''.format(project_fields(fields or default_fields, max_content_chars))
+
+    parameters = [
+        {"name": "@num_results", "value": num_results},
+        {"name": "@embedding", "value": round_vector(embedding)},
+    ]
+    if max_content_chars:
+        parameters.append({"name": "@content_chars", "value": max_content_chars})
+
+    return query, parameters
+
+def build_full_text_query(user_query, num_results, fields=None, max_content_chars=None):
+    # Full-text half of the hybrid query; it doesn't need the embedding
+    query = '''
+        SELECT TOP @num_results {0}
+        FROM c
+        ORDER BY RANK FullTextScore(c.title, @terms)
+    '''.format(project_fields(fields or default_fields, max_content_chars))
+
+    parameters = [
+        {"name": "@num_results", "value": num_results},
+        {"name": "@terms", "value": [user_query]},
+    ]
+    if max_content_chars:
+        parameters.append({"name": "@content_chars", "value": max_content_chars})
+
+    return query, parameters
+
+def rrf_fuse(ranked_lists, num_results, k=60):
+    """
+    Fuses ranked result lists with Reciprocal Rank Fusion, like ORDER BY RANK RRF.
+
+    :param ranked_lists (list[list[dict]]): Result lists, best match first, keyed by "id".
+    :param num_results (int): Number of fused results to return.
+    :param k (int): RRF smoothing constant.
+    :return: The top fused documents.
+    :rtype: list[dict]
+    """
+    scores = {}
+    documents = {}
+    for results in ranked_lists:
+        for rank, document in enumerate(results):
+            scores[document["id"]] = scores.get(document["id"], 0.0) + 1.0 / (k + rank + 1)
+            documents.setdefault(document["id"], document)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:num_results]
+    return [documents[doc_id] for doc_id in ranked]
+
+def build_inline_hybrid_query(user_query, embedding, num_results, fields=None, max_content_chars=None):
+    # Original str.format() query, kept to compare request size and RU charge; its projection is fixed
+    if fields or max_content_chars:
+        raise ValueError("The inline query mode doesn't support fields or max_content_chars")
+    query = '''
+        SELECT TOP {0} c.id, c.title, c.category, c.content
+        FROM c
+        ORDER BY RANK RRF
+            (VectorDistance(c.contentVector, {1}), FullTextScore(c.title, ['{2}']))
+    '''.format(num_results, embedding, user_query)
+    return query, None
+
+def charge_hook(stats):
+    # Per-call response hook: the client's last_response_headers is shared by every query on it
+    def hook(headers, result):
+        stats["request_charge"] += float(headers.get("x-ms-request-charge", 0))
+    return hook
+
+def run_query(container, query, parameters=None):
+    """
+    Runs a cross-partition query and collects its request size and RU charge.
+
+    :return: The result items and a stats dict with request_bytes, response_bytes,
+        request_charge, pages and elapsed_ms.
+    :rtype: tuple[list[dict], dict]
+    """
+    body = {"query": query, "parameters": parameters or []}
+    stats = {"request_bytes": len(json.dumps(body)), "response_bytes": 0,
+             "request_charge": 0.0, "pages": 0}
+
+    start = time.perf_counter()
+    with span("cosmos_query") as current:
+        results = container.query_items(
+                query=query,
+                parameters=parameters,
+                enable_cross_partition_query=True,
+                response_hook=charge_hook(stats))
+
+        items = []
+        for page in results.by_page():
+            page_items = list(page)
+            items.extend(page_items)
+            stats["response_bytes"] += len(json.dumps(page_items))
+            stats["pages"] += 1
+        current.set_attribute("cosmos.request_charge", stats["request_charge"])
+        current.set_attribute("cosmos.pages", stats["pages"])
+    record_request_charge(stats["request_charge"], "query")
+    stats["elapsed_ms"] = (time.perf_counter() - start) * 1000
+
+    return items, stats
+
+async def run_query_async(container, query, parameters=None):
+    """
+    Async variant of run_query for azure.cosmos.aio container clients.
+    """
+    body = {"query": query, "parameters": parameters or []}
+    stats = {"request_bytes": len(json.dumps(body)), "response_bytes": 0,
+             "request_charge": 0.0, "pages": 0}
+
+    start = time.perf_counter()
+    with span("cosmos_query") as current:
+        results = container.query_items(query=query, parameters=parameters, response_hook=charge_hook(stats))
+
+        items = []
+        async for page in results.by_page():
+            page_items = [item async for item in page]
+            items.extend(page_items)
+            stats["response_bytes"] += len(json.dumps(page_items))
+            stats["pages"] += 1
+        current.set_attribute("cosmos.request_charge", stats["request_charge"])
+        current.set_attribute("cosmos.pages", stats["pages"])
+    record_request_charge(stats["request_charge"], "query")
+    stats["elapsed_ms"] = (time.perf_counter() - start) * 1000
+
+    return items, stats
@@ -0,0 +1,182 @@
+from dotenv import load_dotenv
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from telemetry import span, record_usage
+from sqlitestore import SqliteStore
+
+load_dotenv() # take environment variables from .env.
+
+# Cache settings, tunable from the environment
+embedding_cache_size = int(os.getenv("EMBEDDING_CACHE_SIZE") or 10000)
+embedding_cache_ttl = float(os.getenv("EMBEDDING_CACHE_TTL") or 604800)  # 7 days
+embedding_cache_path = os.getenv("EMBEDDING_CACHE_PATH")  # sqlite file, unset = memory only
+# Inserts between evictions of the sqlite tier
+embedding_cache_evict_every = int(os.getenv("EMBEDDING_CACHE_EVICT_EVERY") or 1000)
+
+
+def normalize_query(text):
+    """
+    Normalizes query text so trivially different spellings share a cache entry.
+
+    :param text (str): The raw user query.
+    :return: The query lower-cased with whitespace collapsed.
+    :rtype: str
+    """
+    return " ".join(text.lower().split())
+
+def cache_key(text, deployment, dimensions):
+    raw = f"{deployment}|{dimensions}|{normalize_query(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SqliteEmbeddingStore(SqliteStore):
+    """
+    Persistent tier that keeps float32 embeddings in a sqlite file across restarts.
+    """
+
+    def __init__(self, path):
+        super().__init__(path, "embedding_cache")
+
+    def get(self, key):
+        entry = super().get(key)
+        if entry is None:
+            return None
+        vector = array("f")
+        vector.frombytes(entry[0])
+        return vector.tolist(), entry[1]
+
+    def put(self, key, vector, created):
+        super().put(key, array("f", vector).tobytes(), created)
+
+
+class EmbeddingCache:
+    """
+    Two-tier query-embedding cache: an in-memory LRU in front of an optional
+    persistent store. Entries are keyed on normalized query text, embeddings
+    deployment and dimensions, and expire after ``ttl`` seconds. The store is
+    trimmed to ``max_entries`` at startup and every ``evict_every`` inserts.
+    """
+
+    def __init__(self, max_entries=embedding_cache_size, ttl=embedding_cache_ttl, store=None,
+                 evict_every=embedding_cache_evict_every):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.store = store
+        self.evict_every = evict_every
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._store_puts = 0
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        if store is not None:
+            store.evict(max_entries, ttl)
+
+    def get(self, text, deployment, dimensions):
+        key = cache_key(text, deployment, dimensions)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                vector, created = entry
+                if now - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return vector
+                del self._entries[key]
+        if self.store is not None:
+            entry = self.store.get(key)
+            if entry is not None:
+                vector, created = entry
+                if now - created <= self.ttl:
+                    with self._lock:
+                        self._stats["disk_hits"] += 1
+                        self._remember(key, vector, created)
+                    return vector
+                self.store.delete(key)
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, text, deployment, dimensions, vector):
+        key = cache_key(text, deployment, dimensions)
+        created = time.time()
+        with self._lock:
+            self._remember(key, vector, created)
+        if self.store is not None:
+            self.store.put(key, vector, created)
+            with self._lock:
+                self._store_puts += 1
+                evict = self._store_puts % self.evict_every == 0
+            if evict:
+                self.store.evict(self.max_entries, self.ttl)
+
+    def _remember(self, key, vector, created):
+        self._entries[key] = (vector, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def get_or_create(self, openai_client, text, deployment, dimensions):
+        """
+        Returns the cached embedding for the query, calling the embeddings API on a miss.
+
+        :param openai_client: An AzureOpenAI client.
+        :param text (str): The user query.
+        :param deployment (str): The embeddings deployment name.
+        :param dimensions (int): The embedding size.
+        :return: The query embedding.
+        :rtype: list[float]
+        """
+        vector = self.get(text, deployment, dimensions)
+        if vector is None:
+            with span("embedding", model=deployment) as current:
+                response = openai_client.embeddings.create(input=text,
+                                                           model=deployment,
+                                                           dimensions=dimensions)
+                record_usage(response.usage, deployment, current)
+            vector = response.data[0].embedding
+            self.put(text, deployment, dimensions, vector)
+        return vector
+
+    async def get_or_create_async(self, openai_client, text, deployment, dimensions):
+        """
+        Async variant of get_or_create for use with an AsyncAzureOpenAI client.
+        """
+        # The sqlite tier blocks, so keep it off the event loop
+        if self.store is not None:
+            vector = await asyncio.to_thread(self.get, text, deployment, dimensions)
+        else:
+            vector = self.get(text, deployment, dimensions)
+        if vector is None:
+            with span("embedding", model=deployment) as current:
+                response = await openai_client.embeddings.create(input=text,
+                                                                 model=deployment,
+                                                                 dimensions=dimensions)
+                record_usage(response.usage, deployment, current)
+            vector = response.data[0].embedding
+            if self.store is not None:
+                await asyncio.to_thread(self.put, text, deployment, dimensions, vector)
+            else:
+                self.put(text, deployment, dimensions, vector)
+        return vector
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries))
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Process-wide cache shared by azurecosmos.py and the notebooks
+embedding_cache = EmbeddingCache(
+    store=SqliteEmbeddingStore(embedding_cache_path) if embedding_cache_path else None)
@@ -0,0 +1,387 @@
+import os
+import json
+import time
+import hashlib
+import asyncio
+import argparse
+from dotenv import load_dotenv
+from azure.cosmos import exceptions
+from clientpool import async_registry, azure_cosmosdb_database, azure_cosmosdb_container
+
+load_dotenv() # take environment variables from .env.
+
+azure_openai_embeddings_deployment = os.getenv("AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT")
+azure_openai_embedding_size = 1536
+
+# Azure OpenAI accepts at most 2048 inputs per embeddings request
+max_embedding_inputs = 2048
+
+# Text fields to embed and the vector field each one is written to
+default_vector_fields = {"title": "titleVector", "content": "contentVector"}
+
+
+def iter_json_records(path, chunk_size=1 << 16):
+    """
+    Streams records from a JSON array or JSONL file without loading the whole file.
+
+    :param path (str): A .json file holding an array of objects, or a .jsonl file.
+    :return: A generator of dicts.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as file:
+        buffer = file.read(chunk_size).lstrip()
+        in_array = buffer.startswith("[")
+        if in_array:
+            buffer = buffer[1:]
+        while True:
+            buffer = buffer.lstrip().lstrip(",").lstrip()
+            if in_array and buffer.startswith("]"):
+                return
+            try:
+                record, end = decoder.raw_decode(buffer)
+            except ValueError:
+                more = file.read(chunk_size)
+                if not more:
+                    if buffer.strip():
+                        raise
+                    return
+                buffer += more
+                continue
+            yield record
+            buffer = buffer[end:]
+
+def batched(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class IngestStats:
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.documents = 0
+        self.embedding_requests = 0
+        self.embedded_texts = 0
+        self.request_charge = 0.0
+        self.throttled = 0
+        self.failed = 0
+        self.failed_ids = set()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        return {"documents": self.documents, "failed": self.failed,
+                "embedding_requests": self.embedding_requests, "embedded_texts": self.embedded_texts,
+                "request_charge": round(self.request_charge, 2), "throttled": self.throttled,
+                "elapsed_s": round(elapsed, 2),
+                "docs_per_sec": round(self.documents / elapsed, 1) if elapsed else 0.0}
+
+
+class ThrottleLimiter:
+    """
+    Concurrency limiter that halves its limit when Cosmos DB throttles (429)
+    and grows it back by one after a run of successful requests.
+    """
+
+    def __init__(self, max_concurrency, recover_after=20):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.recover_after = recover_after
+        self._active = 0
+        self._successes = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def succeeded(self):
+        self._successes += 1
+        if self._successes >= self.recover_after and self.limit < self.max_concurrency:
+            self.limit += 1
+            self._successes = 0
+
+    def throttled(self):
+        self.limit = max(1, self.limit // 2)
+        self._successes = 0
+
+
+async def embed_batch(openai_client, documents, vector_fields, stats,
+                      deployment=azure_openai_embeddings_deployment, dimensions=azure_openai_embedding_size):
+    """
+    Embeds every text field of a batch of documents in as few requests as possible.
+    """
+    slots = [(document, vector_field) for text_field, vector_field in vector_fields.items()
+             for document in documents if document.get(text_field)]
+    texts = [document[text_field] for text_field in vector_fields
+             for document in documents if document.get(text_field)]
+
+    for offset in range(0, len(texts), max_embedding_inputs):
+        response = await openai_client.embeddings.create(input=texts[offset:offset + max_embedding_inputs],
+                                                         model=deployment,
+                                                         dimensions=dimensions)
+        stats.embedding_requests += 1
+        for item in response.data:
+            document, vector_field = slots[offset + item.index]
+            document[vector_field] = item.embedding
+    stats.embedded_texts += len(texts)
+
+async def upsert(container, document, limiter, stats, max_attempts=5):
+    def record_charge(headers, _):
+        stats.request_charge += float(headers.get("x-ms-request-charge", 0))
+
+    for attempt in range(max_attempts):
+        async with limiter:
+            try:
+                await container.upsert_item(document, response_hook=record_charge)
+                limiter.succeeded()
+                stats.documents += 1
+                return
+            except exceptions.CosmosHttpResponseError as e:
+                if e.status_code != 429:
+                    raise
+                # The SDK already retried; slow everyone down before trying again
+                limiter.throttled()
+                stats.throttled += 1
+                retry_after = float((e.headers or {}).get("x-ms-retry-after-ms", 1000)) / 1000
+        await asyncio.sleep(retry_after * (attempt + 1))
+    raise RuntimeError(f"Upsert of {document.get('id')} still throttled after {max_attempts} attempts")
+
+async def upsert_documents(container, documents, limiter, stats, writer=None):
+    results = await asyncio.gather(*(upsert(container, document, limiter, stats) for document in documents),
+                                   return_exceptions=True)
+    for document, result in zip(documents, results):
+        if isinstance(result, Exception):
+            stats.failed += 1
+            stats.failed_ids.add(document.get("id"))
+            print(f"Failed to upsert {document.get('id')}: {result}")
+        elif writer:
+            # Only documents that reached the container go to the vectors file
+            writer.write(document)
+
+
+class VectorsWriter:
+    """
+    Writes documents as a JSON array one at a time, replacing the target file on close.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(f"{path}.tmp", "w", encoding="utf-8")
+        self._file.write("[")
+        self._count = 0
+
+    def write(self, document):
+        self._file.write(("," if self._count else "") + json.dumps(document))
+        self._count += 1
+
+    def close(self):
+        self._file.write("]")
+        self._file.close()
+        os.replace(f"{self.path}.tmp", self.path)
+
+
+async def ingest_records(records, container, openai_client, vector_fields, batch_size, max_concurrency,
+                         writer=None, stats=None):
+    """
+    Embeds and upserts a stream of documents in batches.
+
+    Each batch is embedded with one request per 2048 texts, then upserted
+    concurrently while the next batch is being embedded. Upsert concurrency
+    backs off when Cosmos DB throttles.
+    """
+    limiter = ThrottleLimiter(max_concurrency)
+    stats = stats or IngestStats()
+    pending = None
+    for documents in batched(records, batch_size):
+        await embed_batch(openai_client, documents, vector_fields, stats)
+        if pending:
+            await pending
+        pending = asyncio.create_task(upsert_documents(container, documents, limiter, stats, writer))
+        print(f"Embedded {stats.embedded_texts} texts, upserted {stats.documents} documents")
+    if pending:
+        await pending
+    return stats
+
+def print_report(report):
+    print(f"Ingested {report['documents']} documents in {report['elapsed_s']}s "
+          f"({report['docs_per_sec']} docs/sec), {report['request_charge']} RUs, "
+          f"{report['embedding_requests']} embedding requests, {report['throttled']} throttled")
+
+async def ingest(input_path, database_name=azure_cosmosdb_database, container_name=azure_cosmosdb_container,
+                 vector_fields=None, batch_size=256, max_concurrency=32, vectors_output=None):
+    """
+    Embeds and upserts a JSON/JSONL file of documents into a Cosmos DB container.
+
+    :param input_path (str): The source documents, e.g. ../Data/azureservices/AzureServices.json.
+    :param vector_fields (dict): Text field -> vector field; defaults to title and content.
+    :param batch_size (int): Documents per embedding batch.
+    :param max_concurrency (int): Upper bound on concurrent upserts.
+    :param vectors_output (str): Optional path to also write the documents with vectors as a JSON array.
+    :return: Throughput and RU totals.
+    :rtype: dict
+    """
+    vector_fields = vector_fields or default_vector_fields
+    openai_client = async_registry.get_openai_client()
+    container = async_registry.get_container_client(database_name, container_name)
+
+    writer = VectorsWriter(vectors_output) if vectors_output else None
+    stats = await ingest_records(iter_json_records(input_path), container, openai_client,
+                                 vector_fields, batch_size, max_concurrency, writer)
+    if writer:
+        writer.close()
+
+    report = stats.report()
+    print_report(report)
+    return report
+
+def document_hash(document, vector_fields):
+    # Hash everything except the vectors so any field change triggers an upsert
+    content = {key: value for key, value in document.items() if key not in vector_fields.values()}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+def save_manifest(path, manifest):
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file)
+    os.replace(f"{path}.tmp", path)
+
+async def delete_documents(container, ids, max_concurrency, stats, partition_key_field="id"):
+    limiter = ThrottleLimiter(max_concurrency)
+
+    async def delete(document_id):
+        async with limiter:
+            try:
+                # The container is partitioned on /id, so the id is also the partition key
+                await container.delete_item(item=document_id, partition_key=document_id)
+            except exceptions.CosmosResourceNotFoundError:
+                pass
+
+    results = await asyncio.gather(*(delete(document_id) for document_id in ids), return_exceptions=True)
+    failed = set()
+    for document_id, result in zip(ids, results):
+        if isinstance(result, Exception):
+            failed.add(document_id)
+            print(f"Failed to delete {document_id}: {result}")
+    return failed
+
+async def reindex(input_path, manifest_path=None, database_name=azure_cosmosdb_database,
+                  container_name=azure_cosmosdb_container, vector_fields=None, batch_size=256,
+                  max_concurrency=32, vectors_output=None):
+    """
+    Re-embeds and upserts only the documents that changed since the last run, and deletes removed ones.
+
+    A manifest of content hashes per id, plus the embeddings deployment and
+    dimensions, is kept next to the input. Changing the model or dimensions
+    re-embeds everything, as does a missing vectors output. Documents that are
+    no longer in the input are deleted either way. Documents whose upsert or
+    delete fails are left out of the vectors output and marked in the
+    manifest so the next run retries them.
+
+    :param manifest_path (str): Defaults to <input>.manifest.json.
+    :param vectors_output (str): Optional vectors file to keep in sync; unchanged documents
+        are copied over from the existing file without re-embedding.
+    :return: Diff counts plus throughput and RU totals.
+    :rtype: dict
+    """
+    vector_fields = vector_fields or default_vector_fields
+    manifest_path = manifest_path or f"{os.path.splitext(input_path)[0]}.manifest.json"
+    settings = {"model": azure_openai_embeddings_deployment, "dimensions": azure_openai_embedding_size,
+                "vector_fields": vector_fields}
+
+    manifest = load_manifest(manifest_path)
+    previous = manifest["documents"] if manifest else {}
+    # New embedding settings, or nothing to copy unchanged vectors from: embed everything
+    reembed = (manifest is not None and manifest["settings"] != settings) or \
+        bool(vectors_output and not os.path.exists(vectors_output))
+
+    # First pass: hash every document (only ids and hashes are kept in memory)
+    current = {document["id"]: document_hash(document, vector_fields)
+               for document in iter_json_records(input_path)}
+    removed = set(previous) - set(current)
+    if reembed:
+        updated = set(current)
+    else:
+        updated = {document_id for document_id, digest in current.items() if previous.get(document_id) != digest}
+    unchanged = set(current) - updated
+    print(f"{len(updated)} added or changed, {len(removed)} removed, {len(unchanged)} unchanged")
+
+    openai_client = async_registry.get_openai_client()
+    container = async_registry.get_container_client(database_name, container_name)
+    stats = IngestStats()
+
+    writer = None
+    if vectors_output:
+        writer = VectorsWriter(vectors_output)
+        if unchanged:
+            for document in iter_json_records(vectors_output):
+                if document.get("id") in unchanged:
+                    writer.write(document)
+
+    # Second pass: embed and upsert only what changed
+    records = (document for document in iter_json_records(input_path) if document["id"] in updated)
+    await ingest_records(records, container, openai_client, vector_fields, batch_size,
+                         max_concurrency, writer, stats)
+    if writer:
+        writer.close()
+
+    failed_deletes = await delete_documents(container, sorted(removed), max_concurrency, stats)
+
+    documents = dict(current)
+    for document_id in stats.failed_ids:
+        if document_id in previous:
+            # The container may still hold the old version: keep the id for deletes, with no hash to match
+            documents[document_id] = None
+        else:
+            documents.pop(document_id, None)
+    for document_id in failed_deletes:
+        documents[document_id] = previous[document_id]
+    save_manifest(manifest_path, {"settings": settings, "documents": documents})
+
+    report = stats.report()
+    report.update({"updated": len(updated), "removed": len(removed) - len(failed_deletes),
+                   "unchanged": len(unchanged)})
+    print_report(report)
+    return report
+
+async def main(args):
+    try:
+        if args.incremental:
+            return await reindex(args.input, args.manifest, args.database, args.container,
+                                 batch_size=args.batch_size, max_concurrency=args.concurrency,
+                                 vectors_output=args.vectors_output)
+        return await ingest(args.input, args.database, args.container, batch_size=args.batch_size,
+                            max_concurrency=args.concurrency, vectors_output=args.vectors_output)
+    finally:
+        await async_registry.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed and upsert documents into the Cosmos DB container.")
+    parser.add_argument("input", help="JSON array or JSONL file, e.g. ../Data/azureservices/AzureServices.json")
+    parser.add_argument("--database", default=azure_cosmosdb_database)
+    parser.add_argument("--container", default=azure_cosmosdb_container)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--vectors-output", help="Also write the embedded documents, e.g. AzureServicesVectors.json")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only embed and upsert documents that changed since the last run")
+    parser.add_argument("--manifest", help="Manifest of content hashes; defaults to <input>.manifest.json")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
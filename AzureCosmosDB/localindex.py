@@ -0,0 +1,185 @@
+import os
+import re
+import json
+import math
+import time
+import threading
+import numpy as np
+from cosmosquery import default_fields, rrf_fuse
+
+# Same tokenization for documents and queries: lower-cased word characters
+token_pattern = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return token_pattern.findall(str(text).lower())
+
+
+class BM25Index:
+    """
+    Inverted index with Okapi BM25 scoring over one or more text fields.
+    """
+
+    def __init__(self, documents, text_fields, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        lengths = []
+        for row, document in enumerate(documents):
+            tokens = []
+            for field in text_fields:
+                tokens.extend(tokenize(document.get(field, "")))
+            lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                self.postings.setdefault(token, []).append((row, count))
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self.average_length = float(self.lengths.mean()) if len(lengths) else 0.0
+        self.size = len(lengths)
+
+    def scores(self, query):
+        scores = np.zeros(self.size, dtype=np.float32)
+        for token in set(tokenize(query)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            rows = np.fromiter((row for row, _ in postings), dtype=np.int64, count=len(postings))
+            tf = np.fromiter((count for _, count in postings), dtype=np.float32, count=len(postings))
+            idf = math.log(1 + (self.size - len(postings) + 0.5) / (len(postings) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[rows] / self.average_length)
+            scores[rows] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+
+def top_k(scores, k):
+    """
+    Returns the row indices of the k highest scores, best first.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    rows = np.argpartition(-scores, k - 1)[:k]
+    return rows[np.argsort(-scores[rows])]
+
+
+class LocalHybridIndex:
+    """
+    In-process stand-in for the Cosmos DB hybrid query over a *Vectors.json file.
+
+    Vectors are kept in a contiguous float32 matrix, L2-normalized so a matrix
+    product gives cosine similarity, and cached next to the source file as a
+    .npy memory-mapped on later loads. Full-text ranking uses BM25 over the
+    text fields, and the two rankings are fused with RRF like ORDER BY RANK RRF.
+    It can also load a vectorstore.VectorStore directory in place of the JSON
+    file, in which case vector scores come from the store's quantized matrix.
+    """
+
+    def __init__(self, ids, documents, matrix, text_fields, store=None, vector_field=None):
+        self.ids = ids
+        self.documents = documents
+        self.matrix = matrix
+        self.store = store
+        self.vector_field = vector_field
+        self.text_index = BM25Index(documents, text_fields)
+
+    @classmethod
+    def load(cls, path, vector_field="contentVector", text_fields=("title",)):
+        """
+        Loads the index for a *Vectors.json file, rebuilding the binary cache when the source changes.
+
+        :param path (str): The JSON file written by the ingestion notebook, or a vector store directory.
+        :param vector_field (str): The embedding field to search.
+        :param text_fields (tuple[str]): Fields scored by BM25.
+        :rtype: LocalHybridIndex
+        """
+        if os.path.isdir(path):
+            from vectorstore import VectorStore
+            store = VectorStore.load(path)
+            return cls(store.ids, store.documents, None, text_fields, store, vector_field)
+
+        base = os.path.splitext(path)[0]
+        matrix_path = f"{base}.{vector_field}.npy"
+        meta_path = f"{base}.{vector_field}.meta.json"
+        source = os.stat(path)
+        signature = {"size": source.st_size, "mtime": source.st_mtime}
+
+        if os.path.exists(matrix_path) and os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            if meta["source"] == signature:
+                matrix = np.load(matrix_path, mmap_mode="r")
+                return cls(meta["ids"], meta["documents"], matrix, text_fields)
+
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+
+        matrix = np.asarray([item[vector_field] for item in data], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+
+        # Keep metadata without any vector fields in the sidecar
+        documents = [{key: value for key, value in item.items() if not key.endswith("Vector")} for item in data]
+        ids = [item["id"] for item in data]
+
+        np.save(matrix_path, matrix)
+        with open(meta_path, "w", encoding="utf-8") as file:
+            json.dump({"source": signature, "ids": ids, "documents": documents}, file)
+
+        return cls(ids, documents, np.load(matrix_path, mmap_mode="r"), text_fields)
+
+    def vector_scores(self, embedding):
+        if self.store is not None:
+            return self.store.scores(embedding, self.vector_field)
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        return self.matrix @ query
+
+    def search(self, user_query, embedding, num_results, fields=None, max_content_chars=None, depth=None):
+        """
+        Returns the top documents by RRF over vector similarity and BM25 ranks.
+
+        :param depth (int): Candidates taken from each ranking before fusion; defaults to
+            the whole corpus, which matches the server-side query on small corpora.
+        """
+        depth = depth or len(self.ids)
+        vector_rows = top_k(self.vector_scores(embedding), depth)
+        text_scores = self.text_index.scores(user_query)
+        text_rows = [row for row in top_k(text_scores, depth) if text_scores[row] > 0]
+
+        # rrf_fuse works on documents with an id; use the row number as id
+        fused = rrf_fuse([[{"id": int(row)} for row in vector_rows],
+                          [{"id": int(row)} for row in text_rows]], num_results)
+
+        results = []
+        for hit in fused:
+            document = self.documents[hit["id"]]
+            item = {field: document.get(field) for field in fields or default_fields}
+            if max_content_chars and isinstance(item.get("content"), str):
+                item["content"] = item["content"][:max_content_chars]
+            results.append(item)
+        return results
+
+    def search_with_stats(self, user_query, embedding, num_results, fields=None, max_content_chars=None):
+        start = time.perf_counter()
+        items = self.search(user_query, embedding, num_results, fields, max_content_chars)
+        stats = {"request_bytes": 0, "response_bytes": 0, "request_charge": 0.0, "pages": 1,
+                 "elapsed_ms": (time.perf_counter() - start) * 1000}
+        return items, stats
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_local_index(path, vector_field="contentVector", text_fields=("title",)):
+    # Load each file once per process
+    key = (os.path.abspath(path), vector_field, tuple(text_fields))
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = LocalHybridIndex.load(path, vector_field, text_fields)
+            _indexes[key] = index
+        return index
@@ -0,0 +1,268 @@
+import os
+import re
+import sys
+import glob
+import json
+import time
+import bisect
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from ingest import batched, embed_batch, ingest_records, IngestStats, VectorsWriter
+from clientpool import async_registry, azure_cosmosdb_database, azure_cosmosdb_container
+
+load_dotenv() # take environment variables from .env.
+
+# The SplitSkill of AzureAISearch/01_Azure-AI-Search-RAG.ipynb: pages mode, 2000 characters, 500 overlap
+chunk_max_length = int(os.getenv("CHUNK_MAX_LENGTH") or 2000)
+chunk_overlap_length = int(os.getenv("CHUNK_OVERLAP_LENGTH") or 500)
+# Processes extracting PDF text in parallel
+pdf_workers = int(os.getenv("PDF_WORKERS") or os.cpu_count() or 1)
+
+# Only the chunk text is embedded; the title is the file name
+chunk_vector_fields = {"content": "contentVector"}
+# For the same reason the local index must score the chunk text with BM25, not the title:
+# load --vectors-output with text_fields=chunk_text_fields, i.e. LOCAL_INDEX_TEXT_FIELDS=content
+chunk_text_fields = ("content",)
+
+default_inputs = ["../Data/nasabooks/page-*.pdf", "../Data/products/product_info_*.pdf"]
+
+_sentence_end = re.compile(r"[.!?](?=\s)|\n")
+_whitespace = re.compile(r"\s")
+_unsafe_id = re.compile(r"[^\w.-]")
+
+
+def extract_pdf(path):
+    """
+    Extracts the text of every page of a PDF. Runs in the worker processes.
+
+    :return: The path, the text of each page, and the error if the file couldn't be read.
+    :rtype: tuple[str, list[str], str]
+    """
+    # Imported here so the rest of the ingestion code doesn't need pypdf (pip install pypdf)
+    from pypdf import PdfReader
+    try:
+        return path, [page.extract_text() or "" for page in PdfReader(path).pages], None
+    except Exception as e:
+        return path, [], f"{type(e).__name__}: {e}"
+
+def extract_pdfs(paths, workers=pdf_workers):
+    """
+    Extracts PDFs in a process pool, yielding each file in order as soon as it is done.
+    """
+    if workers <= 1 or len(paths) <= 1:
+        yield from map(extract_pdf, paths)
+        return
+    with ProcessPoolExecutor(min(workers, len(paths))) as pool:
+        yield from pool.map(extract_pdf, paths)
+
+def _last_break(text, start, end):
+    # End a page after the last sentence in its second half, else at the last whitespace, else at the limit
+    window_start = start + (end - start) // 2
+    last = None
+    for last in _sentence_end.finditer(text, window_start, end):
+        pass
+    if last is not None:
+        return last.end()
+    for last in _whitespace.finditer(text, window_start, end):
+        pass
+    return last.start() if last is not None else end
+
+def split_pages(text, max_length=chunk_max_length, overlap_length=chunk_overlap_length):
+    """
+    Splits text into overlapping pages the way the SplitSkill's pages mode does.
+
+    A page holds at most max_length characters and ends on a sentence or word
+    boundary where there is one. The next page starts about overlap_length
+    characters before the end of the previous one, on a word boundary. Pages
+    are generated one at a time, so a long document is never held twice.
+
+    :return: A generator of (start, end) character offsets into text.
+    """
+    if overlap_length * 2 > max_length:
+        raise ValueError("The overlap must be at most half the maximum page length")
+    start = 0
+    length = len(text)
+    while start < length and text[start].isspace():
+        start += 1
+    while start < length:
+        end = min(start + max_length, length)
+        if end < length:
+            end = _last_break(text, start, end)
+        yield start, end
+        if end >= length:
+            return
+        next_start = end - overlap_length
+        boundary = _whitespace.search(text, next_start, end) if overlap_length else None
+        next_start = boundary.end() if boundary else next_start
+        start = next_start if start < next_start < end else end
+        while start < length and text[start].isspace():
+            start += 1
+
+def chunk_document(path, pages, max_length=chunk_max_length, overlap_length=chunk_overlap_length):
+    """
+    Turns the pages of one PDF into chunk documents for Cosmos DB and the local index.
+
+    The pages are joined into one text, as the indexer does, before splitting.
+    Each chunk records the PDF pages it spans.
+    """
+    name = os.path.basename(path)
+    category = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    text = "\n".join(pages)
+    page_starts = []
+    offset = 0
+    for page in pages:
+        page_starts.append(offset)
+        offset += len(page) + 1
+
+    for number, (start, end) in enumerate(split_pages(text, max_length, overlap_length)):
+        content = text[start:end].strip()
+        if not content:
+            continue
+        yield {
+            "id": _unsafe_id.sub("-", f"{category}-{os.path.splitext(name)[0]}-{number}"),
+            "parent_id": name,
+            "title": name,
+            "category": category,
+            "content": content,
+            "chunk_number": number,
+            "first_page": bisect.bisect_right(page_starts, start),
+            "last_page": bisect.bisect_right(page_starts, end - 1),
+        }
+
+
+class ChunkStats:
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.files = 0
+        self.pages = 0
+        self.chunks = 0
+        self.characters = 0
+        self.failed_files = []
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        return {"files": self.files, "pages": self.pages, "chunks": self.chunks, "characters": self.characters,
+                "failed_files": self.failed_files, "elapsed_s": round(elapsed, 2),
+                "pages_per_sec": round(self.pages / elapsed, 1) if elapsed else 0.0,
+                "chunks_per_sec": round(self.chunks / elapsed, 1) if elapsed else 0.0}
+
+def iter_chunks(paths, stats, workers=pdf_workers, max_length=chunk_max_length, overlap_length=chunk_overlap_length):
+    """
+    Streams the chunks of many PDFs, extracting them in a process pool.
+    """
+    for path, pages, error in extract_pdfs(paths, workers):
+        if error:
+            stats.failed_files.append(path)
+            print(f"Failed to extract {path}: {error}")
+            continue
+        stats.files += 1
+        stats.pages += len(pages)
+        for chunk in chunk_document(path, pages, max_length, overlap_length):
+            stats.chunks += 1
+            stats.characters += len(chunk["content"])
+            yield chunk
+
+def write_jsonl(chunks, path):
+    # Writes each chunk before it is embedded, so the file holds the chunks without vectors
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        for chunk in chunks:
+            file.write(json.dumps(chunk) + "\n")
+            yield chunk
+    os.replace(f"{path}.tmp", path)
+
+def resolve_inputs(patterns):
+    return sorted({path for pattern in patterns for path in glob.glob(pattern)})
+
+def print_report(report):
+    print(f"Chunked {report['pages']} pages from {report['files']} PDFs into {report['chunks']} chunks "
+          f"in {report['elapsed_s']}s ({report['pages_per_sec']} pages/sec, {report['chunks_per_sec']} chunks/sec)")
+    if "embedded_texts" in report:
+        print(f"Embedded {report['embedded_texts']} chunks in {report['embedding_requests']} requests, "
+              f"upserted {report['documents']} documents, {report['request_charge']} RUs")
+
+async def ingest_pdfs(patterns, output, vectors_output=None, upsert=False, database_name=azure_cosmosdb_database,
+                      container_name=azure_cosmosdb_container, batch_size=256, max_concurrency=32,
+                      workers=pdf_workers, max_length=chunk_max_length, overlap_length=chunk_overlap_length):
+    """
+    Chunks PDFs locally and optionally embeds and upserts the chunks.
+
+    PDFs are extracted in a pool of ``workers`` processes and split with the
+    SplitSkill settings as they arrive. Chunks always go to ``output`` as JSONL,
+    which ingest.py (including --incremental) can load. With vectors_output,
+    chunks are embedded in batches of ``batch_size`` and written as a JSON array
+    that LocalHybridIndex loads with ``text_fields=chunk_text_fields``. With upsert, they are also upserted into Cosmos DB.
+
+    :param patterns (list[str]): Glob patterns of the PDFs, e.g. ../Data/nasabooks/page-*.pdf.
+    :param output (str): The chunks JSONL file.
+    :return: Page and chunk throughput, plus the embedding and RU totals when embedding.
+    :rtype: dict
+    """
+    paths = resolve_inputs(patterns)
+    stats = ChunkStats()
+    chunks = write_jsonl(iter_chunks(paths, stats, workers, max_length, overlap_length), output)
+
+    ingest_stats = None
+    writer = VectorsWriter(vectors_output) if vectors_output else None
+    try:
+        if upsert:
+            ingest_stats = await ingest_records(chunks, async_registry.get_container_client(database_name, container_name),
+                                                async_registry.get_openai_client(), chunk_vector_fields,
+                                                batch_size, max_concurrency, writer)
+        elif writer:
+            ingest_stats = IngestStats()
+            openai_client = async_registry.get_openai_client()
+            for documents in batched(chunks, batch_size):
+                await embed_batch(openai_client, documents, chunk_vector_fields, ingest_stats)
+                for document in documents:
+                    writer.write(document)
+        else:
+            for _ in chunks:
+                pass
+    finally:
+        if writer:
+            writer.close()
+
+    report = stats.report()
+    if ingest_stats:
+        embedding = ingest_stats.report()
+        report.update({key: embedding[key] for key in ("documents", "failed", "embedding_requests", "embedded_texts",
+                                                        "request_charge", "throttled")})
+    print_report(report)
+    return report
+
+async def main(args):
+    try:
+        return await ingest_pdfs(args.inputs, args.output, args.vectors_output, args.upsert, args.database,
+                                 args.container, args.batch_size, args.concurrency, args.workers,
+                                 args.max_length, args.overlap_length)
+    finally:
+        await async_registry.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunk PDFs locally with the SplitSkill settings, then optionally "
+                                                 "embed them and upsert them into the Cosmos DB container.")
+    parser.add_argument("inputs", nargs="*", default=default_inputs, help="Glob patterns of PDFs")
+    parser.add_argument("--output", default="../Data/output/pdfchunks.jsonl", help="Chunks without vectors, as JSONL")
+    parser.add_argument("--vectors-output", help="Also embed the chunks and write them for the local index, "
+                                                 "e.g. ../Data/output/pdfchunksVectors.json; "
+                                                 "search it with LOCAL_INDEX_TEXT_FIELDS=content")
+    parser.add_argument("--upsert", action="store_true", help="Also embed the chunks and upsert them into Cosmos DB")
+    parser.add_argument("--database", default=azure_cosmosdb_database)
+    parser.add_argument("--container", default=azure_cosmosdb_container)
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks per embedding batch")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=pdf_workers, help="PDF extraction processes")
+    parser.add_argument("--max-length", type=int, default=chunk_max_length)
+    parser.add_argument("--overlap-length", type=int, default=chunk_overlap_length)
+    parser.add_argument("--report", help="Write the throughput report to this JSON file")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump(report, file, indent=2)
+    if report["failed_files"]:
+        sys.exit(1)
@@ -0,0 +1,64 @@
+import time
+import sqlite3
+import threading
+
+
+class SqliteStore:
+    """
+    Thread-safe sqlite table of binary values by key, each with the time it was written.
+
+    The persistent tier of the query embedding cache, and the store behind the
+    evaluation runner's judge cache and the image vector cache. Callers encode
+    their values to bytes; the store only keys, timestamps and evicts them.
+    """
+
+    def __init__(self, path, table):
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            "(key TEXT PRIMARY KEY, value BLOB NOT NULL, created REAL NOT NULL)")
+        self._conn.commit()
+
+    def get(self, key):
+        """
+        :return: The value and the time it was written, or None.
+        :rtype: tuple[bytes, float]
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        return None if row is None else (bytes(row[0]), row[1])
+
+    def put(self, key, value, created=None):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created) VALUES (?, ?, ?)",
+                (key, value, time.time() if created is None else created))
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def delete_prefix(self, prefix=""):
+        # Drops every key starting with prefix; all of them for ""
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+            self._conn.commit()
+
+    def evict(self, max_entries, ttl):
+        # Drops entries older than ttl seconds, then all but the newest max_entries
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE created < ?", (time.time() - ttl,))
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key NOT IN "
+                f"(SELECT key FROM {self.table} ORDER BY created DESC LIMIT ?)", (max_entries,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,127 @@
+import time
+from telemetry import stage_latency, record_usage
+
+
+class StreamStats:
+    """
+    Timing for one streamed completion: time to first token and tokens/sec.
+
+    ``start`` is when the stats were created, so the total covers retrieval;
+    TTFT counts from ``requested_at``, when the completion request is sent.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.requested_at = None
+        self.first_token_at = None
+        self.end = None
+        self.chunks = 0
+        self.completion_tokens = None
+        self.usage = None
+
+    def on_request(self):
+        self.requested_at = time.perf_counter()
+
+    def on_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.chunks += 1
+
+    def finish(self, usage=None):
+        self.end = time.perf_counter()
+        if usage is not None:
+            self.usage = usage
+            self.completion_tokens = usage.completion_tokens
+
+    @property
+    def ttft_ms(self):
+        if self.first_token_at is None:
+            return None
+        return (self.first_token_at - self.sent) * 1000
+
+    @property
+    def sent(self):
+        # A cached answer is never requested; time it from the start
+        return self.requested_at if self.requested_at is not None else self.start
+
+    @property
+    def retrieval_ms(self):
+        # Time spent before the completion request: embedding, cache lookup and search
+        return (self.sent - self.start) * 1000
+
+    @property
+    def tokens(self):
+        # Chunk count is a close stand-in when the service doesn't report usage
+        return self.completion_tokens if self.completion_tokens is not None else self.chunks
+
+    @property
+    def tokens_per_second(self):
+        if self.first_token_at is None or self.end is None or self.end <= self.first_token_at:
+            return None
+        return self.tokens / (self.end - self.first_token_at)
+
+    def as_dict(self):
+        return {"retrieval_ms": self.retrieval_ms, "ttft_ms": self.ttft_ms, "tokens": self.tokens,
+                "tokens_per_second": self.tokens_per_second,
+                "total_ms": (self.end - self.start) * 1000 if self.end else None}
+
+
+def stream_chat_completion(openai_client, messages, model, stats=None):
+    """
+    Yields the content deltas of a streamed chat completion.
+
+    :param openai_client: An AzureOpenAI client.
+    :param messages (list[dict]): The chat messages.
+    :param model (str): The chat deployment name.
+    :param stats (StreamStats): Optional, filled in with TTFT and tokens/sec.
+    :return: A generator of text deltas.
+    """
+    stats = stats or StreamStats()
+    stats.on_request()
+    response = openai_client.chat.completions.create(
+        messages=messages,
+        model=model,
+        stream=True,
+        stream_options={"include_usage": True})
+
+    usage = None
+    for chunk in response:
+        if chunk.usage is not None:
+            usage = chunk.usage
+        # Azure sends a first chunk with only content filter results and no choices
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            stats.on_token()
+            yield delta
+    stats.finish(usage)
+    # No span here: the generator is suspended at every yield, so only the totals are recorded
+    stage_latency.observe(stats.end - stats.requested_at, stage="completion_stream")
+    record_usage(usage, model)
+
+async def stream_chat_completion_async(openai_client, messages, model, stats=None):
+    """
+    Async variant of stream_chat_completion for an AsyncAzureOpenAI client.
+    """
+    stats = stats or StreamStats()
+    stats.on_request()
+    response = await openai_client.chat.completions.create(
+        messages=messages,
+        model=model,
+        stream=True,
+        stream_options={"include_usage": True})
+
+    usage = None
+    async for chunk in response:
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            stats.on_token()
+            yield delta
+    stats.finish(usage)
+    stage_latency.observe(stats.end - stats.requested_at, stage="completion_stream")
+    record_usage(usage, model)
@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import random
+import asyncio
+import functools
+import threading
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from opentelemetry import trace
+    tracer = trace.get_tracer("azure-ai-samples")
+except ImportError:
+    tracer = None
+
+# Fraction of info-level log events printed; warnings and errors are always printed
+log_sample_rate = float(os.getenv("LOG_SAMPLE_RATE") or 0.1)
+# Port for the Prometheus /metrics endpoint; unset = no endpoint
+metrics_port = int(os.getenv("METRICS_PORT") or 0)
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    pairs = ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                     for key, value in labels)
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """
+    Monotonic counter per label set, rendered in Prometheus text format.
+    """
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_label_text(key)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram per label set, rendered in Prometheus text format.
+    """
+
+    def __init__(self, name, description, buckets=latency_buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            # Bucket counts, then the sum and count of observations
+            values = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, values in self._values.items():
+                for bound, bucket_count in zip(self.buckets, values):
+                    lines.append(f"{self.name}_bucket{_label_text(key + (('le', bound),))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_label_text(key + (('le', '+Inf'),))} {values[-1]}")
+                lines.append(f"{self.name}_sum{_label_text(key)} {values[-2]}")
+                lines.append(f"{self.name}_count{_label_text(key)} {values[-1]}")
+        return lines
+
+
+stage_latency = Histogram("stage_latency_seconds", "Latency of each pipeline stage")
+stage_errors = Counter("stage_errors_total", "Stages that ended with an exception")
+cosmos_request_charge = Counter("cosmos_request_charge_total", "Request units charged by Cosmos DB")
+openai_tokens = Counter("openai_tokens_total", "Tokens reported in Azure OpenAI usage")
+metrics = [stage_latency, stage_errors, cosmos_request_charge, openai_tokens]
+
+
+class Span:
+    """
+    Handle for the stage being timed; attributes go to the OpenTelemetry span when there is one.
+    """
+
+    def __init__(self, stage, otel_span=None):
+        self.stage = stage
+        self.otel_span = otel_span
+        self.attributes = {}
+
+    def set_attribute(self, key, value):
+        if value is None:
+            return
+        self.attributes[key] = value
+        if self.otel_span is not None:
+            self.otel_span.set_attribute(key, value)
+
+
+@contextmanager
+def span(stage, **attributes):
+    """
+    Times a pipeline stage into stage_latency_seconds and, when OpenTelemetry
+    is installed, wraps it in a span nested under the current one.
+
+    :param stage (str): The stage name, used as the metric label and span name.
+    """
+    start = time.perf_counter()
+    manager = tracer.start_as_current_span(stage) if tracer is not None else nullcontext()
+    # The OpenTelemetry span records the exception and error status itself
+    with manager as otel_span:
+        current = Span(stage, otel_span)
+        for key, value in attributes.items():
+            current.set_attribute(key, value)
+        try:
+            yield current
+        except BaseException:
+            stage_errors.inc(stage=stage)
+            raise
+        finally:
+            stage_latency.observe(time.perf_counter() - start, stage=stage)
+
+def traced(stage):
+    """
+    Decorator running a function (sync or async) inside span(stage).
+    """
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_request_charge(charge, operation):
+    if charge:
+        cosmos_request_charge.inc(charge, operation=operation)
+
+def record_usage(usage, model, current=None):
+    """
+    Counts prompt and completion tokens from an OpenAI usage object.
+    """
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        tokens = getattr(usage, kind, None)
+        if tokens:
+            openai_tokens.inc(tokens, kind=kind, model=model)
+            if current is not None:
+                current.set_attribute(f"openai.{kind}", tokens)
+
+def log(event, level="info", sampled=True, **fields):
+    """
+    Prints one JSON log line; info events are sampled at LOG_SAMPLE_RATE unless sampled is False.
+    """
+    if sampled and level == "info" and random.random() >= log_sample_rate:
+        return
+    record = {"ts": round(time.time(), 3), "level": level, "event": event}
+    record.update(fields)
+    print(json.dumps(record, default=str))
+
+def render_metrics():
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not worth a log line
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port=metrics_port):
+    """
+    Serves /metrics in a background thread, once per process; does nothing when port is 0.
+    """
+    global _server
+    with _server_lock:
+        if _server is None and port:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+            print(f"Serving metrics on :{port}/metrics")
+        return _server
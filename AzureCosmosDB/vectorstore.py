@@ -0,0 +1,358 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from localindex import top_k
+
+# Layout version written to meta.json
+store_format = 1
+quantizations = ("float16", "int8")
+# Rows scored per block, so scanning an int8 or float16 matrix never converts all of it to float32 at once
+score_block_rows = 4096
+
+
+def current_rss():
+    # Resident memory in bytes (Linux), else the peak from getrusage
+    try:
+        with open("/proc/self/status", "r") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def quantize(matrix, quantization):
+    """
+    Scalar-quantizes L2-normalized rows.
+
+    float16 halves the size. int8 quarters it, with each row scaled so its
+    largest component maps to 127.
+
+    :return: The quantized matrix and, for int8, the per-row scales.
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    if quantization == "float16":
+        return matrix.astype(np.float16), None
+    if quantization == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Unknown quantization {quantization}; use one of {', '.join(quantizations)}")
+
+
+class VectorStore:
+    """
+    Binary replacement for a *Vectors.json file: .npy matrices plus a metadata sidecar.
+
+    A store is a directory holding meta.json (ids, documents without their
+    vectors, field settings) and per vector field:
+
+    - <field>.float32.npy, the vectors exactly as embedded
+    - <field>.norms.npy, their L2 norms
+    - optionally <field>.float16.npy or <field>.int8.npy (+ <field>.scales.npy)
+
+    Every matrix is memory-mapped, so loading reads no vectors. With a
+    quantized copy, search scans it to pick candidates and re-scores only
+    those rows with exact float32 cosine similarity.
+    """
+
+    def __init__(self, path, meta, mmap_mode="r"):
+        self.path = path
+        self.ids = meta["ids"]
+        self.documents = meta["documents"]
+        self.fields = meta["fields"]
+        self._matrices = {}
+        for field, settings in self.fields.items():
+            matrices = {"float32": np.load(os.path.join(path, f"{field}.float32.npy"), mmap_mode=mmap_mode),
+                        "norms": np.load(os.path.join(path, f"{field}.norms.npy"), mmap_mode=mmap_mode)}
+            quantization = settings.get("quantization")
+            if quantization:
+                matrices["quantized"] = np.load(os.path.join(path, f"{field}.{quantization}.npy"), mmap_mode=mmap_mode)
+            if quantization == "int8":
+                matrices["scales"] = np.load(os.path.join(path, f"{field}.scales.npy"), mmap_mode=mmap_mode)
+            self._matrices[field] = matrices
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        if meta.get("format") != store_format:
+            raise ValueError(f"{path} is a format {meta.get('format')} store; this code reads format {store_format}")
+        return cls(path, meta, mmap_mode)
+
+    @classmethod
+    def write(cls, path, ids, documents, vectors, quantization=None):
+        """
+        Writes a store from documents and their vectors.
+
+        :param documents (list[dict]): The documents without their vector fields.
+        :param vectors (dict): Vector field -> float32 matrix, one row per document.
+        :param quantization (str): None, "float16" or "int8".
+        :rtype: VectorStore
+        """
+        os.makedirs(path, exist_ok=True)
+        fields = {}
+        for field, matrix in vectors.items():
+            matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1).astype(np.float32)
+            np.save(os.path.join(path, f"{field}.float32.npy"), matrix)
+            np.save(os.path.join(path, f"{field}.norms.npy"), norms)
+            if quantization:
+                normalized = matrix / np.where(norms == 0, 1, norms)[:, None]
+                quantized, scales = quantize(normalized, quantization)
+                np.save(os.path.join(path, f"{field}.{quantization}.npy"), quantized)
+                if scales is not None:
+                    np.save(os.path.join(path, f"{field}.scales.npy"), scales)
+            fields[field] = {"dimensions": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+                             "quantization": quantization}
+        # Written last and replaced atomically, so a half-written store never loads
+        meta = {"format": store_format, "ids": ids, "documents": documents, "fields": fields}
+        with open(os.path.join(path, "meta.json.tmp"), "w", encoding="utf-8") as file:
+            json.dump(meta, file)
+        os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+        return cls.load(path)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def vectors(self, field):
+        # The exact float32 vectors (memory-mapped)
+        return self._matrices[field]["float32"]
+
+    def _query(self, embedding):
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        return query / norm if norm else query
+
+    def exact_scores(self, embedding, field, rows=None):
+        """
+        Cosine similarity from the float32 vectors, for all rows or only the given ones.
+
+        :rtype: np.ndarray
+        """
+        matrices = self._matrices[field]
+        query = self._query(embedding)
+        if rows is None:
+            scores = np.concatenate([matrices["float32"][start:start + score_block_rows] @ query
+                                     for start in range(0, len(self), score_block_rows)] or [np.empty(0, np.float32)])
+            norms = np.asarray(matrices["norms"])
+        else:
+            scores = matrices["float32"][rows] @ query
+            norms = matrices["norms"][rows]
+        return scores / np.where(norms == 0, 1, norms)
+
+    def approximate_scores(self, embedding, field):
+        """
+        Cosine similarity from the quantized vectors, or the exact one if the field isn't quantized.
+
+        :rtype: np.ndarray
+        """
+        matrices = self._matrices[field]
+        if "quantized" not in matrices:
+            return self.exact_scores(embedding, field)
+        query = self._query(embedding)
+        quantized = matrices["quantized"]
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), score_block_rows):
+            scores[start:start + score_block_rows] = quantized[start:start + score_block_rows].astype(np.float32) @ query
+        if "scales" in matrices:
+            scores *= matrices["scales"]
+        return scores
+
+    def scores(self, embedding, field, rescore=100):
+        """
+        Scores every row from the quantized vectors, with the ``rescore`` best replaced by exact scores.
+
+        This is what LocalHybridIndex ranks by when it loads a store.
+
+        :rtype: np.ndarray
+        """
+        scores = self.approximate_scores(embedding, field)
+        if "quantized" in self._matrices[field] and rescore:
+            rows = np.sort(top_k(scores, rescore))
+            scores[rows] = self.exact_scores(embedding, field, rows)
+        return scores
+
+    def search(self, embedding, k=10, field="contentVector", oversample=4):
+        """
+        Returns the k most similar rows: candidates from the quantized vectors, re-scored exactly.
+
+        :param oversample (int): Candidates re-scored per result; more raises recall at a small cost.
+        :return: (row, exact cosine similarity) pairs, best first.
+        :rtype: list[tuple[int, float]]
+        """
+        if "quantized" not in self._matrices[field]:
+            scores = self.exact_scores(embedding, field)
+            return [(int(row), float(scores[row])) for row in top_k(scores, k)]
+        candidates = np.sort(top_k(self.approximate_scores(embedding, field), k * max(oversample, 1)))
+        exact = self.exact_scores(embedding, field, candidates)
+        order = top_k(exact, k)
+        return [(int(candidates[i]), float(exact[i])) for i in order]
+
+
+def vector_fields_of(document):
+    # The *Vectors.json files name their embedding fields <name>Vector
+    return [key for key, value in document.items() if key.endswith("Vector") and isinstance(value, list)]
+
+def json_to_store(json_path, store_path, quantization=None, vector_fields=None):
+    """
+    Converts a *Vectors.json file (JSON array or JSONL) into a store, streaming the records.
+
+    :param vector_fields (list[str]): Defaults to the *Vector fields of the first record.
+    :rtype: VectorStore
+    """
+    # Imported here; ingest pulls in the Cosmos client
+    from ingest import iter_json_records
+    ids, documents, rows = [], [], {}
+    for record in iter_json_records(json_path):
+        if vector_fields is None:
+            vector_fields = vector_fields_of(record)
+        ids.append(str(record["id"]))
+        documents.append({key: value for key, value in record.items() if key not in vector_fields})
+        for field in vector_fields:
+            rows.setdefault(field, []).append(np.asarray(record[field], dtype=np.float32))
+    vectors = {field: np.vstack(rows[field]) if rows.get(field) else np.empty((0, 0), np.float32)
+               for field in vector_fields or []}
+    return VectorStore.write(store_path, ids, documents, vectors, quantization)
+
+def store_to_json(store_path, json_path):
+    """
+    Writes a store back out as a *Vectors.json array, with the float32 vectors.
+    """
+    from ingest import VectorsWriter
+    store = VectorStore.load(store_path)
+    writer = VectorsWriter(json_path)
+    for row, document in enumerate(store.documents):
+        document = dict(document)
+        for field in store.fields:
+            document[field] = store.vectors(field)[row].tolist()
+        writer.write(document)
+    writer.close()
+
+
+def measure_load(kind, path, field):
+    # Runs in a fresh process, so each measurement starts from the same baseline
+    baseline = current_rss()
+    start = time.perf_counter()
+    if kind == "json":
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        matrix = np.asarray([item[field] for item in data], dtype=np.float32)
+        loaded = time.perf_counter() - start
+        loaded_rss = current_rss()
+        matrix @ matrix[0]
+    else:
+        store = VectorStore.load(path)
+        loaded = time.perf_counter() - start
+        loaded_rss = current_rss()
+        store.search(store.vectors(field)[0], 10, field)
+    return {"load_s": round(loaded, 4), "rss_after_load_mb": round((loaded_rss - baseline) / 2**20, 1),
+            "rss_after_search_mb": round((current_rss() - baseline) / 2**20, 1)}
+
+def recall_at_k(store, field, k, oversample, queries, noise, seed=0):
+    """
+    Recall@k of quantized search, with and without re-scoring, against exact float32 search.
+
+    Queries are stored vectors with Gaussian noise added, so they fall near, not on, a document.
+    """
+    vectors = np.asarray(store.vectors(field))
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(store), size=min(queries, len(store)), replace=False)
+    scale = noise * float(np.mean(store._matrices[field]["norms"])) / np.sqrt(vectors.shape[1])
+    found_raw = found_rescored = 0
+    for row in rows:
+        query = vectors[row] + rng.normal(0, scale, vectors.shape[1]).astype(np.float32)
+        truth = set(top_k(store.exact_scores(query, field), k).tolist())
+        found_raw += len(truth & set(top_k(store.approximate_scores(query, field), k).tolist()))
+        found_rescored += len(truth & {row for row, _ in store.search(query, k, field, oversample)})
+    total = len(rows) * min(k, len(store))
+    return {"recall_quantized": round(found_raw / total, 4), "recall_rescored": round(found_rescored / total, 4)}
+
+def benchmark(json_path, store_dir, field="contentVector", k=10, oversample=4, queries=200, noise=0.5):
+    """
+    Converts json_path to a full-precision, a float16 and an int8 store and compares them with the JSON file.
+
+    :return: Size, load time and RSS of each format, and recall@k of the quantized ones.
+    :rtype: dict
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    def size_of(path):
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+    name = os.path.splitext(os.path.basename(json_path))[0]
+    report = {"source": json_path, "field": field, "k": k, "oversample": oversample, "formats": {"json": {}}}
+    targets = {"json": json_path}
+    for quantization in (None,) + quantizations:
+        store_path = os.path.join(store_dir, f"{name}.{quantization or 'float32'}")
+        store = json_to_store(json_path, store_path, quantization, [field])
+        targets[quantization or "float32"] = store_path
+        report["formats"][quantization or "float32"] = \
+            recall_at_k(store, field, k, oversample, queries, noise) if quantization else {}
+    report["documents"] = len(store)
+
+    context = multiprocessing.get_context("spawn")
+    for kind, path in targets.items():
+        with ProcessPoolExecutor(1, mp_context=context) as pool:
+            measured = pool.submit(measure_load, "json" if kind == "json" else "store", path, field).result()
+        entry = report["formats"].setdefault(kind, {})
+        entry.update(measured)
+        entry["size_mb"] = round(size_of(path) / 2**20, 3)
+        if kind not in ("json", "float32"):
+            # What has to be resident to scan: the quantized matrix (and scales), not the float32 one
+            entry["scanned_mb"] = round(sum(os.path.getsize(os.path.join(path, f"{field}.{suffix}.npy"))
+                                            for suffix in (kind, "scales")
+                                            if os.path.exists(os.path.join(path, f"{field}.{suffix}.npy"))) / 2**20, 3)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert *Vectors.json files to binary vector stores and back.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="*Vectors.json -> store")
+    convert.add_argument("input", help="e.g. ../Data/recipes/recipesVectors.json")
+    convert.add_argument("--output", help="Store directory; defaults to the input without .json")
+    convert.add_argument("--quantization", choices=quantizations)
+    export = commands.add_parser("export", help="store -> *Vectors.json")
+    export.add_argument("input")
+    export.add_argument("output")
+    bench = commands.add_parser("benchmark", help="Size, load time, RSS and recall@k of each format")
+    bench.add_argument("input")
+    bench.add_argument("--store-dir", default="../Data/output/vectorstores")
+    bench.add_argument("--field", default="contentVector")
+    bench.add_argument("--k", type=int, default=10)
+    bench.add_argument("--oversample", type=int, default=4)
+    bench.add_argument("--queries", type=int, default=200)
+    bench.add_argument("--report", default="vectorstore.json")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        output = args.output or os.path.splitext(args.input)[0]
+        store = json_to_store(args.input, output, args.quantization)
+        print(f"Wrote {len(store)} documents to {output} ({', '.join(store.fields)}, "
+              f"{args.quantization or 'float32 only'})")
+    elif args.command == "export":
+        store_to_json(args.input, args.output)
+        print(f"Wrote {args.output}")
+    else:
+        report = benchmark(args.input, args.store_dir, args.field, args.k, args.oversample, args.queries)
+        with open(args.report, "w") as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+        for kind, entry in report["formats"].items():
+            recall = f", recall@{args.k} {entry['recall_quantized']} -> {entry['recall_rescored']} re-scored" \
+                if "recall_rescored" in entry else ""
+            scanned = f" ({entry['scanned_mb']} MB scanned)" if "scanned_mb" in entry else ""
+            print(f"{kind}: {entry['size_mb']} MB{scanned}, load {entry['load_s']}s, "
+                  f"RSS +{entry['rss_after_load_mb']} MB loaded / +{entry['rss_after_search_mb']} MB searched{recall}")
+
+
+if __name__ == "__main__":
+    main()
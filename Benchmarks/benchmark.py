@@ -0,0 +1,315 @@
+"""
+Offline performance benchmark for the Cosmos DB RAG path and the agent run loop.
+
+The Azure OpenAI, Cosmos DB and Agents endpoints are replaced by the local
+mock server in mockservers.py, so a run needs no Azure resources and is
+repeatable: latencies come from the profile, and throttling is injected at
+a fixed rate. Each scenario runs at increasing concurrency and the results
+(latency percentiles, throughput, errors, allocations, 429s served) are
+written to a JSON file with sorted keys, so two runs can be diffed.
+
+    python Benchmarks/benchmark.py --concurrency 1 4 16 --requests 50 --output baseline.json
+"""
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import argparse
+import platform
+import tracemalloc
+import contextlib
+import concurrent.futures
+from azure.core.credentials import AccessToken
+from azure.core.pipeline.policies import SansIOHTTPPolicy
+from mockservers import MockServer
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+queries = [
+    "What are the services for running ML models?",
+    "How do I store documents with vector search?",
+    "Which service gives me a managed Kubernetes cluster?",
+    "What can I use for real-time analytics on streaming data?",
+    "How do I add full-text search to my application?",
+    "Which database is best for globally distributed apps?",
+    "How do I schedule serverless functions?",
+    "What service translates text between languages?",
+]
+
+agent_inputs = [
+    "What is the weather in London?",
+    "Suggest restaurants in Tokyo.",
+    "What budget do I need for New York?",
+    "Plan a weekend in London.",
+]
+
+
+def configure_environment(server_url, warm_caches):
+    # The modules read their configuration at import time, so this runs before importing them
+    os.environ.update({
+        "AZURE_OPENAI_ENDPOINT": server_url,
+        "AZURE_OPENAI_API_KEY": "benchmark",
+        "AZURE_OPENAI_CHAT_DEPLOYMENT_NAME": "gpt-4o",
+        "AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT": "text-embedding-3-small",
+        "AZURE_COSMOSDB_ENDPOINT": server_url,
+        "AZURE_COSMOSDB_KEY": base64.b64encode(b"benchmark").decode("ascii"),
+        "RETRIEVAL_BACKEND": "cosmos",
+        "LOG_SAMPLE_RATE": "0.000001",
+        "HISTORY_COMPACTION": "off",
+        # The answer cache is opt-in; --warm-caches turns it on
+        "ANSWER_CACHE_SIZE": "1000" if warm_caches else "0",
+    })
+    # AzureAIAgents imports telemetry and contextpacker from AzureCosmosDB
+    sys.path[:0] = [os.path.join(repo_root, "AzureCosmosDB"), os.path.join(repo_root, "AzureAIAgents")]
+
+    if not warm_caches:
+        # Every request goes to the mock endpoints, as on a cold process
+        from embeddingcache import embedding_cache
+        embedding_cache.max_entries = 0
+        embedding_cache.store = None
+
+
+class MockAuthenticationPolicy(SansIOHTTPPolicy):
+    """
+    Adds a bearer token without the https check of BearerTokenCredentialPolicy.
+    """
+
+    def on_request(self, request):
+        request.http_request.headers["Authorization"] = "Bearer benchmark"
+
+
+class MockCredential:
+
+    def get_token(self, *scopes, **kwargs):
+        return AccessToken("benchmark", int(time.time()) + 3600)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return round(sorted_values[index], 2)
+
+
+class Scenario:
+    """
+    One benchmarked operation. setup() runs once before the first level, call(i) is timed.
+    """
+
+    name = None
+
+    def setup(self, concurrency):
+        pass
+
+    def call(self, i):
+        raise NotImplementedError
+
+    def teardown(self):
+        pass
+
+
+class HybridSearchScenario(Scenario):
+
+    name = "hybrid_search"
+
+    def call(self, i):
+        from azurecosmos import hybrid_search
+        return hybrid_search(queries[i % len(queries)], 5)
+
+
+class RagScenario(Scenario):
+
+    name = "rag"
+
+    def call(self, i):
+        from azurecosmos import RAG_CosmosDb
+        # The answer is printed to stdout, which main() discards
+        RAG_CosmosDb(queries[i % len(queries)])
+
+
+class RunAgentScenario(Scenario):
+    """
+    One session per request: open a ChatSession, run one agent turn, end the session.
+
+    The turn is ChatSession.run_turn, the same code run_agent in the Chainlit
+    apps calls (create the message, create the run, drive it with concurrent
+    tool calls, fetch only the reply). The app modules themselves need
+    chainlit and build their client from a project connection string at
+    import, so they aren't imported here.
+    """
+
+    name = "run_agent"
+
+    def __init__(self, server_url):
+        self.server_url = server_url
+
+    def setup(self, concurrency):
+        from azure.ai.projects import AIProjectClient
+        from azure.ai.projects.models import FunctionTool
+        from agentpool import AgentRegistry, ThreadPool
+        from rundriver import memoize_tool
+
+        self.project_client = AIProjectClient(endpoint=self.server_url, subscription_id="benchmark",
+                                              resource_group_name="benchmark", project_name="benchmark",
+                                              credential=MockCredential(),
+                                              authentication_policy=MockAuthenticationPolicy())
+
+        @memoize_tool(ttl=300)
+        def fetch_weather(location: str) -> str:
+            """
+            Fetches the weather information for the specified location.
+
+            :param location (str): The location to fetch weather for.
+            :return: Weather information as a JSON string.
+            :rtype: str
+            """
+            return json.dumps({"weather": "Cloudy, 18°C"})
+
+        self.functions = FunctionTool({fetch_weather})
+        self.agent = AgentRegistry(self.project_client).get_or_create(
+            model="gpt-4o", name="benchmark-agent", instructions="You are an AI Travel Agent.")
+        self.thread_pool = ThreadPool(self.project_client, size=concurrency)
+        self.thread_pool.fill()
+
+    def call(self, i):
+        return asyncio.run(self.turn(agent_inputs[i % len(agent_inputs)]))
+
+    async def turn(self, user_input):
+        from sessions import ChatSession
+
+        session = await ChatSession.start(self.thread_pool, self.agent.id)
+        try:
+            async with session.lock:
+                run, reply = await session.run_turn(self.project_client, user_input, self.functions)
+        finally:
+            session.end()
+        if run.status != "completed":
+            raise RuntimeError(f"Run {run.id} ended as {run.status}")
+        if reply is None:
+            raise RuntimeError(f"Run {run.id} left no reply")
+        return reply
+
+
+def run_level(scenario, concurrency, requests):
+    """
+    Runs ``requests`` calls of a scenario with ``concurrency`` of them in flight.
+
+    :return: Latency percentiles (ms), throughput, errors and allocation figures.
+    :rtype: dict
+    """
+    latencies = []
+    errors = {}
+
+    def timed(i):
+        start = time.perf_counter()
+        scenario.call(i)
+        return (time.perf_counter() - start) * 1000
+
+    tracemalloc.reset_peak()
+    allocated_before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(timed, i) for i in range(requests)]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                latencies.append(future.result())
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "succeeded": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": round(latencies[-1], 2) if latencies else None,
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else None,
+        },
+        "allocations": {
+            "peak_kib": round((peak - allocated_before) / 1024, 1),
+            "retained_kib": round((current - allocated_before) / 1024, 1),
+            "per_request_kib": round((peak - allocated_before) / 1024 / requests, 2) if requests else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", default=["hybrid_search", "rag", "run_agent"],
+                        choices=["hybrid_search", "rag", "run_agent"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="Requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed requests before the first level")
+    parser.add_argument("--throttle-rate", type=float, default=None,
+                        help="Fraction of requests answered with 429, for every endpoint")
+    parser.add_argument("--profile", default=None,
+                        help="JSON file overriding the latency profile, e.g. {\"chat\": {\"median_ms\": 200}}")
+    parser.add_argument("--warm-caches", action="store_true",
+                        help="Keep the embedding and answer caches on (off by default so every call hits the mock)")
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+
+    profile = {}
+    if args.profile:
+        with open(args.profile) as f:
+            profile = json.load(f)
+
+    server = MockServer(profile)
+    if args.throttle_rate is not None:
+        for model in server.server.state.models.values():
+            model.throttle_rate = args.throttle_rate
+        for settings in server.profile.values():
+            settings["throttle_rate"] = args.throttle_rate
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(terse=True),
+        "settings": {"concurrency": args.concurrency, "requests": args.requests, "warmup": args.warmup,
+                     "warm_caches": args.warm_caches},
+        "profile": server.profile,
+        "scenarios": {},
+    }
+
+    # The modules print answers and progress; the benchmark reports on stderr and in the JSON file
+    with server, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        configure_environment(server.url, args.warm_caches)
+        tracemalloc.start()
+        for name in args.scenarios:
+            scenario = RunAgentScenario(server.url) if name == "run_agent" else \
+                {"hybrid_search": HybridSearchScenario, "rag": RagScenario}[name]()
+            scenario.setup(max(args.concurrency))
+            for i in range(args.warmup):
+                scenario.call(i)
+
+            levels = []
+            for concurrency in args.concurrency:
+                counts_before = server.counts
+                level = run_level(scenario, concurrency, args.requests)
+                counts = server.counts
+                level["mock_requests"] = {key: counts[key] - counts_before.get(key, 0)
+                                          for key in sorted(counts) if counts[key] != counts_before.get(key, 0)}
+                levels.append(level)
+                print(f"{name} c={concurrency}: p50 {level['latency_ms']['p50']} ms, "
+                      f"p95 {level['latency_ms']['p95']} ms, {level['throughput_rps']} req/s, "
+                      f"{sum(level['errors'].values())} errors", file=sys.stderr)
+            scenario.teardown()
+            report["scenarios"][name] = levels
+        tracemalloc.stop()
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Benchmark of the batch lexical metrics engine against the per-row evaluators.
+
+The evaluation rows in Data/output are repeated up to each dataset size. The
+F1, ROUGE, BLEU, GLEU and METEOR evaluators from azure-ai-evaluation score
+every row one call at a time, as evaluate() does, then lexicalmetrics scores
+the same rows in one process and across worker processes. Every score is
+compared with the per-row result, and the run fails if any differs by more
+than the tolerance.
+
+    python Benchmarks/lexicalbench.py --rows 100 1000 --workers 4 --output lexicalbench.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_root, "AzureAIEvaluation"))
+
+from evalrunner import read_jsonl, build_evaluators
+from lexicalmetrics import score_rows, lexical_metrics
+
+
+def build_dataset(size):
+    rows = [row for name in ("nasaeval.jsonl", "product-eval.jsonl")
+            for row in read_jsonl(os.path.join(repo_root, "Data", "output", name))]
+    # Numbered so that no two rows are identical
+    return [{"response": f"{rows[i % len(rows)]['response']} (answer {i})",
+             "ground_truth": rows[i % len(rows)]["ground_truth"]} for i in range(size)]
+
+def score_per_row(evaluators, rows):
+    return [{name: evaluator(response=row["response"], ground_truth=row["ground_truth"])
+             for name, evaluator in evaluators.items()} for row in rows]
+
+def flatten(result):
+    # Newer evaluator versions nest the ROUGE precision and recall in rouge_properties
+    flat = dict(result)
+    for value in result.values():
+        if isinstance(value, dict):
+            flat.update(value)
+    return flat
+
+def max_differences(expected, actual):
+    # Largest absolute difference per evaluator result key, over every row
+    differences = {}
+    for expected_row, actual_row in zip(expected, actual):
+        for name, scores in actual_row.items():
+            expected_scores = flatten(expected_row[name])
+            for key, value in scores.items():
+                column = f"{name}.{key}"
+                differences[column] = max(differences.get(column, 0.0), abs(expected_scores[key] - value))
+    return differences
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", nargs="+", type=int, default=[100, 1000])
+    parser.add_argument("--metrics", nargs="+", default=list(lexical_metrics), choices=lexical_metrics)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-rows", type=int, default=250)
+    parser.add_argument("--tolerance", type=float, default=1e-9)
+    parser.add_argument("--output", default="lexicalbench.json")
+    args = parser.parse_args()
+
+    evaluators = build_evaluators(model_config=None, names=args.metrics)
+    metrics = tuple(args.metrics)
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(terse=True),
+        "settings": {"metrics": args.metrics, "workers": args.workers, "chunk_rows": args.chunk_rows,
+                     "tolerance": args.tolerance},
+        "sizes": [],
+    }
+    # Untimed, so NLTK data checks and imports don't count against the first size
+    score_per_row(evaluators, build_dataset(1))
+    score_rows(build_dataset(1), metrics, workers=1)
+
+    failed = False
+    for size in args.rows:
+        rows = build_dataset(size)
+        expected, per_row_seconds = timed(score_per_row, evaluators, rows)
+        single, single_seconds = timed(score_rows, rows, metrics, workers=1, chunk_rows=size)
+        pooled, pooled_seconds = timed(score_rows, rows, metrics, workers=args.workers, chunk_rows=args.chunk_rows)
+        differences = max_differences(expected, single)
+        for column, difference in max_differences(expected, pooled).items():
+            differences[column] = max(differences[column], difference)
+        within_tolerance = all(difference <= args.tolerance for difference in differences.values())
+        failed = failed or not within_tolerance
+        report["sizes"].append({
+            "rows": size,
+            "per_row_s": round(per_row_seconds, 3),
+            "batch_s": round(single_seconds, 3),
+            "batch_pool_s": round(pooled_seconds, 3),
+            "speedup": round(per_row_seconds / single_seconds, 1),
+            "speedup_pool": round(per_row_seconds / pooled_seconds, 1),
+            "max_difference": differences,
+            "within_tolerance": within_tolerance,
+        })
+        print(f"{size} rows: per-row {per_row_seconds:.2f} s, batch {single_seconds:.2f} s "
+              f"({per_row_seconds / single_seconds:.1f}x), batch on {args.workers} workers {pooled_seconds:.2f} s "
+              f"({per_row_seconds / pooled_seconds:.1f}x), "
+              f"{'within' if within_tolerance else 'OUTSIDE'} tolerance", file=sys.stderr)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Wrote {args.output}", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
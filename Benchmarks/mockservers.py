@@ -0,0 +1,505 @@
+import re
+import sys
+import json
+import math
+import time
+import uuid
+import base64
+import random
+import hashlib
+import threading
+import functools
+from array import array
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency per endpoint: lognormal around median_ms with the given sigma, plus a 429 rate
+default_profile = {
+    "embeddings": {"median_ms": 25, "sigma": 0.3, "throttle_rate": 0.0},
+    "chat": {"median_ms": 400, "sigma": 0.4, "throttle_rate": 0.0, "token_ms": 15, "tokens": 60},
+    "cosmos": {"median_ms": 12, "sigma": 0.4, "throttle_rate": 0.0},
+    "agents": {"median_ms": 40, "sigma": 0.3, "throttle_rate": 0.0, "queued_ms": 150, "in_progress_ms": 800,
+               "tool_call_rate": 0.5},
+}
+
+# Documents returned by the mock Cosmos query
+corpus_size = 50
+
+
+class LatencyModel:
+    """
+    Samples service latency from a lognormal distribution and decides when to answer 429.
+    """
+
+    def __init__(self, median_ms=20, sigma=0.3, throttle_rate=0.0, **extra):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.throttle_rate = throttle_rate
+        self.extra = extra
+        self._random = random.Random()
+        self._lock = threading.Lock()
+
+    def sample(self):
+        with self._lock:
+            return self.median_ms * math.exp(self._random.gauss(0, self.sigma)) / 1000
+
+    def throttled(self):
+        with self._lock:
+            return self._random.random() < self.throttle_rate
+
+    def wait(self):
+        time.sleep(self.sample())
+
+
+@functools.lru_cache(maxsize=1024)
+def fake_embedding(text, dimensions=1536):
+    # Deterministic per text so caches and similarity behave like the real thing;
+    # memoized so the mock spends its time sleeping, not competing with the client for the GIL
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    generator = random.Random(seed)
+    vector = [generator.gauss(0, 1) for _ in range(dimensions)]
+    norm = math.sqrt(sum(value * value for value in vector))
+    return tuple(value / norm for value in vector)
+
+def fake_document(i):
+    return {"id": str(i), "title": f"Azure service {i}", "category": "Compute",
+            "content": f"Azure service {i} is a managed cloud service. " * 40}
+
+def now():
+    return int(time.time())
+
+
+class MockState:
+    """
+    Everything the mock services remember between requests: agents, threads, messages and runs.
+    """
+
+    def __init__(self, profile):
+        self.models = {name: LatencyModel(**settings) for name, settings in profile.items()}
+        self.agents = {}
+        self.threads = {}
+        self.runs = {}
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    Routes Azure OpenAI, Cosmos DB gateway and Agents requests to small in-memory fakes.
+    """
+
+    protocol_version = "HTTP/1.1"
+    agents_prefix = re.compile(r"^/agents/v1\.0/subscriptions/[^/]+/resourceGroups/[^/]+/providers/"
+                               r"Microsoft\.MachineLearningServices/workspaces/[^/]+")
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        body = self.rfile.read(length)
+        try:
+            return json.loads(body)
+        except ValueError:
+            return {}
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def throttle(self, service):
+        # Answer 429 with the retry hints each SDK understands
+        model = self.state.models[service]
+        if not model.throttled():
+            return False
+        self.state.count(f"{service}_429")
+        if service == "cosmos":
+            self.send_json(429, {"code": "TooManyRequests", "message": "Request rate is large"},
+                           {"x-ms-retry-after-ms": "50", "x-ms-substatus": "3200"})
+        else:
+            self.send_json(429, {"error": {"code": "429", "message": "Rate limit is exceeded"}},
+                           {"Retry-After": "0", "retry-after-ms": "50"})
+        return True
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_DELETE(self):
+        self.route("DELETE")
+
+    def route(self, method):
+        url = urlparse(self.path)
+        path = url.path.rstrip("/")
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self.read_body() if method == "POST" else {}
+
+        match = re.match(r"^/openai/deployments/([^/]+)/(embeddings|chat/completions)$", path)
+        if match:
+            if match.group(2) == "embeddings":
+                return self.embeddings(body)
+            return self.chat_completions(body)
+
+        match = self.agents_prefix.match(path)
+        if match:
+            return self.agents(method, path[match.end():], query, body)
+
+        return self.cosmos(method, path, body)
+
+    # Azure OpenAI
+
+    def embeddings(self, body):
+        self.state.count("embeddings")
+        if self.throttle("embeddings"):
+            return
+        self.state.models["embeddings"].wait()
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        dimensions = body.get("dimensions") or 1536
+        data = []
+        for i, text in enumerate(inputs):
+            embedding = fake_embedding(str(text), dimensions)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(array("f", embedding).tobytes()).decode("ascii")
+            data.append({"object": "embedding", "index": i, "embedding": list(embedding) if isinstance(embedding, tuple) else embedding})
+        tokens = sum(len(str(text).split()) for text in inputs)
+        self.send_json(200, {"object": "list", "data": data, "model": "text-embedding-3-small",
+                             "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    def chat_completions(self, body):
+        self.state.count("chat")
+        if self.throttle("chat"):
+            return
+        model = self.state.models["chat"]
+        tokens = model.extra.get("tokens", 60)
+        token_seconds = model.extra.get("token_ms", 15) / 1000
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in body.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": tokens, "total_tokens": prompt_tokens + tokens}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        if not body.get("stream"):
+            # Time to first token plus the time to generate the rest
+            time.sleep(model.sample() + tokens * token_seconds)
+            self.send_json(200, {"id": completion_id, "object": "chat.completion", "created": now(),
+                                 "model": "gpt-4o", "usage": usage,
+                                 "choices": [{"index": 0, "finish_reason": "stop",
+                                              "message": {"role": "assistant", "content": "token " * tokens}}]})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def chunk(choices, chunk_usage=None):
+            return json.dumps({"id": completion_id, "object": "chat.completion.chunk", "created": now(),
+                               "model": "gpt-4o", "choices": choices, "usage": chunk_usage})
+
+        model.wait()
+        for i in range(tokens):
+            send_event(chunk([{"index": 0, "delta": {"content": "token "}, "finish_reason": None}]))
+            time.sleep(token_seconds)
+        send_event(chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            send_event(chunk([], usage))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    # Cosmos DB gateway
+
+    def cosmos(self, method, path, body):
+        base = f"http://{self.headers.get('Host')}/"
+        if path == "":
+            location = [{"name": "Local", "databaseAccountEndpoint": base}]
+            return self.send_json(200, {
+                "id": "mock", "_rid": "mock", "_self": "", "media": "//media/", "addresses": "//addresses/",
+                "_dbs": "//dbs/", "writableLocations": location, "readableLocations": location,
+                "enableMultipleWriteLocations": False,
+                "userConsistencyPolicy": {"defaultConsistencyLevel": "Session"},
+                "userReplicationPolicy": {"asyncReplication": False, "minReplicaSetSize": 1, "maxReplicasetSize": 4},
+                "systemReplicationPolicy": {"minReplicaSetSize": 1, "maxReplicasetSize": 4},
+                "readPolicy": {"primaryReadCoefficient": 1, "secondaryReadCoefficient": 1},
+                "queryEngineConfiguration": json.dumps({"maxSqlQueryInputLength": 262144, "maxJoinsPerSqlQuery": 5,
+                                                        "maxLogicalAndPerSqlQuery": 500, "maxLogicalOrPerSqlQuery": 500,
+                                                        "maxUdfRefPerSqlQuery": 10, "maxInExpressionItemsCount": 16000,
+                                                        "queryMaxInMemorySortDocumentCount": 500,
+                                                        "maxQueryRequestTimeoutFraction": 0.9,
+                                                        "sqlAllowNonFiniteNumbers": False, "sqlAllowAggregateFunctions": True,
+                                                        "sqlAllowSubQuery": True, "sqlAllowScalarSubQuery": True,
+                                                        "allowNewKeywords": True, "sqlAllowLike": True,
+                                                        "sqlAllowGroupByClause": True, "maxSpatialQueryCells": 12,
+                                                        "spatialMaxGeometryPointCount": 256,
+                                                        "sqlDisableOptimizationFlags": 0,
+                                                        "sqlAllowTop": True, "enableSpatialIndexing": True})})
+
+        match = re.match(r"^/dbs/([^/]+)/colls/([^/]+)(?:/(pkranges|docs))?$", path)
+        if match is None:
+            return self.send_json(404, {"code": "NotFound", "message": path})
+        database, container, resource = match.groups()
+        container_rid = "mockcoll="
+        headers = {"x-ms-request-charge": "1.0", "x-ms-session-token": "0:1#1", "x-ms-activity-id": str(uuid.uuid4()),
+                   "x-ms-alt-content-path": f"dbs/{database}/colls/{container}", "x-ms-content-path": container_rid}
+
+        if resource is None:
+            return self.send_json(200, {"id": container, "_rid": container_rid, "_self": f"dbs/mockdb=/colls/{container_rid}/",
+                                        "partitionKey": {"paths": ["/id"], "kind": "Hash", "version": 2},
+                                        "_etag": "\"0\"", "_ts": now()}, headers)
+
+        if resource == "pkranges":
+            # The routing map is read as a change feed until it reports no changes
+            if self.headers.get("If-None-Match") == "\"1\"":
+                self.send_response(304)
+                self.send_header("etag", "\"1\"")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            return self.send_json(200, {"_rid": container_rid, "_count": 1, "PartitionKeyRanges": [
+                {"id": "0", "_rid": "mockrange=", "minInclusive": "", "maxExclusive": "FF", "ridPrefix": 0,
+                 "throughputFraction": 1.0, "status": "online", "parents": [], "_etag": "\"1\"", "_ts": now()}]},
+                dict(headers, etag="\"1\"", **{"x-ms-item-count": "1"}))
+
+        if self.headers.get("x-ms-cosmos-is-query-plan-request", "").lower() == "true":
+            # A pass-through plan: the query goes to the single partition range as is
+            return self.send_json(200, {"partitionedQueryExecutionInfoVersion": 2, "queryInfo": {
+                "distinctType": "None", "top": None, "offset": None, "limit": None, "orderBy": [],
+                "orderByExpressions": [], "groupByExpressions": [], "groupByAliases": [], "aggregates": [],
+                "groupByAliasToAggregateType": {}, "rewrittenQuery": "", "hasSelectValue": False,
+                "dCountInfo": None, "hasNonStreamingOrderBy": False},
+                "queryRanges": [{"min": "", "max": "FF", "isMinInclusive": True, "isMaxInclusive": False}]}, headers)
+
+        self.state.count("cosmos")
+        if self.throttle("cosmos"):
+            return
+        self.state.models["cosmos"].wait()
+        parameters = {parameter["name"]: parameter["value"] for parameter in body.get("parameters") or []}
+        num_results = int(parameters.get("@num_results") or 5)
+        documents = [fake_document(i) for i in random.sample(range(corpus_size), min(num_results, corpus_size))]
+        headers["x-ms-request-charge"] = f"{10 + 2.5 * num_results:.2f}"
+        headers["x-ms-item-count"] = str(len(documents))
+        return self.send_json(200, {"_rid": container_rid, "Documents": documents, "_count": len(documents)}, headers)
+
+    # Azure AI Agents
+
+    def agents(self, method, path, query, body):
+        self.state.count(f"agents_{method}")
+        if self.throttle("agents"):
+            return
+        model = self.state.models["agents"]
+        model.wait()
+        state = self.state
+
+        if path == "/assistants" and method == "POST":
+            agent = {"id": f"asst_{uuid.uuid4().hex[:24]}", "object": "assistant", "created_at": now(),
+                     "model": body.get("model"), "name": body.get("name"), "instructions": body.get("instructions"),
+                     "tools": body.get("tools") or [], "metadata": body.get("metadata") or {}}
+            with state.lock:
+                state.agents[agent["id"]] = agent
+            return self.send_json(200, agent)
+        if path == "/assistants" and method == "GET":
+            with state.lock:
+                agents = list(state.agents.values())
+            return self.send_json(200, self.page(agents, query))
+
+        match = re.match(r"^/assistants/([^/]+)$", path)
+        if match:
+            with state.lock:
+                agent = state.agents.get(match.group(1))
+                if agent is not None and method == "DELETE":
+                    del state.agents[agent["id"]]
+                    return self.send_json(200, {"id": agent["id"], "object": "assistant.deleted", "deleted": True})
+                if agent is not None and method == "POST":
+                    agent.update({key: value for key, value in body.items() if key in agent})
+            if agent is None:
+                return self.send_json(404, {"error": {"message": f"No assistant found with id '{match.group(1)}'."}})
+            return self.send_json(200, agent)
+
+        match = re.match(r"^/threads(?:/([^/]+))?(?:/(messages|runs))?(?:/([^/]+))?(?:/(submit_tool_outputs|cancel))?$", path)
+        if match is None:
+            return self.send_json(404, {"error": {"message": path}})
+        thread_id, collection, item_id, action = match.groups()
+
+        if thread_id is None:
+            thread = {"id": f"thread_{uuid.uuid4().hex[:24]}", "object": "thread", "created_at": now(),
+                      "metadata": {}, "tool_resources": {}}
+            with state.lock:
+                state.threads[thread["id"]] = []
+                for message in body.get("messages") or []:
+                    state.threads[thread["id"]].append(self.message(thread["id"], message["role"], message["content"]))
+            return self.send_json(200, thread)
+
+        with state.lock:
+            messages = state.threads.get(thread_id)
+        if messages is None:
+            return self.send_json(404, {"error": {"message": f"No thread found with id '{thread_id}'."}})
+
+        if collection is None:
+            if method == "DELETE":
+                with state.lock:
+                    state.threads.pop(thread_id, None)
+                return self.send_json(200, {"id": thread_id, "object": "thread.deleted", "deleted": True})
+            return self.send_json(200, {"id": thread_id, "object": "thread", "created_at": now(), "metadata": {}})
+
+        if collection == "messages":
+            if method == "POST":
+                message = self.message(thread_id, body.get("role", "user"), body.get("content", ""))
+                with state.lock:
+                    messages.append(message)
+                return self.send_json(200, message)
+            with state.lock:
+                items = list(messages)
+            if query.get("order") != "asc":
+                items.reverse()
+            return self.send_json(200, self.page(items, query))
+
+        if item_id is None:
+            run = {"id": f"run_{uuid.uuid4().hex[:24]}", "object": "thread.run", "thread_id": thread_id,
+                   "assistant_id": body.get("assistant_id"), "status": "queued", "created_at": now(),
+                   "required_action": None, "last_error": None, "usage": None,
+                   "_started": time.monotonic(), "_tool_call": random.random() < model.extra.get("tool_call_rate", 0),
+                   "_submitted": None}
+            with state.lock:
+                state.runs[run["id"]] = run
+            return self.send_json(200, self.public_run(run))
+
+        with state.lock:
+            run = state.runs.get(item_id)
+        if run is None:
+            return self.send_json(404, {"error": {"message": f"No run found with id '{item_id}'."}})
+
+        with state.lock:
+            if action == "submit_tool_outputs":
+                run["_submitted"] = time.monotonic()
+                run["required_action"] = None
+                run["status"] = "in_progress"
+            elif action == "cancel":
+                run["status"] = "cancelled"
+            self.advance(run, messages)
+            public = self.public_run(run)
+        return self.send_json(200, public)
+
+    def advance(self, run, messages):
+        # Called with the state lock held: move the run along its status timeline
+        if run["status"] in ("completed", "cancelled", "failed", "expired"):
+            return
+        model = self.state.models["agents"]
+        elapsed = (time.monotonic() - run["_started"]) * 1000
+        queued_ms = model.extra.get("queued_ms", 150)
+        in_progress_ms = model.extra.get("in_progress_ms", 800)
+        if elapsed < queued_ms:
+            run["status"] = "queued"
+            return
+        if run["_tool_call"] and run["_submitted"] is None:
+            if elapsed < queued_ms + in_progress_ms / 2:
+                run["status"] = "in_progress"
+                return
+            run["status"] = "requires_action"
+            run["required_action"] = {"type": "submit_tool_outputs", "submit_tool_outputs": {"tool_calls": [
+                {"id": f"call_{run['id'][-8:]}", "type": "function",
+                 "function": {"name": "fetch_weather", "arguments": json.dumps({"location": "London"})}}]}}
+            return
+        if run["_submitted"] is not None and (time.monotonic() - run["_submitted"]) * 1000 < in_progress_ms / 2:
+            run["status"] = "in_progress"
+            return
+        if run["_submitted"] is None and elapsed < queued_ms + in_progress_ms:
+            run["status"] = "in_progress"
+            return
+        run["status"] = "completed"
+        run["usage"] = {"prompt_tokens": 500, "completion_tokens": 60, "total_tokens": 560}
+        # Quote the message being answered so a client can tell whose thread the reply came from
+        question = next((message["content"][0]["text"]["value"] for message in reversed(messages)
+                         if message["role"] == "user"), "")
+        messages.append(self.message(run["thread_id"], "assistant", f"Reply to: {question}\n" + "token " * 60, run["id"]))
+
+    def public_run(self, run):
+        return {key: value for key, value in run.items() if not key.startswith("_")}
+
+    def message(self, thread_id, role, content, run_id=None):
+        return {"id": f"msg_{uuid.uuid4().hex[:24]}", "object": "thread.message", "created_at": now(),
+                "thread_id": thread_id, "role": role, "run_id": run_id, "status": "completed",
+                "content": [{"type": "text", "text": {"value": content, "annotations": []}}], "metadata": {}}
+
+    def page(self, items, query):
+        after = query.get("after")
+        if after:
+            ids = [item["id"] for item in items]
+            items = items[ids.index(after) + 1:] if after in ids else []
+        limit = int(query.get("limit") or 20)
+        data = items[:limit]
+        return {"object": "list", "data": data, "first_id": data[0]["id"] if data else None,
+                "last_id": data[-1]["id"] if data else None, "has_more": len(items) > limit}
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that exit mid-request (e.g. a worker process shutting down) aren't an error here
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockServer:
+    """
+    A local HTTP server standing in for Azure OpenAI, Cosmos DB and Agents.
+
+    Every endpoint sleeps for a latency drawn from its profile entry and
+    answers 429 at the profile's throttle rate. ``counts`` tracks requests
+    and injected 429s per service.
+    """
+
+    def __init__(self, profile=None, port=0):
+        settings = {name: dict(values) for name, values in default_profile.items()}
+        for name, values in (profile or {}).items():
+            settings.setdefault(name, {}).update(values)
+        self.profile = settings
+        self.server = QuietHTTPServer(("127.0.0.1", port), MockHandler)
+        self.server.state = MockState(settings)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def counts(self):
+        return dict(self.server.state.counts)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-azure", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
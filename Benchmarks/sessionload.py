@@ -0,0 +1,121 @@
+"""
+Load test for concurrent chat sessions across one or more worker processes.
+
+Each worker process builds the shared objects once, the way an app worker
+does at import (project client, agent registry, thread pool), then runs its
+share of simulated users concurrently on one event loop. Every user opens a
+ChatSession, sends a few messages and closes it. The mock agent quotes the
+message it answers, so each reply is checked against the session that sent
+it. The report shows latency per session count and whether any session
+received another one's reply, shared a thread, or used a different agent.
+
+    python Benchmarks/sessionload.py --workers 2 --sessions 1 8 32 --turns 3
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import multiprocessing
+from mockservers import MockServer
+from benchmark import configure_environment, MockCredential, MockAuthenticationPolicy, percentile
+
+
+async def simulate_user(project_client, thread_pool, agent_id, name, turns, results):
+    from azure.ai.projects.models import FunctionTool
+    from history import message_text
+    from sessions import ChatSession
+
+    functions = FunctionTool(set())
+    session = await ChatSession.start(thread_pool, agent_id)
+    results["threads"][name] = session.thread_id
+    try:
+        for turn in range(turns):
+            user_input = f"{name} turn {turn}"
+            start = time.perf_counter()
+            # The same steps as on_message with AGENT_STREAMING=false
+            async with session.lock:
+                run, reply = await session.run_turn(project_client, user_input, functions)
+                await session.compact(project_client)
+            results["latencies"].append((time.perf_counter() - start) * 1000)
+            if reply is None or not message_text(reply).startswith(f"Reply to: {user_input}\n"):
+                results["mismatched"].append({"session": name, "turn": turn,
+                                              "reply": message_text(reply)[:80] if reply else None})
+    finally:
+        session.end()
+
+def run_worker(server_url, worker, sessions, turns):
+    """
+    Runs ``sessions`` simulated users in one process and returns what they observed.
+    """
+    configure_environment(server_url, warm_caches=True)
+    from azure.ai.projects import AIProjectClient
+    from agentpool import AgentRegistry, ThreadPool
+
+    # Built once per worker and shared by all of its sessions
+    project_client = AIProjectClient(endpoint=server_url, subscription_id="benchmark",
+                                     resource_group_name="benchmark", project_name="benchmark",
+                                     credential=MockCredential(), authentication_policy=MockAuthenticationPolicy())
+    agent = AgentRegistry(project_client).get_or_create(model="gpt-4o", name="loadtest-agent",
+                                                        instructions="You are an AI Travel Agent.")
+    thread_pool = ThreadPool(project_client, size=max(sessions, 1))
+    thread_pool.fill()
+
+    results = {"agent_id": agent.id, "threads": {}, "latencies": [], "mismatched": []}
+
+    async def main():
+        await asyncio.gather(*(simulate_user(project_client, thread_pool, agent.id, f"w{worker}s{i}", turns, results)
+                               for i in range(sessions)))
+
+    asyncio.run(main())
+    return results
+
+def run_level(server_url, workers, sessions, turns):
+    shares = [sessions // workers + (1 if i < sessions % workers else 0) for i in range(workers)]
+    start = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        outputs = pool.starmap(run_worker, [(server_url, i, share, turns) for i, share in enumerate(shares) if share])
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for output in outputs for latency in output["latencies"])
+    threads = [thread_id for output in outputs for thread_id in output["threads"].values()]
+    return {
+        "sessions": sessions,
+        "workers": workers,
+        "turns": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "turn_latency_ms": {"p50": percentile(latencies, 0.50), "p95": percentile(latencies, 0.95),
+                            "p99": percentile(latencies, 0.99)},
+        "isolation": {
+            "mismatched_replies": [mismatch for output in outputs for mismatch in output["mismatched"]],
+            "shared_threads": len(threads) - len(set(threads)),
+            "agents": sorted({output["agent_id"] for output in outputs}),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--sessions", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--turns", type=int, default=3, help="Messages each simulated user sends")
+    parser.add_argument("--output", default="sessionload.json")
+    args = parser.parse_args()
+
+    report = {"settings": {"workers": args.workers, "sessions": args.sessions, "turns": args.turns}, "levels": []}
+    with MockServer({"agents": {"tool_call_rate": 0.0}}) as server:
+        for sessions in args.sessions:
+            level = run_level(server.url, args.workers, sessions, args.turns)
+            report["levels"].append(level)
+            isolation = level["isolation"]
+            print(f"{sessions} sessions on {args.workers} workers: p50 {level['turn_latency_ms']['p50']} ms, "
+                  f"p95 {level['turn_latency_ms']['p95']} ms, {len(isolation['mismatched_replies'])} mismatched replies, "
+                  f"{isolation['shared_threads']} shared threads, {len(isolation['agents'])} agent(s)", file=sys.stderr)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()